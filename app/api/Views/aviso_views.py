@@ -0,0 +1,52 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.authentication import TokenAuthentication
+from rest_framework import permissions
+from rest_framework import status
+from avisos.models import markAvisosChecked
+from profiles.models import Profile
+from api.constants import SerializerContextKey
+from api.utils import getTokenFromHeader, getUserByToken
+
+
+class AvisoCheckAllAPIView(APIView):
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """機能
+        未読のAvisoをまとめて既読にする(1回のUPDATE)。
+        content_type(通知対象のモデル名), item(記事のid)を指定した場合はそのAvisoのみ既読にする。
+
+        endpoint: /api/avisos/check/
+        name: -
+
+        Returns:
+            {"AVISO_COUNT": 更新後の未読数, "CHECKED_COUNT": 既読にした数}
+        """
+        """テスト項目
+        済 指定なしの場合は全ての未読のAvisoが既読になり、AVISO_COUNTが0になる
+        済 content_type, itemを指定した場合はそのAvisoのみ既読になる
+        済 不正なcontent_typeの場合は400が返る
+        """
+        user_obj = getUserByToken(getTokenFromHeader(self))
+        profile_obj = Profile.objects.filter(user=user_obj).first()
+        if profile_obj is None:
+            return Response({"result": "fail"}, status=status.HTTP_400_BAD_REQUEST)
+
+        content_type_model = request.data.get("content_type") or None
+        item_id = request.data.get("item") or None
+        try:
+            item_id = int(item_id) if item_id is not None else None
+            checked_count, aviso_count = markAvisosChecked(profile_obj, content_type_model, item_id)
+        except (TypeError, ValueError) as e:
+            return Response({"result": "fail", "detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            SerializerContextKey.AVISO_COUNT: aviso_count,
+            SerializerContextKey.CHECKED_COUNT: checked_count,
+        })
+
+    def patch(self, request, *args, **kwargs):
+        return self.post(request, *args, **kwargs)
@@ -0,0 +1,92 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.authentication import TokenAuthentication
+from rest_framework import permissions
+from rest_framework import status
+from direct_messages.inbox import DirectMessageInbox, markDirectMessageRead
+from direct_messages.models import DirectMessage
+from profiles.models import Profile
+from api.constants import SerializerContextKey
+from api.pagination import DirectMessageInboxPagination
+from api.serializers import DirectMessageThreadSerializer
+from api.utils import getTokenFromHeader, getUserByToken
+
+
+class DirectMessageInboxAPIView(APIView):
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request, *args, **kwargs):
+        """機能
+        ユーザーの会話(DirectMessage)を最後のメッセージの新しい順に返す。
+        1ページ分を1つのSQLで取得する(direct_messages/inbox.py 参照)。
+
+        endpoint: /api/direct_messages/inbox/?page_size=20&cursor=...
+        name: -
+
+        Returns:
+            DM_THREADS: 会話のリスト(記事のタイトル、相手、最後のメッセージ、未読数)
+            NEXT_CURSOR: 次のページのcursor(最後のページの場合はNone)
+        """
+        """テスト項目
+        済 自分が参加している会話のみが最後のメッセージの新しい順に返る
+        済 最後のメッセージの抜粋、相手、未読数が返る
+        済 page_sizeを指定するとページ分割され、NEXT_CURSORで次のページを取得できる
+        済 会話の数に関わらず発行されるクエリの数は一定である
+        """
+        user_obj = getUserByToken(getTokenFromHeader(self))
+        profile_obj = Profile.objects.filter(user=user_obj).first()
+        if profile_obj is None:
+            return Response({"result": "fail"}, status=status.HTTP_400_BAD_REQUEST)
+
+        rows, next_cursor = DirectMessageInboxPagination(request).paginateInbox(DirectMessageInbox(profile_obj))
+        serializerContext = {}
+        serializerContext[SerializerContextKey.DM_THREADS] = DirectMessageThreadSerializer(
+            rows, many=True, context={"request": request}).data
+        serializerContext[SerializerContextKey.NEXT_CURSOR] = next_cursor
+        return Response(serializerContext)
+
+
+class DirectMessageReadAPIView(APIView):
+
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        """機能
+        会話(DirectMessage)の自分のlast_read_message_idをmessage_idまで進める。
+        message_idを指定しない場合は会話の最新のメッセージまで読んだことにする。
+
+        endpoint: /api/direct_messages/<int:pk>/read/
+        name: -
+
+        Returns:
+            LAST_READ_MESSAGE_ID: 更新後のlast_read_message_id
+            UNREAD_COUNT: 会話の未読数
+        """
+        """テスト項目
+        済 message_idまで既読になり、未読数はそれより新しい相手のメッセージの数になる
+        済 古いmessage_idを指定してもlast_read_message_idは戻らない
+        済 全て既読にすると会話のAvisoも既読になる
+        済 会話の参加者でない場合は403が返る
+        """
+        user_obj = getUserByToken(getTokenFromHeader(self))
+        profile_obj = Profile.objects.filter(user=user_obj).first()
+        dm_obj = DirectMessage.objects.filter(id=self.kwargs["pk"]).first()
+        if dm_obj is None:
+            return Response({"result": "fail"}, status=status.HTTP_404_NOT_FOUND)
+        if profile_obj is None or profile_obj.id not in (dm_obj.owner_id, dm_obj.participant_id):
+            return Response({"result": "fail"}, status=status.HTTP_403_FORBIDDEN)
+
+        message_id = request.data.get("message_id")
+        try:
+            message_id = int(message_id) if message_id not in (None, "") else None
+            last_read_message_id, unread_count = markDirectMessageRead(dm_obj, profile_obj, message_id)
+        except (TypeError, ValueError) as e:
+            return Response({"result": "fail", "detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            SerializerContextKey.LAST_READ_MESSAGE_ID: last_read_message_id,
+            SerializerContextKey.UNREAD_COUNT: unread_count,
+        })
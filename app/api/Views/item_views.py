@@ -8,8 +8,7 @@ from rest_framework import parsers
 import json
 from django.shortcuts import redirect
 from django.contrib.auth.models import User
-from django.db.models import Q
-from categories.models      import Category
+from categories.models      import Category, CATEGORY_GROUPS
 from direct_messages.models import DirectMessage
 from direct_messages.models import DirectMessageContent
 from favorite.models        import Favorite
@@ -20,7 +19,17 @@ from solicitudes.models     import Solicitud
 from api.constants import SerializerContextKey
 from api.constants import BtnChoice
 from api.constants import CategoryValue
+from api.constants import ItemListViewMode
+from api.pagination import ItemKeysetPagination
+from api.querysets import getItemSummaryValues
+from api.querysets import prefetchForItemSerializer
+from api.querysets import prefetchForNormalizedItemSerializer
+from api.serializers import IncludedProfiles
 from api.serializers import ItemSerializer
+from api.serializers import ItemSummarySerializer
+from items.home_feed import HOME_FEED_MAX_CACHED_ITEMS, home_feed_cache
+from items.search import ItemSearch
+from items.viewer_state import resolveItemViewerState
 from api.serializers import ProfileSerializer
 from api.serializers import SolicitudSerializer
 from api.serializers import ItemContactSerializer
@@ -29,6 +38,78 @@ from api.utils import getTokenFromHeader
 from api.utils import getUserByToken, getItemDetailUrl
 
 
+def serializeItemObjects(request, queryset):
+    """機能
+    記事一覧のquerysetをシリアライズする。
+    ?view=summaryが指定された場合はカード表示用のItemSummarySerializer、それ以外はItemSerializerで出力する。
+
+    Args:
+        request: Request
+        queryset: ItemのQuerySet(prefetchForItemSerializerは不要)
+    Returns:
+        ReturnList
+    """
+    if request.query_params.get(ItemListViewMode.QUERY_PARAM) == ItemListViewMode.SUMMARY:
+        serializer = ItemSummarySerializer(getItemSummaryValues(queryset), many=True)
+        return serializer.data
+    serializer = ItemSerializer(prefetchForItemSerializer(queryset), many=True)
+    return serializer.data
+
+
+def serializeHomeBucket(view_mode, queryset):
+    """機能
+    ホーム画面のカテゴリーグループごとの記事一覧を、home_feed_cacheに保存する値にする。
+    summaryはItemSummarySerializerの出力(記事の列と件数のみで、Profileを含まない)を保存する。
+    fullはItemSerializerがProfileやメッセージを埋め込むので、記事のidのみを保存し、出力はリクエストごとに
+    serializeHomeItemIds()で行う。そのためProfileの編集やメッセージの送信でキャッシュを無効にする必要がない。
+    requestを渡さないので、画像のURLはホストを含まない相対URLになる。
+
+    Args:
+        view_mode: "full" または ItemListViewMode.SUMMARY
+        queryset: ItemのQuerySet(prefetchForItemSerializerは不要)
+    Returns:
+        ReturnList (summary) または 記事のidのリスト (full)
+    """
+    if view_mode == ItemListViewMode.SUMMARY:
+        return ItemSummarySerializer(getItemSummaryValues(queryset), many=True).data
+    return list(queryset.values_list("id", flat=True))
+
+
+def serializeHomeItemIds(item_ids):
+    """機能
+    serializeHomeBucket()で保存した記事のidをItemSerializerで出力する(キャッシュと同じ順序)
+    """
+    if len(item_ids) == 0:
+        return []
+    queryset = Item.objects.filter(id__in=item_ids).order_by("-created_at", "-id")
+    return ItemSerializer(prefetchForItemSerializer(queryset), many=True).data
+
+
+def setItemObjectsToContext(request, serializerContext, queryset):
+    """機能
+    serializerContext[SerializerContextKey.ITEM_OBJECTS]に記事一覧を設定する。
+    ?view=normalizedが指定された場合は、埋め込まれたProfileをidのみで出力し、
+    ProfileはserializerContext[SerializerContextKey.INCLUDED]に1回のクエリでまとめて出力する。
+    それ以外はserializeItemObjects()で出力する。
+
+    Args:
+        request: Request
+        serializerContext: dict
+        queryset: ItemのQuerySet(prefetchは不要)
+    Returns:
+        dict: serializerContext
+    """
+    if IncludedProfiles.isRequested(request):
+        included_profiles = IncludedProfiles()
+        serializer = ItemSerializer(
+            prefetchForNormalizedItemSerializer(queryset), many=True, context=included_profiles.getContext())
+        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data
+        serializerContext[SerializerContextKey.INCLUDED] = included_profiles.serialize()
+        return serializerContext
+    serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializeItemObjects(request, queryset)
+    return serializerContext
+
+
 class ItemListAPIView(APIView):
     """
     endpoint: 'items/list/'
@@ -38,9 +119,11 @@ class ItemListAPIView(APIView):
 
     def get(self, request, *args, **kwargs):
         serializerContext = {}
-        item_objects = Item.objects.all().exclude(active=False).order_by("-created_at")
-        serializer = ItemSerializer(item_objects, many=True)
-        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data
+        item_objects = Item.objects.all().filter(active=True).order_by("-created_at")
+        pagination = ItemKeysetPagination(request)
+        if pagination.isRequested():
+            item_objects, serializerContext[SerializerContextKey.NEXT_CURSOR] = pagination.paginateQueryset(item_objects)
+        setItemObjectsToContext(request, serializerContext, item_objects)
         return Response(serializerContext)
 
 
@@ -51,33 +134,42 @@ class ItemHomeListAPIView(APIView):
     """
     def get(self, request, *args, **kwargs):
         serializerContext = {}
-        # las cosas
-        # item_objects_cosas = Item.objects.filter(category__number="1").filter(category__number="2").filter(category__number="3").order_by("-created_at")
-        item_objects_cosas = Item.objects.filter(Q(category__number="1")|Q(category__number="2")|Q(category__number="3")).exclude(active=False).order_by("-id")
-        serializer_cosas = ItemSerializer(item_objects_cosas, many=True)
-
-        item_objects_habitacion = Item.objects.filter(Q(category__number="4")|Q(category__number="5")|Q(category__number="6")|Q(category__number="7")).exclude(active=False).order_by("-id")
-        serializer_habitacion = ItemSerializer(
-            item_objects_habitacion,
-            many=True
-            )
-
-        item_objects_trabajo = Item.objects.filter(Q(category__number="8")|Q(category__number="9")).exclude(active=False).order_by("-id")
-        serializer_trabajo = ItemSerializer(
-            item_objects_trabajo,
-            many=True
-            )
-
-        item_objects_tienda = Item.objects.filter(category__number="10").exclude(active=False).order_by("-id")
-        serializer_tienda = ItemSerializer(
-            item_objects_tienda,
-            many=True
-            )
-
-        serializerContext[SerializerContextKey.ITEM_OBJECTS_COSAS] = serializer_cosas.data
-        serializerContext[SerializerContextKey.ITEM_OBJECTS_HABITACION] = serializer_habitacion.data
-        serializerContext[SerializerContextKey.ITEM_OBJECTS_TRABAJO] = serializer_trabajo.data
-        serializerContext[SerializerContextKey.ITEM_OBJECTS_TIENDA] = serializer_tienda.data
+        pagination = ItemKeysetPagination(request)
+        view_mode = "full"
+        if request.query_params.get(ItemListViewMode.QUERY_PARAM) == ItemListViewMode.SUMMARY:
+            view_mode = ItemListViewMode.SUMMARY
+        if pagination.isRequested():
+            # page_sizeが指定された場合は各カテゴリーの1ページ目のみ返す。続きは ItemCategoryListAPIView(500~800)のcursorで取得する
+            variant = "api:{}:{}".format(view_mode, pagination.page_size)
+        else:
+            variant = "api:{}:all".format(view_mode)
+
+        def buildBucket(category_group):
+            item_objects = Item.objects.filter(category_group=category_group, active=True).order_by("-created_at", "-id")
+            next_cursor = None
+            if pagination.isRequested():
+                item_objects, next_cursor = pagination.paginateQueryset(item_objects, first_page=True)
+            # キャッシュは全てのリクエストで共有するので、requestのホストに依存するURL(build_absolute_uri)を含めない
+            return serializeHomeBucket(view_mode, item_objects), next_cursor
+
+        if pagination.isRequested() or view_mode != ItemListViewMode.SUMMARY:
+            # 1ページ分(page_sizeはMAX_PAGE_SIZEまで)、またはidのみなので大きさに上限がある
+            buckets = home_feed_cache.getBuckets(variant, buildBucket)
+        else:
+            # ページ分割しないsummaryは記事数がHOME_FEED_MAX_CACHED_ITEMS以下のグループのみキャッシュする
+            buckets = home_feed_cache.getBuckets(
+                variant, buildBucket, cacheable=lambda bucket: len(bucket[0]) <= HOME_FEED_MAX_CACHED_ITEMS)
+
+        for group, objectsKey, cursorKey in (
+                ("cosas", SerializerContextKey.ITEM_OBJECTS_COSAS, SerializerContextKey.NEXT_CURSOR_COSAS),
+                ("habitacion", SerializerContextKey.ITEM_OBJECTS_HABITACION, SerializerContextKey.NEXT_CURSOR_HABITACION),
+                ("trabajo", SerializerContextKey.ITEM_OBJECTS_TRABAJO, SerializerContextKey.NEXT_CURSOR_TRABAJO),
+                ("tienda", SerializerContextKey.ITEM_OBJECTS_TIENDA, SerializerContextKey.NEXT_CURSOR_TIENDA)):
+            serializerContext[objectsKey], next_cursor = buckets[group]
+            if view_mode != ItemListViewMode.SUMMARY:
+                serializerContext[objectsKey] = serializeHomeItemIds(serializerContext[objectsKey])
+            if pagination.isRequested():
+                serializerContext[cursorKey] = next_cursor
         return Response(serializerContext)
 
 
@@ -94,44 +186,19 @@ class ItemCategoryListAPIView(APIView):
         category_number = self.kwargs["pk"]    
         if category_number == 999:
             return redirect('api:item_home_list')
-        elif category_number == 500:
-            # 500 --- Las Cosas...(1,2,3) dar o donar, busca donante, quiere avisarのカテゴリを一括にしたもの / categories.models.py 参照すること
-            itemObjects = Item.objects.filter(Q(category__number="1")|Q(category__number="2")|Q(category__number="3")).exclude(active=False).order_by("-id")
-            serializer = ItemSerializer(itemObjects, many=True)
-            serializerContext = {}
-            serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data 
-            return Response(serializerContext)
-
-        elif category_number == 600:
-            # 600 --- Habitacion...(4,5,6,7) buscar habitacion, alquilar habitacion, dar pencionado, busco pencionista
-            itemObjects = Item.objects.filter(Q(category__number="4")|Q(category__number="5")|Q(category__number="6")|Q(category__number="7")).exclude(active=False).order_by("-id")
-            serializer = ItemSerializer(itemObjects, many=True)
-            serializerContext = {}
-            serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data 
-            return Response(serializerContext)
-
-        elif category_number == 700:
-            # 700 --- trabajo ...(8,9) buscar empleo, buscar trabajador
-            itemObjects = Item.objects.filter(Q(category__number="8")|Q(category__number="9")).exclude(active=False).order_by("-id")
-            serializer = ItemSerializer(itemObjects, many=True) 
-            serializerContext = {}
-            serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data 
-            return Response(serializerContext)
-
-        elif category_number == 800:
-            # 800 ___ Empresas y Servicios ...(10) publicidad de Enpresas y Servicios
-            itemObjects = Item.objects.filter(category__number="10").exclude(active=False).order_by("-id")
-            serializer = ItemSerializer(itemObjects, many=True) 
-            serializerContext = {}
-            serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data 
-            return Response(serializerContext)
+        elif category_number in CATEGORY_GROUPS:
+            # 500 --- Las Cosas...(1,2,3), 600 --- Habitacion...(4,5,6,7), 700 --- trabajo ...(8,9), 800 ___ Empresas y Servicios ...(10)
+            # グループの一覧 / categories/models.py 参照すること
+            itemObjects = Item.objects.filter(category_group=category_number, active=True).order_by("-created_at", "-id")
+        else:
+            categoryObj = Category.objects.get(number=category_number)
+            itemObjects = Item.objects.filter(category=categoryObj).filter(active=True).order_by("-created_at")
 
-        # print(category_number)
-        categoryObj = Category.objects.get(number=category_number)
-        itemObjects = Item.objects.filter(category=categoryObj).exclude(active=False).exclude(active=False).order_by("-created_at")
-        serializer = ItemSerializer(itemObjects, many=True)
         serializerContext = {}
-        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data
+        pagination = ItemKeysetPagination(request)
+        if pagination.isRequested():
+            itemObjects, serializerContext[SerializerContextKey.NEXT_CURSOR] = pagination.paginateQueryset(itemObjects)
+        setItemObjectsToContext(request, serializerContext, itemObjects)
         return Response(serializerContext)
 
 
@@ -154,11 +221,17 @@ class ItemCategoryLocalListAPIView(APIView):
 
         category_number = self.kwargs["pk"]
         # print(category_number)
-        categoryObj = Category.objects.get(number=category_number)
-        itemObjects = Item.objects.filter(category=categoryObj).filter(adm1=profileObj.adm1).exclude(active=False).order_by("-created_at")
-        serializer = ItemSerializer(itemObjects, many=True)
+        if category_number in CATEGORY_GROUPS:
+            itemObjects = Item.objects.filter(category_group=category_number)
+        else:
+            categoryObj = Category.objects.get(number=category_number)
+            itemObjects = Item.objects.filter(category=categoryObj)
+        itemObjects = itemObjects.filter(adm1=profileObj.adm1).filter(active=True).order_by("-created_at")
         serializerContext = {}
-        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data 
+        pagination = ItemKeysetPagination(request)
+        if pagination.isRequested():
+            itemObjects, serializerContext[SerializerContextKey.NEXT_CURSOR] = pagination.paginateQueryset(itemObjects)
+        setItemObjectsToContext(request, serializerContext, itemObjects)
         return Response(serializerContext)
 
 
@@ -177,17 +250,49 @@ class ItemFavoriteListAPIVIiew(APIView):
         if requestUser is None:
             return Response({"result": "fail"})
 
-        favItemObjects = Item.objects.filter(favorite_users=requestUser).exclude(active=False)
-        serializer = ItemSerializer(favItemObjects, many=True)
+        favItemObjects = Item.objects.filter(favorite_users=requestUser).filter(active=True)
 
         # serializerContextに表示するデータを格納
         serializerContext = {}
-        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data
+        setItemObjectsToContext(request, serializerContext, favItemObjects)
 
         # 成功した場合のレスポンスを返す
         return Response(serializerContext)
 
 
+class ItemSearchAPIView(APIView):
+    """
+    endpoint: 'api/items/search/'
+    name: 'api:item_search'
+
+    クエリパラメータ
+        q: 検索キーワード
+        category: カテゴリー番号またはグループ(500~800)
+        adm1: Departamento
+        page: ページ番号(1から)
+        page_size: 1ページの記事数(ItemKeysetPagination.MAX_PAGE_SIZEまで)
+        view: summaryを指定した場合はカード表示用のデータを返す
+              normalizedを指定した場合はProfileをidのみで出力し、INCLUDEDにまとめて返す
+    """
+    authentication_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        try:
+            page = max(int(params.get("page", 1)), 1)
+        except ValueError:
+            page = 1
+        page_size = ItemKeysetPagination(request).page_size
+
+        item_search = ItemSearch(params.get("q"), category=params.get("category"), adm1=params.get("adm1"))
+        item_objects, next_page = item_search.getPage(page=page, page_size=page_size)
+
+        serializerContext = {}
+        setItemObjectsToContext(request, serializerContext, item_objects)
+        serializerContext[SerializerContextKey.NEXT_PAGE] = next_page
+        return Response(serializerContext)
+
+
 class ItemDetailSerializerAPIView(APIView):
 
     authentication_classes = ()
@@ -223,6 +328,9 @@ class ItemDetailSerializerAPIView(APIView):
         item_obj, profile_obj, solicitudes_objects, direct_messages_objects
         ItemContactに関しては最新の５コメントしか表示しない仕様である。
 
+        ?view=normalizedを指定した場合はProfileをidのみで出力し(profile_obj_serializerは出品者のProfileのid)、
+        Profileの内容はSerializerContextKey.INCLUDEDにまとめて返す。
+
         """
         """テスト項目
         済 ItemオブジェクトがResponseとして返される
@@ -233,49 +341,30 @@ class ItemDetailSerializerAPIView(APIView):
         """
 
         pk = self.kwargs["pk"]
-        item_obj = Item.objects.get(id=pk)
-        item_obj_serializer = ItemSerializer(item_obj)
-        user_obj = item_obj.user
-        profile_obj = Profile.objects.get(user=item_obj.user)
-        profile_obj_serializer = ProfileSerializer(profile_obj)
-        solicitudes_objects = item_obj.solicitudes.all()
-        solicitudSerializer = SolicitudSerializer(solicitudes_objects, many=True)        
-        item_contact_objects = item_obj.item_contacts.all().order_by("-timestamp")[:5]
-        item_contact_objects_serializer = ItemContactSerializer(item_contact_objects, many=True)
-        direct_messages_objects = DirectMessage.objects.filter(item=item_obj)
+        token = getTokenFromHeader(self)
+        accessUser = getUserByToken(token)
 
         # 共通のデータをserializer_contextに格納する
         serializer_context = {}
-        serializer_context["item_obj_serializer"] = item_obj_serializer.data
-        serializer_context["profile_obj_serializer"] = profile_obj_serializer.data
 
-        token = getTokenFromHeader(self)
-        accessUser = getUserByToken(token)
+        # 閲覧者と記事の関係、出品者の評価をまとめて取得する (items/viewer_state.py)
+        if IncludedProfiles.isRequested(request):
+            # ?view=normalizedの場合、出品者を含むProfileはidのみを出力し、INCLUDEDにまとめて出力する
+            included_profiles = IncludedProfiles()
+            state = resolveItemViewerState(pk, accessUser, prefetchForNormalizedItemSerializer(Item.objects.all()))
+            item_obj_serializer = ItemSerializer(state.item_obj, context=included_profiles.getContext())
+            serializer_context["item_obj_serializer"] = item_obj_serializer.data
+            serializer_context["profile_obj_serializer"] = included_profiles.add(state.seller_profile_obj.id)
+            serializer_context[SerializerContextKey.INCLUDED] = included_profiles.serialize()
+        else:
+            state = resolveItemViewerState(pk, accessUser, prefetchForItemSerializer(Item.objects.all()))
+            item_obj_serializer = ItemSerializer(state.item_obj)
+            profile_obj_serializer = ProfileSerializer(state.seller_profile_obj)
+            serializer_context["item_obj_serializer"] = item_obj_serializer.data
+            serializer_context["profile_obj_serializer"] = profile_obj_serializer.data
 
         # serializer_context[SerializerContextKey.BTN_CHOICE]を設定
-        if accessUser == None:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.ANONYMOUS_USER_ACCESS
-
-        elif accessUser == user_obj and solicitudes_objects.count() == 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.NO_SOLICITUDES
-
-        elif accessUser == user_obj and solicitudes_objects.count() != 0 and direct_messages_objects.count() == 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.SELECT_SOLICITUDES
-
-        elif accessUser == user_obj and direct_messages_objects.count() != 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.GO_TRANSACTION
-
-        elif accessUser != user_obj and solicitudes_objects.filter(applicant=Profile.objects.get(user=accessUser)).count() == 0 and direct_messages_objects.filter(item=item_obj).count() == 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.SOLICITAR
-
-        elif accessUser != user_obj and solicitudes_objects.filter(applicant=Profile.objects.get(user=accessUser)).count() != 0 and direct_messages_objects.count() == 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.SOLICITADO
-
-        elif accessUser != user_obj and direct_messages_objects.filter(participant=Profile.objects.get(user=accessUser)).count() == 1:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.GO_TRANSACTION
-
-        elif accessUser != user_obj and direct_messages_objects.filter(participant=Profile.objects.get(user=accessUser)).count() == 0:
-            serializer_context[SerializerContextKey.BTN_CHOICE] = BtnChoice.CANNOT_TRANSACTION
+        serializer_context[SerializerContextKey.BTN_CHOICE] = state.btn_choice
 
         # データを送信
         return Response(serializer_context)
@@ -364,6 +453,13 @@ class MyItemListSerializerAPIView(APIView):
 
         # 自分が作成した記事を表示する
         item_objects = Item.objects.filter(user=request.user).order_by("-created_at")
+        pagination = ItemKeysetPagination(request)
+        if pagination.isRequested():
+            item_objects, next_cursor = pagination.paginateQueryset(item_objects)
+            item_objects_serializer = ItemSerializer(prefetchForItemSerializer(item_objects), many=True)
+            return Response({"itemSerializer": item_objects_serializer.data, SerializerContextKey.NEXT_CURSOR: next_cursor})
+
+        item_objects = prefetchForItemSerializer(item_objects)
         if item_objects.count() > 0:
             item_objects_serializer = ItemSerializer(item_objects, many=True)
             print("maji??")
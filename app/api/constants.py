@@ -21,6 +21,42 @@ class SerializerContextKey(object):
     ITEM_OBJECTS_HABITACION = "ITEM_OBJECTS_HABITACION"
     ITEM_OBJECTS_TRABAJO = "ITEM_OBJECTS_TRABAJO"
     ITEM_OBJECTS_TIENDA = "ITEM_OBJECTS_TIENDA"
+    REGION_LIST = "REGION_LIST"
+    NEXT_CURSOR = "NEXT_CURSOR"
+    NEXT_CURSOR_COSAS = "NEXT_CURSOR_COSAS"
+    NEXT_CURSOR_HABITACION = "NEXT_CURSOR_HABITACION"
+    NEXT_CURSOR_TRABAJO = "NEXT_CURSOR_TRABAJO"
+    NEXT_CURSOR_TIENDA = "NEXT_CURSOR_TIENDA"
+    NEXT_PAGE = "NEXT_PAGE"
+    AVISO_COUNT = "AVISO_COUNT"
+    CHECKED_COUNT = "CHECKED_COUNT"
+    DM_CONTENT_OBJECTS = "DM_CONTENT_OBJECTS"
+    PROFILES = "PROFILES"
+    LAST_ID = "LAST_ID"
+    HAS_MORE = "HAS_MORE"
+    DM_THREADS = "DM_THREADS"
+    LAST_READ_MESSAGE_ID = "LAST_READ_MESSAGE_ID"
+    UNREAD_COUNT = "UNREAD_COUNT"
+    INCLUDED = "INCLUDED"
+
+
+class ItemListViewMode(object):
+    """
+    記事一覧のAPIで?view=summaryを指定した場合はカード表示用の簡易なデータを返す
+    """
+
+    QUERY_PARAM = "view"
+    SUMMARY = "summary"
+
+
+class NormalizedViewMode(object):
+    """
+    記事、Avisoを返すAPIで?view=normalizedを指定した場合は、埋め込まれたProfileをidのみで出力し、
+    Profileの内容はSerializerContextKey.INCLUDEDの"profiles"にidをキーとして1回だけ出力する
+    """
+
+    QUERY_PARAM = "view"
+    NORMALIZED = "normalized"
 
 
 class BtnChoice(object):
@@ -0,0 +1,153 @@
+import firebase_admin
+import os
+import threading
+from firebase_admin import credentials
+from firebase_admin import messaging
+from config.settings.base import BASE_DIR
+from api.models import DeviceToken
+from api.constants import FirebaseCloudMessagingCase
+
+
+"""
+FCMの通知をまとめて送信するモジュール。
+
+FirebaseAdminSDKの初期化(サービスアカウントのJSONの読み込み)はgetFirebaseApp()でプロセスごとに1回だけ行う。
+通知はsend_multicastで最大FCM_MULTICAST_LIMIT(500)件のデバイストークンにまとめて送信し、
+登録が解除された(UnregisteredError)デバイストークンはDeviceToken.device_tokenをNoneにして以降送信しない。
+
+firebase-admin 4.3.0にはsend_each_for_multicastがないので、send_multicast(内部はバッチAPI)を使う。
+"""
+
+FILE_NAME = "share-xela-firebase-adminsdk-6a3za-4d5f9d4d35.json"
+FILE_PATH = BASE_DIR + os.path.join("/config/settings/", FILE_NAME)
+
+# send_multicastで1回に送信できるデバイストークンの上限
+FCM_MULTICAST_LIMIT = 500
+
+# (title, body)
+NOTIFICATION_TEXTS = {
+    None: ('test server', 'test server message'),
+    FirebaseCloudMessagingCase.ITEMCONTACT_ADDED_TO_ITEM: (
+        "Tiene un comentario sobre el artículo que publicó", "sharexela"),  # '投稿した記事にコメントが付きました'
+    FirebaseCloudMessagingCase.CREATED_SOLICITUD: (
+        "Ha recibido propuestas para su artículo", "sharexela"),  # "投稿した記事に対して応募がありました"
+    FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE: (
+        "Ha sido seleccionado para hacer negocios sobre este articulo.", "sharexela"),  # "取引相手としてあなたが決まりました"
+    FirebaseCloudMessagingCase.CREATED_DM_CONTENT: (
+        "Su mensaje ha sido recibido.", "sharexela"),  # "メッセージが届きました"
+}
+
+_firebase_app_lock = threading.Lock()
+
+
+def getFirebaseApp():
+    """機能
+    FirebaseAdminSDKのAppを返す。初期化されていない場合のみサービスアカウントのJSONを読み込んで初期化する。
+    """
+    if not firebase_admin._apps:
+        with _firebase_app_lock:
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(credentials.Certificate(FILE_PATH))
+    return firebase_admin.get_app()
+
+
+def makeNotification(case=None):
+    """機能
+    FirebaseCloudMessagingCaseの値に対応するNotificationオブジェクトを生成する。
+    """
+    title, body = NOTIFICATION_TEXTS[case]
+    return messaging.Notification(title=title, body=body)
+
+
+class FcmSendResult(object):
+
+    """
+    FcmNotificationSender#sendMulticastの結果
+
+    success_count: 送信に成功したデバイストークンの数
+    failures: 送信に失敗したデバイストークンをキー、例外(FirebaseError)を値とする辞書
+    unregistered_tokens: failuresのうちUnregisteredErrorのデバイストークン(DeviceTokenから削除済み)
+    """
+
+    def __init__(self):
+        self.success_count = 0
+        self.failures = {}
+        self.unregistered_tokens = []
+
+
+class FcmNotificationSender(object):
+
+    """ *使用方法*
+
+    from api.fcm_sender import FcmNotificationSender
+
+    sender = FcmNotificationSender()
+    result = sender.sendToUsers([user_obj.id, ...], case=FirebaseCloudMessagingCase.CREATED_DM_CONTENT)
+    result = sender.sendMulticast(["deviceToken1", "deviceToken2"], makeNotification(case))
+    result.failures  # {"deviceToken2": UnregisteredError(...)}
+
+    send_multicastにはテスト用にFCMに接続しない関数(MulticastMessageを受け取りBatchResponseを返す)を渡すことができる。
+    """
+
+    def __init__(self, send_multicast=None):
+        self.send_multicast = send_multicast
+
+    def getSendMulticast(self):
+        if self.send_multicast is not None:
+            return self.send_multicast
+        app = getFirebaseApp()
+        return lambda multicast_message: messaging.send_multicast(multicast_message, app=app)
+
+    def getDeviceTokens(self, user_ids):
+        """機能
+        ユーザーのデバイストークンを1回のクエリで取得する。デバイストークンがないユーザーは含まれない。
+
+        Returns:
+            dict: user_idをキー、デバイストークンを値とする辞書
+        """
+        return dict(
+            DeviceToken.objects.filter(user_id__in=user_ids).exclude(device_token__isnull=True).exclude(
+                device_token="").values_list("user_id", "device_token"))
+
+    def sendToUsers(self, user_ids, case=None):
+        tokens = self.getDeviceTokens(user_ids)
+        return self.sendMulticast(list(tokens.values()), makeNotification(case))
+
+    def sendMulticast(self, tokens, notification):
+        """機能
+        notificationをtokensにFCM_MULTICAST_LIMIT件ずつまとめて送信する。
+        同じデバイストークンには1回だけ送信する。
+
+        Args:
+            tokens: デバイストークンのリスト
+            notification: messaging.Notification
+        Returns:
+            FcmSendResult
+        """
+        tokens = list(dict.fromkeys(token for token in tokens if token))
+        send_multicast = self.getSendMulticast()
+        result = FcmSendResult()
+
+        for start in range(0, len(tokens), FCM_MULTICAST_LIMIT):
+            chunk = tokens[start:start + FCM_MULTICAST_LIMIT]
+            batch_response = send_multicast(messaging.MulticastMessage(tokens=chunk, notification=notification))
+            # responsesはtokensと同じ順に並んでいる
+            for token, send_response in zip(chunk, batch_response.responses):
+                if send_response.success:
+                    result.success_count += 1
+                    continue
+                result.failures[token] = send_response.exception
+                if isinstance(send_response.exception, messaging.UnregisteredError):
+                    result.unregistered_tokens.append(token)
+
+        self.pruneTokens(result.unregistered_tokens)
+        return result
+
+    def pruneTokens(self, tokens):
+        """
+        登録が解除されたデバイストークンを削除する。
+        DeviceTokenはUserと1対1で作成されているので、行は残してdevice_tokenをNoneにする。
+        """
+        if len(tokens) == 0:
+            return 0
+        return DeviceToken.objects.filter(device_token__in=tokens).update(device_token=None)
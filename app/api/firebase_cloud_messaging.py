@@ -1,17 +1,11 @@
-import firebase_admin
-from firebase_admin import credentials
 from firebase_admin import messaging
-import os
-from config.settings.base import BASE_DIR
 from api.models import DeviceToken
-from api.constants import FirebaseCloudMessagingCase
+from api.fcm_sender import getFirebaseApp, makeNotification
 
 """
 android端末へpush通知を実装するためのクラス。
-基本的にはsignalを通じて以下のクラスメソッドを使う。
+1件ずつ送信するので、複数のユーザーに送信する場合はapi/fcm_sender.pyのFcmNotificationSenderを使う。
 """
-# print(os.getcwd())
-FILE_NAME = "share-xela-firebase-adminsdk-6a3za-4d5f9d4d35.json"  
 
 
 class FireBaseMassagingDeal(object):
@@ -31,22 +25,15 @@ class FireBaseMassagingDeal(object):
         self.notification = None
         self.message = None
 
-        # FirebaseAdminSDKの初期化を実施する
-        FILE_PATH = BASE_DIR + os.path.join("/config/settings/", FILE_NAME)
-        cred = credentials.Certificate(FILE_PATH)
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(cred)
+        # FirebaseAdminSDKの初期化はプロセスごとに1回だけ実施される
+        getFirebaseApp()
 
     def initFirebaseAdminSDK(self):
         """
         FirebaseAdminSDKの初期化を実施する
         基本的にFireBaseMassagingDealを初期化する時に実施されるので使うことはないと思われる
         """
-        # FILE_PATH = os.path.join(BASE_DIR, "/config/settings/", FILE_NAME)
-        FILE_PATH = BASE_DIR + os.path.join("/config/settings/", FILE_NAME)
-        print(FILE_PATH)
-        cred = credentials.Certificate(FILE_PATH)
-        firebase_admin.initialize_app(cred)
+        getFirebaseApp()
 
     def getDeviceToken(self, userObj):
         """機能
@@ -79,27 +66,7 @@ class FireBaseMassagingDeal(object):
         """テスト項目
         makeNoticationメソッドにdataが渡された時そのbodyとしてitemオブジェクトのタイトルが表示される
         """
-        if case is None:
-            strTitle = 'test server'
-            strBody = 'test server message'
-
-        elif case == FirebaseCloudMessagingCase.ITEMCONTACT_ADDED_TO_ITEM:
-            strTitle = "Tiene un comentario sobre el artículo que publicó" #'投稿した記事にコメントが付きました'
-            strBody = "sharexela"  # data["item_obj"]
-        elif case == FirebaseCloudMessagingCase.CREATED_SOLICITUD:
-            strTitle = "Ha recibido propuestas para su artículo"  # "投稿した記事に対して応募がありました"
-            strBody = "sharexela"  # data["item_obj"] # "Usernameを記述する"
-        elif case == FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE:
-            strTitle = "Ha sido seleccionado para hacer negocios sobre este articulo."  # "取引相手としてあなたが決まりました"
-            strBody = "sharexela"  # data["item_obj"]   # "投稿記事タイトルを表示します"
-        elif case == FirebaseCloudMessagingCase.CREATED_DM_CONTENT:
-            strTitle = "Su mensaje ha sido recibido."  # "メッセージが届きました"
-            strBody = "sharexela"  # data["item_obj"] #"メッセージ内容を表示する"
-
-        notification = messaging.Notification(
-            title=strTitle,
-            body=strBody,
-        )
+        notification = makeNotification(case)
 
         self.notification = notification
 
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+
+
+class ItemKeysetPagination(object):
+
+    """ *使用方法*
+
+    pagination = ItemKeysetPagination(request)
+    if pagination.isRequested():
+        item_objects, next_cursor = pagination.paginateQueryset(item_objects)
+
+    記事一覧を(created_at, id)の降順でページ分割する。
+    config.utils.paginate_queryset(Paginator)のようにOFFSETとCOUNT(*)を使わず、
+    前のページの最後の記事の(created_at, id)より古い記事を取得するので、何ページ目でもコストは変わらない。
+
+    クエリパラメータ
+        page_size: 1ページの記事数(MAX_PAGE_SIZEまで)
+        cursor: 前のレスポンスのNEXT_CURSORの値。指定しない場合は1ページ目を返す。
+
+    どちらも指定されていないリクエストは従来通り全件を返す(isRequested()がFalse)。
+    """
+
+    CURSOR_QUERY_PARAM = "cursor"
+    PAGE_SIZE_QUERY_PARAM = "page_size"
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    ORDERING = ("-created_at", "-id")
+
+    def __init__(self, request):
+        self.request = request
+        self.page_size = self.getPageSize()
+
+    def getQueryParams(self):
+        # DjangoのHttpRequest(webのページ)の場合はrequest.GETを使う
+        return getattr(self.request, "query_params", self.request.GET)
+
+    def isRequested(self):
+        params = self.getQueryParams()
+        return self.CURSOR_QUERY_PARAM in params or self.PAGE_SIZE_QUERY_PARAM in params
+
+    def getPageSize(self):
+        try:
+            page_size = int(self.getQueryParams()[self.PAGE_SIZE_QUERY_PARAM])
+        except (KeyError, ValueError):
+            return self.DEFAULT_PAGE_SIZE
+        if page_size <= 0:
+            return self.DEFAULT_PAGE_SIZE
+        return min(page_size, self.MAX_PAGE_SIZE)
+
+    def paginateQueryset(self, queryset, first_page=False):
+        """機能
+        querysetから1ページ分の記事を取得する。
+
+        Args:
+            queryset: ItemのQuerySet(並び順はORDERINGで上書きされる)
+            first_page: Trueの場合はcursorを無視して1ページ目を返す(ホーム画面の各カテゴリーなど)
+        Returns:
+            (QuerySet, str): 1ページ分のquerysetと次のページのcursor(最後のページの場合はNone)
+        """
+        queryset = queryset.order_by(*self.ORDERING)
+        if first_page is False:
+            position = self.decodeCursor(self.getQueryParams().get(self.CURSOR_QUERY_PARAM))
+            if position is not None:
+                created_at, pk = position
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        # 1件多く取得して次のページがあるか判定する
+        keys = list(queryset.values_list("created_at", "id")[:self.page_size + 1])
+        next_cursor = None
+        if len(keys) > self.page_size:
+            keys = keys[:self.page_size]
+            next_cursor = self.encodeCursor(*keys[-1])
+
+        page_queryset = queryset.filter(id__in=[pk for created_at, pk in keys])
+        return page_queryset, next_cursor
+
+    def encodeCursor(self, created_at, pk):
+        value = json.dumps([created_at.isoformat(), pk])
+        return base64.urlsafe_b64encode(value.encode("utf-8")).decode("ascii")
+
+    def decodeCursor(self, cursor):
+        """
+        cursorが不正な値の場合はDRFのCursorPaginationと同様にNotFound(404)とする。
+        """
+        if not cursor:
+            return None
+        try:
+            created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8"))
+            created_at = parse_datetime(created_at)
+            pk = int(pk)
+        except (binascii.Error, UnicodeError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+        if created_at is None:
+            raise NotFound("Invalid cursor")
+        return created_at, pk
+
+
+class AvisoKeysetPagination(ItemKeysetPagination):
+
+    """ *使用方法*
+
+    pagination = AvisoKeysetPagination(request)
+    if pagination.isRequested():
+        aviso_objects, next_cursor = pagination.paginateQueryset(aviso_objects)
+
+    通知一覧をItemKeysetPaginationと同じ(created_at, id)の降順でページ分割する。
+    """
+
+    DEFAULT_PAGE_SIZE = 30
+
+
+class DirectMessageInboxPagination(ItemKeysetPagination):
+
+    """ *使用方法*
+
+    pagination = DirectMessageInboxPagination(request)
+    rows, next_cursor = pagination.paginateInbox(DirectMessageInbox(profile_obj))
+
+    会話の一覧(direct_messages/inbox.py)を(last_activity, id)の降順でページ分割する。
+    会話の一覧は常にページ分割する。
+    """
+
+    def paginateInbox(self, inbox):
+        position = self.decodeCursor(self.getQueryParams().get(self.CURSOR_QUERY_PARAM))
+        rows, next_position = inbox.getPage(before=position, page_size=self.page_size)
+        next_cursor = self.encodeCursor(*next_position) if next_position is not None else None
+        return rows, next_cursor
@@ -0,0 +1,201 @@
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from avisos.models import AVISO_ITEM_LOOKUPS
+from direct_messages.models import DirectMessage, DirectMessageContent
+from feedback.models import Feedback
+from items.models import Item
+from item_contacts.models import ItemContact
+from solicitudes.models import Solicitud
+
+
+"""
+Serializerで出力する関連オブジェクトをまとめて取得するためのquerysetを作成するモジュール。
+
+ItemSerializerはfavorite_users, item_contacts, solicitudes, direct_messageをネストして出力し、
+さらにその中でProfileSerializer(user, feedback)をネストしている。
+そのままItemオブジェクトの一覧を出力すると記事数 × 関連オブジェクト数のクエリが発行されるので、
+記事の一覧を返すAPIViewは必ずprefetchForItemSerializer()を通したquerysetを使う。
+?view=normalizedの場合はprefetchForNormalizedItemSerializer()を使う。
+
+一覧画面のカード表示のみに使う場合はgetItemSummaryValues()とItemSummarySerializerを使う。
+Avisoの一覧はprefetchForAvisoSerializer()とresolveAvisoContentObjects()を使う。
+ダイレクトメッセージの差分同期はgetDirectMessageContentsSince()を使う。
+"""
+
+# 差分同期で1回に返すメッセージの上限
+DM_CONTENT_SYNC_LIMIT = 200
+
+
+def getFeedbackPrefetchQuerySet():
+    # FeedbackSerializerはevaluator(User)をネストしている
+    return Feedback.objects.select_related("evaluator").order_by("id")
+
+
+def prefetchForItemSerializer(queryset):
+    """機能
+    ItemSerializer(many=True)で出力するquerysetにselect_related, prefetch_relatedを設定する。
+    記事数に関わらず発行されるクエリの数は一定になる。
+
+    Args:
+        queryset: ItemのQuerySet
+    Returns:
+        QuerySet
+
+    コピペ
+        item_objects = prefetchForItemSerializer(Item.objects.filter(active=True).order_by("-created_at"))
+    """
+    return queryset.select_related(
+        "category",
+        "user",
+        "direct_message__owner__user",
+        "direct_message__participant__user",
+    ).prefetch_related(
+        Prefetch("favorite_users", queryset=User.objects.order_by("id")),
+        Prefetch(
+            "item_contacts",
+            queryset=ItemContact.objects.select_related("post_user__user").order_by("timestamp", "id")),
+        Prefetch("item_contacts__post_user__feedback", queryset=getFeedbackPrefetchQuerySet()),
+        Prefetch(
+            "solicitudes",
+            queryset=Solicitud.objects.select_related("applicant__user").order_by("timestamp", "id")),
+        Prefetch("solicitudes__applicant__feedback", queryset=getFeedbackPrefetchQuerySet()),
+        Prefetch("direct_message__owner__feedback", queryset=getFeedbackPrefetchQuerySet()),
+        Prefetch("direct_message__participant__feedback", queryset=getFeedbackPrefetchQuerySet()),
+        Prefetch(
+            "direct_message__direct_message_contents",
+            queryset=DirectMessageContent.objects.select_related("profile__user").order_by("created_at", "id")),
+        Prefetch("direct_message__direct_message_contents__profile__feedback", queryset=getFeedbackPrefetchQuerySet()),
+    )
+
+
+def prefetchForNormalizedItemSerializer(queryset):
+    """機能
+    ?view=normalized(api.serializers.IncludedProfiles)でItemSerializerを出力するquerysetに
+    select_related, prefetch_relatedを設定する。
+    Profileはidのみを出力し、IncludedProfiles.serialize()でまとめて取得するので、Profileとfeedbackは取得しない。
+
+    コピペ
+        item_objects = prefetchForNormalizedItemSerializer(Item.objects.filter(active=True).order_by("-created_at"))
+    """
+    return queryset.select_related(
+        "category",
+        "user",
+        "direct_message",
+    ).prefetch_related(
+        Prefetch("favorite_users", queryset=User.objects.order_by("id")),
+        Prefetch("item_contacts", queryset=ItemContact.objects.order_by("timestamp", "id")),
+        Prefetch("solicitudes", queryset=Solicitud.objects.order_by("timestamp", "id")),
+        Prefetch(
+            "direct_message__direct_message_contents",
+            queryset=DirectMessageContent.objects.order_by("created_at", "id")),
+    )
+
+
+def countItemRelationSubquery(through_model):
+    """機能
+    ItemのManyToManyFieldの中間テーブルから記事ごとの件数を求めるサブクエリを作成する。
+    JOINしてCountすると複数のManyToManyFieldの行数が掛け合わされるのでサブクエリにしている。
+    """
+    count_qs = through_model.objects.filter(item=OuterRef("pk")).order_by().values("item").annotate(
+        count=Count("pk")).values("count")[:1]
+    return Coalesce(Subquery(count_qs, output_field=IntegerField()), 0)
+
+
+def getItemSummaryValues(queryset):
+    """機能
+    ItemSummarySerializerで出力する値だけをvalues()で取得する。
+    Itemオブジェクトを生成しないので、記事数が多い一覧でもシリアライズの負荷が小さい。
+
+    Args:
+        queryset: ItemのQuerySet
+    Returns:
+        ValuesQuerySet: querysetの並び順を保った辞書のリスト
+    """
+    return queryset.annotate(
+        favorite_count=countItemRelationSubquery(Item.favorite_users.through),
+        item_contact_count=countItemRelationSubquery(Item.item_contacts.through),
+        solicitud_count=countItemRelationSubquery(Item.solicitudes.through),
+    ).values(
+        "id", "title", "price", "category__number", "adm1", "adm2", "image1", "created_at",
+        "favorite_count", "item_contact_count", "solicitud_count",
+    )
+
+
+def prefetchForAvisoSerializer(queryset):
+    """機能
+    AvisoSerializer(many=True)で出力するquerysetにselect_related, prefetch_relatedを設定する。
+    content_object(GenericForeignKey)はresolveAvisoContentObjects()でまとめて取得する。
+    """
+    return queryset.select_related("aviso_user__user").prefetch_related(
+        Prefetch("aviso_user__feedback", queryset=getFeedbackPrefetchQuerySet()),
+    )
+
+
+def resolveAvisoContentObjects(aviso_objects):
+    """機能
+    AvisoSerializerのcontent_object({"modelName", "itemName"})を各Avisoのcontent_object_dataに設定する。
+    itemNameは作成時に保存したAviso.item_titleを使う。item_titleがない(backfill_aviso_item実行前の)Avisoのみ
+    content_typeごとに1回のクエリでまとめて記事を取得する。通知対象の記事が削除されている場合のitemNameはNoneである。
+
+    Args:
+        aviso_objects: Avisoオブジェクトのリスト
+    Returns:
+        list: aviso_objects
+
+    コピペ
+        aviso_objects = resolveAvisoContentObjects(list(prefetchForAvisoSerializer(aviso_objects)))
+    """
+    model_names = {}
+    object_ids_by_type = {}
+    for model, model_name, lookup in AVISO_ITEM_LOOKUPS:
+        model_names[ContentType.objects.get_for_model(model).id] = model_name
+    for aviso_obj in aviso_objects:
+        if aviso_obj.item_title == "":
+            object_ids_by_type.setdefault(aviso_obj.content_type_id, set()).add(aviso_obj.object_id)
+
+    item_titles = {}
+    for model, model_name, lookup in AVISO_ITEM_LOOKUPS:
+        content_type_id = ContentType.objects.get_for_model(model).id
+        object_ids = object_ids_by_type.get(content_type_id)
+        if not object_ids:
+            continue
+        for object_id, title in Item.objects.filter(**{lookup + "__in": object_ids}).values_list(lookup, "title"):
+            item_titles[(content_type_id, object_id)] = title
+
+    for aviso_obj in aviso_objects:
+        if aviso_obj.content_type_id not in model_names:
+            aviso_obj.content_object_data = {}
+            continue
+        item_title = aviso_obj.item_title or item_titles.get((aviso_obj.content_type_id, aviso_obj.object_id))
+        aviso_obj.content_object_data = {
+            "modelName": model_names[aviso_obj.content_type_id], "itemName": item_title}
+    return aviso_objects
+
+
+def getDirectMessageContentsSince(dm_obj, since_id=None, since=None, limit=DM_CONTENT_SYNC_LIMIT):
+    """機能
+    dm_objのメッセージのうちsince_idより後(またはsinceより後)に作成されたものを古い順にlimit件取得する。
+    中間テーブルの(directmessage_id, directmessagecontent_id)のユニークインデックスを範囲検索するので、
+    会話のメッセージ数に関わらず新しいメッセージの数だけのコストで取得できる。
+
+    Args:
+        dm_obj: DirectMessageオブジェクト
+        since_id: int ...クライアントが持っている最新のメッセージのid
+        since: datetime ...クライアントが持っている最新のメッセージのcreated_at
+        limit: int
+    Returns:
+        (list, bool): メッセージのリストと、limit件より多くのメッセージがあるかどうか
+    """
+    content_ids = DirectMessage.direct_message_contents.through.objects.filter(directmessage_id=dm_obj.id)
+    if since_id is not None:
+        content_ids = content_ids.filter(directmessagecontent_id__gt=since_id)
+    dm_content_objects = DirectMessageContent.objects.filter(
+        id__in=content_ids.values("directmessagecontent_id"))
+    if since is not None:
+        dm_content_objects = dm_content_objects.filter(created_at__gt=since)
+
+    dm_content_objects = list(dm_content_objects.order_by("created_at", "id")[:limit + 1])
+    has_more = len(dm_content_objects) > limit
+    return dm_content_objects[:limit], has_more
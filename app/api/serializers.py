@@ -1,5 +1,8 @@
 from rest_framework import serializers
+from api.constants import NormalizedViewMode
+from api.querysets import resolveAvisoContentObjects
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from avisos.models import Aviso
 from categories.models import Category
 from contacts.models import Contact
@@ -92,9 +95,94 @@ class ProfileSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class ProfileSummarySerializer(serializers.ModelSerializer):
+    """
+    Profileをidごとに1回だけまとめて出力する場合(差分同期のPROFILES、?view=normalizedのINCLUDED)の簡易なProfileのSerializer。
+    feedbackの一覧の代わりに評価の件数、合計、平均(Profile.rating_*)を出力する。
+    feedbackとそのevaluatorを取得しないので、select_related("user")のみでクエリは増えない。
+    """
+
+    username = serializers.CharField(source="user.username", read_only=True)
+
+    class Meta:
+        model = Profile
+        fields = (
+            "id", "username", "image", "adm1", "adm2",
+            "rating_count", "rating_sum", "rating_average",
+            )
+
+
+class IncludedProfiles(object):
+
+    """ *使用方法*
+
+    from api.serializers import IncludedProfiles
+
+    if IncludedProfiles.isRequested(request):
+        included_profiles = IncludedProfiles()
+        serializer = ItemSerializer(item_objects, many=True, context=included_profiles.getContext())
+        serializerContext[SerializerContextKey.ITEM_OBJECTS] = serializer.data
+        serializerContext[SerializerContextKey.INCLUDED] = included_profiles.serialize()
+
+    getContext()を渡したSerializerでは、ProfileReferenceFieldはProfileのidのみを出力し、そのidを集める。
+    serialize()は集めたidのProfileを1回のクエリで取得し、{"profiles": {"id": ProfileSummarySerializerのデータ}}を返す。
+    idはserializer.dataを評価した時に集まるので、serialize()は必ずその後に呼び出す。
+    """
+
+    CONTEXT_KEY = "included_profile_ids"
+
+    def __init__(self):
+        self.profile_ids = set()
+
+    @staticmethod
+    def isRequested(request):
+        return request.query_params.get(NormalizedViewMode.QUERY_PARAM) == NormalizedViewMode.NORMALIZED
+
+    def getContext(self, context=None):
+        context = dict(context or {})
+        context[self.CONTEXT_KEY] = self.profile_ids
+        return context
+
+    def add(self, profile_id):
+        if profile_id is not None:
+            self.profile_ids.add(profile_id)
+        return profile_id
+
+    def serialize(self):
+        profile_objects = []
+        if self.profile_ids:
+            profile_objects = Profile.objects.filter(id__in=self.profile_ids).select_related("user").order_by("id")
+        data = ProfileSummarySerializer(profile_objects, many=True).data
+        return {"profiles": {str(profile["id"]): profile for profile in data}}
+
+
+class ProfileReferenceField(serializers.Field):
+    """
+    ItemContact.post_userなど、他のオブジェクトに埋め込まれたProfileを出力するField。
+    IncludedProfiles.getContext()のcontextで出力する場合はProfileを取得せずに外部キーの値(id)のみを出力する。
+    それ以外はこれまで通りProfileSerializerで出力する。
+    """
+
+    def __init__(self, **kwargs):
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        if IncludedProfiles.CONTEXT_KEY in self.context:
+            return getattr(instance, instance._meta.get_field(self.source).attname)
+        return super().get_attribute(instance)
+
+    def to_representation(self, value):
+        profile_ids = self.context.get(IncludedProfiles.CONTEXT_KEY)
+        if profile_ids is not None:
+            profile_ids.add(value)
+            return value
+        return ProfileSerializer(value, context=self.context).data
+
+
 class ItemContactSerializer(serializers.ModelSerializer):
 
-    post_user = ProfileSerializer(read_only=True)
+    post_user = ProfileReferenceField()
 
     class Meta:
         model = ItemContact
@@ -105,7 +193,7 @@ class ItemContactSerializer(serializers.ModelSerializer):
 class SolicitudSerializer(serializers.ModelSerializer):
 
     # item = ItemSerializer(read_only=True)#
-    applicant = ProfileSerializer(read_only=True)
+    applicant = ProfileReferenceField()
 
     class Meta:
         model = Solicitud
@@ -115,7 +203,7 @@ class SolicitudSerializer(serializers.ModelSerializer):
 class DirectMessageContentSerializer(serializers.ModelSerializer):
 
     # dm = DirectMessageSerializer(read_only=True)
-    profile = ProfileSerializer(read_only=True)
+    profile = ProfileReferenceField()
 
     class Meta:
         model = DirectMessageContent
@@ -124,10 +212,22 @@ class DirectMessageContentSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at',)  # 'dm', 'profile',
 
 
+class DirectMessageContentSyncSerializer(serializers.ModelSerializer):
+    """
+    差分同期用のメッセージのSerializer。送信者はProfileのidのみを出力する(ProfileSummarySerializerで別に出力する)。
+    """
+
+    profile = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    class Meta:
+        model = DirectMessageContent
+        fields = ("id", "content", "profile", "created_at")
+
+
 class DirectMessageSerializer(serializers.ModelSerializer):
 
-    owner = ProfileSerializer()
-    participant = ProfileSerializer()
+    owner = ProfileReferenceField()
+    participant = ProfileReferenceField()
     direct_message_contents = DirectMessageContentSerializer(read_only=True, many=True)
 
     class Meta:
@@ -166,48 +266,81 @@ class ItemSerializer(serializers.ModelSerializer):
         # return super(Item, self).create(*args, **kwargs)
 
 
+class ItemSummarySerializer(serializers.Serializer):
+    """
+    一覧画面のカード表示用のSerializer。
+    api.querysets.getItemSummaryValues()で取得した辞書を出力する。Itemオブジェクトは受け取らない。
+    """
+
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    price = serializers.IntegerField()
+    category = serializers.CharField(source="category__number")
+    adm1 = serializers.CharField()
+    adm2 = serializers.CharField()
+    image1 = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField()
+    favorite_count = serializers.IntegerField()
+    item_contact_count = serializers.IntegerField()
+    solicitud_count = serializers.IntegerField()
+
+    def get_image1(self, row):
+        # ItemSerializer(ImageField)と同じURLを返す
+        if not row["image1"]:
+            return None
+        url = default_storage.url(row["image1"])
+        request = self.context.get("request", None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class DirectMessageThreadSerializer(serializers.Serializer):
+    """
+    会話の一覧の1行を出力するSerializer。
+    direct_messages.inbox.DirectMessageInboxで取得した辞書を出力する。DirectMessageオブジェクトは受け取らない。
+    """
+
+    id = serializers.IntegerField()
+    item_id = serializers.IntegerField(allow_null=True)
+    item_title = serializers.CharField(allow_null=True)
+    other_profile = serializers.SerializerMethodField()
+    last_message = serializers.CharField(allow_null=True)
+    last_message_profile_id = serializers.IntegerField(allow_null=True)
+    last_message_at = serializers.DateTimeField(allow_null=True)
+    last_activity = serializers.DateTimeField()
+    unread_count = serializers.IntegerField()
+
+    def get_other_profile(self, row):
+        if row["other_profile_id"] is None:
+            return None
+        image = None
+        if row["other_image"]:
+            image = default_storage.url(row["other_image"])
+            request = self.context.get("request", None)
+            if request is not None:
+                image = request.build_absolute_uri(image)
+        return {"id": row["other_profile_id"], "username": row["other_username"], "image": image}
+
+
 class AvisoObjectRelatedField(serializers.RelatedField):
 
+    """
+    Avisoの通知対象(content_object)を{"modelName": モデル名, "itemName": 記事のタイトル}として出力する。
+    値はapi/querysets.py resolveAvisoContentObjects()でcontent_typeごとにまとめて取得しておく。
+    取得されていない場合はそのAvisoだけ取得する。
+    """
+
     def to_representation(self, value):
-        # print("VALUEのチェックを実行する")
-        # print(dir(value))
-        # print(value.item)
-        content_object = {}
-
-        if isinstance(value, ItemContact):
-            content_object["modelName"] = "ItemContact"
-            # content_object["itemName"] = str(value.item)
-            content_object["itemName"] = Item.objects.get(
-                item_contacts__id=value.id).title
-
-        elif isinstance(value, Solicitud):
-            content_object["modelName"] = "Solicitud"
-            # content_object["itemName"] = str(value.item)
-            content_object["itemName"] = Item.objects.get(
-                solicitudes__id=value.id).title
-        elif isinstance(value, DirectMessage):
-            content_object["modelName"] = "DirectMessage"
-            # content_object["itemName"] = str(value.item)
-            print(value)
-            print(dir(value))
-            content_object["itemName"] = Item.objects.get(
-                direct_message__id=value.id).title
-        elif isinstance(value, DirectMessageContent):
-            content_object["modelName"] = "DirectMessageContent"
-            # content_object["sendUserName"] = str(value.profile)
-            dm_obj = DirectMessage.objects.get(direct_messages__id=value.id)
-            content_object["itemName"] = Item.objects.get(
-                direct_message__id=dm_obj.id).title
-        else:
-            print("注意")
-            print(value)
-        return content_object
+        if not hasattr(value, "content_object_data"):
+            resolveAvisoContentObjects([value])
+        return value.content_object_data
 
 
 class AvisoSerializer(serializers.ModelSerializer):
 
-    content_object = AvisoObjectRelatedField(read_only=True)
-    aviso_user = ProfileSerializer()
+    content_object = AvisoObjectRelatedField(source="*", read_only=True)
+    aviso_user = ProfileReferenceField()
     # aviso_user = ProfileSerializer(many=True)
 
     class Meta:
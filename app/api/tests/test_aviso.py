@@ -4,6 +4,15 @@ from django.urls import reverse, reverse_lazy
 from rest_framework.test import APIClient
 from config.constants import ViewName
 from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from avisos.models import Aviso
+from categories.models import Category
+from items.models import Item
+from item_contacts.models import ItemContact
+from profiles.models import Profile
+from solicitudes.models import Solicitud
 from config.tests.utils import (
     create_user_for_test, create_user_data,
     pickUp_category_obj_for_test,
@@ -99,3 +108,134 @@ class ItemContactListByContactObjPKAPIViewTest(TestCase):
             response = self.client.get(
                 reverse_lazy(ViewName.ItemContactListByContactObjPKAPIView, args=(str(object_id),)))
             self.assertTrue('ITEM_OBJECT' in response.data.keys())
+
+
+class AvisosAllListAPIViewTest(TestCase):
+
+    """テスト対象
+    api/views.py AvisosAllListAPIView#get
+
+    endpoint: api/avisos/list/
+    name: -
+    """
+    """テスト項目
+    content_objectにmodelNameと記事のタイトルが出力される
+    Avisoの数に関わらず発行されるクエリの数は一定である
+    page_sizeを指定するとページ分割され、NEXT_CURSORで次のページを取得できる
+    ?view=normalizedを指定するとaviso_userがidで出力され、ProfileはINCLUDEDに1回だけ出力される
+    """
+
+    def setUp(self):
+        self.category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        self.contact_user = User.objects.create_user(username="contact_user", email="test_contact_user@gmail.com", password='12345')
+        Token.objects.create(key="TOKEN_VALUE", user=self.post_user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+
+    def createAvisos(self, num):
+        """
+        contact_userが記事にコメントと取引申請をする(記事作成者にAvisoが2つ作成される)
+        """
+        contact_profile_obj = Profile.objects.get(user=self.contact_user)
+        item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム{}".format(num), description="説明です。",
+            category=self.category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        item_obj.item_contacts.add(ItemContact.objects.create(post_user=contact_profile_obj, message="コメント"))
+        item_obj.solicitudes.add(Solicitud.objects.create(applicant=contact_profile_obj, message="申請"))
+
+    def countQueries(self, path="/api/avisos/list/"):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_content_objectにmodelNameと記事のタイトルが出力される(self):
+        self.createAvisos(1)
+        count, response = self.countQueries()
+        content_objects = sorted(
+            [aviso["content_object"] for aviso in response.data["AVISO_OBJECTS"]], key=lambda data: data["modelName"])
+        self.assertEqual(content_objects, [
+            {"modelName": "ItemContact", "itemName": "テストアイテム1"},
+            {"modelName": "Solicitud", "itemName": "テストアイテム1"},
+        ])
+
+    def test_Avisoの数に関わらず発行されるクエリの数は一定である(self):
+        self.createAvisos(1)
+        count_with_2_avisos, response = self.countQueries()
+        self.assertEqual(len(response.data["AVISO_OBJECTS"]), 2)
+
+        for num in range(2, 6):
+            self.createAvisos(num)
+        count_with_10_avisos, response = self.countQueries()
+        self.assertEqual(len(response.data["AVISO_OBJECTS"]), 10)
+        self.assertEqual(count_with_2_avisos, count_with_10_avisos)
+
+    def test_page_sizeを指定するとページ分割される(self):
+        for num in range(1, 4):
+            self.createAvisos(num)
+        count, response = self.countQueries("/api/avisos/list/?page_size=4")
+        first_page = response.data["AVISO_OBJECTS"]
+        self.assertEqual(len(first_page), 4)
+        next_cursor = response.data["NEXT_CURSOR"]
+        self.assertIsNotNone(next_cursor)
+
+        count, response = self.countQueries("/api/avisos/list/?page_size=4&cursor=" + next_cursor)
+        self.assertEqual(len(response.data["AVISO_OBJECTS"]), 2)
+        self.assertIsNone(response.data["NEXT_CURSOR"])
+
+    def test_view_normalizedを指定するとaviso_userがidで出力される(self):
+        for num in range(1, 3):
+            self.createAvisos(num)
+        post_profile_obj = Profile.objects.get(user=self.post_user)
+        count, response = self.countQueries("/api/avisos/list/?view=normalized")
+        self.assertEqual([aviso["aviso_user"] for aviso in response.data["AVISO_OBJECTS"]], [post_profile_obj.id] * 4)
+        self.assertEqual(list(response.data["INCLUDED"]["profiles"].keys()), [str(post_profile_obj.id)])
+
+
+class AvisoCheckAllAPIViewTest(TestCase):
+
+    """テスト対象
+    api/Views/aviso_views.py AvisoCheckAllAPIView#post
+
+    endpoint: api/avisos/check/
+    name: -
+    """
+    """テスト項目
+    指定なしの場合は全ての未読のAvisoが既読になり、AVISO_COUNTが0になる
+    content_type, itemを指定した場合はそのAvisoのみ既読になる
+    不正なcontent_typeの場合は400が返る
+    """
+
+    def setUp(self):
+        self.category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        contact_profile_obj = Profile.objects.get(
+            user=User.objects.create_user(username="contact_user", email="test_contact_user@gmail.com", password='12345'))
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム", description="説明です。",
+            category=self.category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        self.item_obj.item_contacts.add(ItemContact.objects.create(post_user=contact_profile_obj, message="コメント"))
+        self.item_obj.solicitudes.add(Solicitud.objects.create(applicant=contact_profile_obj, message="申請"))
+        Token.objects.create(key="TOKEN_VALUE", user=self.post_user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+
+    def test_指定なしの場合は全てのAvisoが既読になる(self):
+        response = self.client.post("/api/avisos/check/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"AVISO_COUNT": 0, "CHECKED_COUNT": 2})
+        self.assertEqual(Profile.objects.get(user=self.post_user).unread_aviso_count, 0)
+
+    def test_content_typeとitemを指定した場合はそのAvisoのみ既読になる(self):
+        response = self.client.post(
+            "/api/avisos/check/", {"content_type": "solicitud", "item": self.item_obj.id}, format="json")
+        self.assertEqual(response.data, {"AVISO_COUNT": 1, "CHECKED_COUNT": 1})
+        self.assertEqual(
+            list(Aviso.objects.filter(aviso_user__user=self.post_user, checked=False).values_list(
+                "content_type__model", flat=True)), ["itemcontact"])
+
+    def test_不正なcontent_typeの場合は400が返る(self):
+        response = self.client.post("/api/avisos/check/", {"content_type": "user"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Profile.objects.get(user=self.post_user).unread_aviso_count, 2)
@@ -0,0 +1,281 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from avisos.models import Aviso
+from direct_messages.models import DirectMessage, DirectMessageContent
+from profiles.models import Profile
+from config.tests.utils import (
+    pickUp_category_obj_for_test,
+    create_user_for_test, create_user_data,
+    create_item_for_test, create_item_data,
+    create_solicitud_for_test, create_solicitud_data,
+    create_direct_message_for_test,
+)
+
+
+class DirectMessageContentListAPIViewSyncTest(TestCase):
+
+    """テスト対象
+    api/views.py DirectMessageContentListAPIView#get (since_id, since を指定した場合)
+
+    endpoint: api/item/<int:pk>/direct_message_content_list/
+    name: "api:DirectMessageContentListAPIView"
+    """
+    """テスト項目
+    since_idより新しいメッセージのみが古い順に返り、送信者はProfileのidのみである
+    owner, participantのProfileはPROFILESに1回だけ出力される
+    新しいメッセージがない場合は空のリストとsince_idのLAST_IDが返る
+    sinceを指定した場合はそのcreated_atより新しいメッセージが返る
+    メッセージの数に関わらず発行されるクエリの数は一定である
+    不正なsince_idの場合は400が返る
+    since_id, sinceを指定しない場合は従来通り全てのメッセージを返す
+    """
+
+    def setUp(self):
+        category_obj = pickUp_category_obj_for_test()
+        self.owner_user_obj, self.owner_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="owner_user"))
+        self.participant_user_obj, self.participant_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="participant_user"))
+        item_obj = create_item_for_test(self.owner_user_obj, create_item_data(category_obj))
+        solicitud_obj = create_solicitud_for_test(item_obj, self.participant_user_obj, create_solicitud_data(message=None))
+        self.dm_obj, self.item_obj = create_direct_message_for_test(solicitud_obj)
+        self.URL = "/api/item/{}/direct_message_content_list/".format(self.item_obj.id)
+
+        Token.objects.create(key="TOKEN_VALUE", user=self.owner_user_obj)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+
+    def addContents(self, num):
+        dm_content_objects = []
+        for count in range(num):
+            profile_obj = self.owner_profile_obj if count % 2 == 0 else self.participant_profile_obj
+            dm_content_obj = DirectMessageContent.objects.create(content="mensaje{}".format(count), profile=profile_obj)
+            self.dm_obj.direct_message_contents.add(dm_content_obj)
+            dm_content_objects.append(dm_content_obj)
+        return dm_content_objects
+
+    def test_since_idより新しいメッセージのみが返る(self):
+        dm_content_objects = self.addContents(4)
+        response = self.client.get(self.URL, {"since_id": dm_content_objects[1].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(data["id"], data["profile"]) for data in response.data["DM_CONTENT_OBJECTS"]],
+            [(dm_content_objects[2].id, self.owner_profile_obj.id), (dm_content_objects[3].id, self.participant_profile_obj.id)])
+        self.assertEqual(response.data["LAST_ID"], dm_content_objects[3].id)
+        self.assertFalse(response.data["HAS_MORE"])
+        self.assertEqual(
+            [(data["id"], data["username"]) for data in response.data["PROFILES"]],
+            sorted([(self.owner_profile_obj.id, self.owner_user_obj.username),
+                    (self.participant_profile_obj.id, self.participant_user_obj.username)]))
+
+    def test_新しいメッセージがない場合は空のリストが返る(self):
+        dm_content_objects = self.addContents(2)
+        response = self.client.get(self.URL, {"since_id": dm_content_objects[-1].id})
+        self.assertEqual(response.data["DM_CONTENT_OBJECTS"], [])
+        self.assertEqual(response.data["LAST_ID"], dm_content_objects[-1].id)
+
+    def test_sinceを指定した場合はcreated_atより新しいメッセージが返る(self):
+        dm_content_objects = self.addContents(3)
+        DirectMessageContent.objects.filter(id=dm_content_objects[0].id).update(
+            created_at=dm_content_objects[1].created_at.replace(year=2000))
+        since = DirectMessageContent.objects.get(id=dm_content_objects[0].id).created_at
+        response = self.client.get(self.URL, {"since": since.isoformat()})
+        self.assertEqual(
+            [data["id"] for data in response.data["DM_CONTENT_OBJECTS"]],
+            [dm_content_objects[1].id, dm_content_objects[2].id])
+
+    def test_メッセージの数に関わらず発行されるクエリの数は一定である(self):
+        self.addContents(2)
+        with CaptureQueriesContext(connection) as queries_with_2:
+            self.client.get(self.URL, {"since_id": 0})
+        self.addContents(8)
+        with CaptureQueriesContext(connection) as queries_with_10:
+            response = self.client.get(self.URL, {"since_id": 0})
+        self.assertEqual(len(response.data["DM_CONTENT_OBJECTS"]), 10)
+        self.assertEqual(len(queries_with_2.captured_queries), len(queries_with_10.captured_queries))
+
+    def test_不正なsince_idの場合は400が返る(self):
+        response = self.client.get(self.URL, {"since_id": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_since_idを指定しない場合は全てのメッセージを返す(self):
+        self.addContents(3)
+        response = self.client.get(self.URL)
+        self.assertEqual(len(response.data["DM_CONTENT_OBJECTS_SERIALIZER"]), 3)
+        self.assertIn("feedback", response.data["DM_CONTENT_OBJECTS_SERIALIZER"][0]["profile"])
+
+
+class DirectMessageInboxAPIViewTest(TestCase):
+
+    """テスト対象
+    api/Views/direct_message_views.py DirectMessageInboxAPIView#get
+    direct_messages/inbox.py DirectMessageInbox
+
+    endpoint: api/direct_messages/inbox/
+    name: "api:direct_message_inbox"
+    """
+    """テスト項目
+    自分が参加している会話のみが最後のメッセージの新しい順に返る
+    最後のメッセージの抜粋、相手、未読数が返る
+    page_sizeを指定するとページ分割され、NEXT_CURSORで次のページを取得できる
+    会話の数に関わらず発行されるクエリの数は一定である
+    """
+
+    URL = "/api/direct_messages/inbox/"
+
+    def setUp(self):
+        self.category_obj = pickUp_category_obj_for_test()
+        self.owner_user_obj, self.owner_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="owner_user"))
+        self.participant_user_obj, self.participant_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="participant_user"))
+        Token.objects.create(key="TOKEN_VALUE", user=self.owner_user_obj)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+
+    def createThread(self, messages, owner_user_obj=None):
+        """
+        owner_user_objの記事にparticipant_userが申請して会話を作成し、messages([(profile_obj, content), ...])を送信する
+        """
+        owner_user_obj = owner_user_obj or self.owner_user_obj
+        item_obj = create_item_for_test(owner_user_obj, create_item_data(self.category_obj))
+        solicitud_obj = create_solicitud_for_test(item_obj, self.participant_user_obj, create_solicitud_data(message=None))
+        dm_obj, item_obj = create_direct_message_for_test(solicitud_obj)
+        for profile_obj, content in messages:
+            dm_content_obj = DirectMessageContent.objects.create(content=content, profile=profile_obj)
+            dm_obj.direct_message_contents.add(dm_content_obj)
+        return dm_obj, item_obj
+
+    def test_会話が最後のメッセージの新しい順に返る(self):
+        dm_obj1, item_obj1 = self.createThread([(self.participant_profile_obj, "hola")])
+        dm_obj2, item_obj2 = self.createThread([])
+        other_user_obj, other_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="other_user"))
+        self.createThread([], owner_user_obj=other_user_obj)
+        # dm_obj1に新しいメッセージが届くと先頭になる
+        dm_content_obj = DirectMessageContent.objects.create(content="x" * 150, profile=self.participant_profile_obj)
+        dm_obj1.direct_message_contents.add(dm_content_obj)
+
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        threads = response.data["DM_THREADS"]
+        self.assertEqual([thread["id"] for thread in threads], [dm_obj1.id, dm_obj2.id])
+        self.assertEqual(threads[0]["item_title"], item_obj1.title)
+        self.assertEqual(threads[0]["other_profile"]["id"], self.participant_profile_obj.id)
+        self.assertEqual(threads[0]["other_profile"]["username"], self.participant_user_obj.username)
+        self.assertEqual(threads[0]["last_message"], "x" * 100)
+        self.assertEqual(threads[0]["last_message_profile_id"], self.participant_profile_obj.id)
+        self.assertEqual(threads[0]["unread_count"], 2)
+        self.assertIsNone(threads[1]["last_message"])
+        self.assertEqual(threads[1]["unread_count"], 0)
+        self.assertIsNone(response.data["NEXT_CURSOR"])
+
+    def test_page_sizeを指定するとページ分割される(self):
+        dm_ids = [self.createThread([])[0].id for _ in range(3)]
+        response = self.client.get(self.URL, {"page_size": 2})
+        self.assertEqual([thread["id"] for thread in response.data["DM_THREADS"]], dm_ids[::-1][:2])
+        response = self.client.get(self.URL, {"page_size": 2, "cursor": response.data["NEXT_CURSOR"]})
+        self.assertEqual([thread["id"] for thread in response.data["DM_THREADS"]], dm_ids[:1])
+        self.assertIsNone(response.data["NEXT_CURSOR"])
+
+    def test_会話の数に関わらず発行されるクエリの数は一定である(self):
+        self.createThread([(self.participant_profile_obj, "hola")])
+        with CaptureQueriesContext(connection) as queries_with_1:
+            self.client.get(self.URL)
+        for _ in range(3):
+            self.createThread([(self.participant_profile_obj, "hola"), (self.owner_profile_obj, "gracias")])
+        with CaptureQueriesContext(connection) as queries_with_4:
+            response = self.client.get(self.URL)
+        self.assertEqual(len(response.data["DM_THREADS"]), 4)
+        self.assertEqual(len(queries_with_1.captured_queries), len(queries_with_4.captured_queries))
+
+
+class DirectMessageReadAPIViewTest(TestCase):
+
+    """テスト対象
+    api/Views/direct_message_views.py DirectMessageReadAPIView#post
+    direct_messages/inbox.py markDirectMessageRead
+    avisos/models.py dm_content_m2m_receiver
+
+    endpoint: api/direct_messages/<int:pk>/read/
+    name: "api:direct_message_read"
+    """
+    """テスト項目
+    相手のメッセージが何件届いても未読のAvisoは会話ごとに1つである
+    未読のAvisoの有無はDirectMessageの行をロックしてから確認する(同時に送信されても2つ作成されない)
+    message_idまで既読になり、未読数はそれより新しい相手のメッセージの数になる
+    古いmessage_idを指定してもlast_read_message_idは戻らない
+    全て既読にすると会話のAvisoも既読になり、unread_aviso_countが減る
+    会話の参加者でない場合は403が返る
+    """
+
+    def setUp(self):
+        category_obj = pickUp_category_obj_for_test()
+        self.owner_user_obj, self.owner_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="owner_user"))
+        self.participant_user_obj, self.participant_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="participant_user"))
+        item_obj = create_item_for_test(self.owner_user_obj, create_item_data(category_obj))
+        solicitud_obj = create_solicitud_for_test(item_obj, self.participant_user_obj, create_solicitud_data(message=None))
+        self.dm_obj, self.item_obj = create_direct_message_for_test(solicitud_obj)
+        self.URL = "/api/direct_messages/{}/read/".format(self.dm_obj.id)
+        # participantからownerへのメッセージ3件
+        self.dm_content_objects = []
+        for count in range(3):
+            dm_content_obj = DirectMessageContent.objects.create(content="mensaje{}".format(count), profile=self.participant_profile_obj)
+            self.dm_obj.direct_message_contents.add(dm_content_obj)
+            self.dm_content_objects.append(dm_content_obj)
+
+        Token.objects.create(key="TOKEN_VALUE", user=self.owner_user_obj)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+
+    def getDmContentAvisos(self):
+        return Aviso.objects.filter(aviso_user=self.owner_profile_obj, content_type__model="directmessagecontent")
+
+    def test_未読のAvisoは会話ごとに1つである(self):
+        self.assertEqual(self.getDmContentAvisos().count(), 1)
+
+    def test_未読のAvisoの有無はDirectMessageの行をロックしてから確認する(self):
+        dm_content_obj = DirectMessageContent.objects.create(content="otra vez", profile=self.participant_profile_obj)
+        with CaptureQueriesContext(connection) as context:
+            self.dm_obj.direct_message_contents.add(dm_content_obj)
+        sqls = [query["sql"] for query in context.captured_queries]
+        lock_index = next(
+            index for index, sql in enumerate(sqls)
+            if "FOR UPDATE" in sql and DirectMessage._meta.db_table in sql)
+        exists_index = next(
+            index for index, sql in enumerate(sqls)
+            if sql.startswith("SELECT") and Aviso._meta.db_table in sql and "LIMIT 1" in sql)
+        self.assertLess(lock_index, exists_index)
+        self.assertEqual(self.getDmContentAvisos().count(), 1)
+
+    def test_message_idまで既読になる(self):
+        response = self.client.post(self.URL, {"message_id": self.dm_content_objects[0].id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"LAST_READ_MESSAGE_ID": self.dm_content_objects[0].id, "UNREAD_COUNT": 2})
+        self.assertEqual(
+            DirectMessage.objects.get(id=self.dm_obj.id).owner_last_read_message_id, self.dm_content_objects[0].id)
+        self.assertFalse(self.getDmContentAvisos().get().checked)
+
+    def test_古いmessage_idを指定しても戻らない(self):
+        self.client.post(self.URL, {"message_id": self.dm_content_objects[1].id}, format="json")
+        response = self.client.post(self.URL, {"message_id": self.dm_content_objects[0].id}, format="json")
+        self.assertEqual(response.data["LAST_READ_MESSAGE_ID"], self.dm_content_objects[1].id)
+        self.assertEqual(response.data["UNREAD_COUNT"], 1)
+
+    def test_全て既読にすると会話のAvisoも既読になる(self):
+        unread_aviso_count = Profile.objects.get(id=self.owner_profile_obj.id).unread_aviso_count
+        response = self.client.post(self.URL)
+        self.assertEqual(response.data, {"LAST_READ_MESSAGE_ID": self.dm_content_objects[-1].id, "UNREAD_COUNT": 0})
+        self.assertTrue(self.getDmContentAvisos().get().checked)
+        self.assertEqual(Profile.objects.get(id=self.owner_profile_obj.id).unread_aviso_count, unread_aviso_count - 1)
+
+        # 自分のメッセージは未読数に含まれない
+        dm_content_obj = DirectMessageContent.objects.create(content="gracias", profile=self.owner_profile_obj)
+        self.dm_obj.direct_message_contents.add(dm_content_obj)
+        response = self.client.post(self.URL, {"message_id": self.dm_content_objects[-1].id}, format="json")
+        self.assertEqual(response.data["UNREAD_COUNT"], 0)
+
+    def test_会話の参加者でない場合は403が返る(self):
+        other_user_obj, other_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="other_user"))
+        Token.objects.create(key="OTHER_TOKEN_VALUE", user=other_user_obj)
+        self.client.credentials(HTTP_AUTHORIZATION='Token OTHER_TOKEN_VALUE')
+        response = self.client.post(self.URL)
+        self.assertEqual(response.status_code, 403)
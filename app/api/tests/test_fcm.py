@@ -2,7 +2,10 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
 from django.test import TestCase
 from rest_framework.test import APIClient
+from api.constants import FirebaseCloudMessagingCase
+from api.fcm_sender import FcmNotificationSender, FCM_MULTICAST_LIMIT, makeNotification
 from api.models import DeviceToken
+from firebase_admin import messaging
 
 
 class DeviceTokenDealAPIVeiwTest(TestCase):
@@ -80,3 +83,76 @@ class DeviceTokenDealAPIVeiwTest(TestCase):
         device_token_obj = DeviceToken.objects.get(
             user__username="access_user")
         self.assertEqual(device_token_obj.device_token, "CHANGE_DEVICE_TOKEN")
+
+
+class FakeMulticastTransport(object):
+    """
+    FcmNotificationSenderに渡すsend_multicastの代わり。FCMに接続せずにMulticastMessageを記録する。
+    unregistered_tokensに含まれるデバイストークンにはUnregisteredErrorを返す。
+    """
+
+    def __init__(self, unregistered_tokens=()):
+        self.unregistered_tokens = set(unregistered_tokens)
+        self.messages = []
+
+    def __call__(self, multicast_message):
+        self.messages.append(multicast_message)
+        responses = []
+        for token in multicast_message.tokens:
+            if token in self.unregistered_tokens:
+                responses.append(messaging.SendResponse(None, messaging.UnregisteredError("unregistered")))
+            else:
+                responses.append(messaging.SendResponse({"name": "projects/test/messages/" + token}, None))
+        return messaging.BatchResponse(responses)
+
+
+class FcmNotificationSenderTest(TestCase):
+    """テスト対象
+    api/fcm_sender.py FcmNotificationSender#sendMulticast, sendToUsers
+    """
+    """テスト項目
+    デバイストークンはFCM_MULTICAST_LIMIT件ずつまとめて送信される
+    同じデバイストークンには1回だけ送信される
+    UnregisteredErrorのデバイストークンはfailuresに含まれ、DeviceTokenから削除される
+    sendToUsersはデバイストークンがないユーザーには送信しない
+    """
+
+    def setUp(self):
+        self.user_obj1 = User.objects.create_user(username="user1", email="user1@gmail.com", password='12345')
+        self.user_obj2 = User.objects.create_user(username="user2", email="user2@gmail.com", password='12345')
+        self.user_obj3 = User.objects.create_user(username="user3", email="user3@gmail.com", password='12345')
+        DeviceToken.objects.filter(user=self.user_obj1).update(device_token="token1")
+        DeviceToken.objects.filter(user=self.user_obj2).update(device_token="token2")
+
+    def test_デバイストークンはFCM_MULTICAST_LIMIT件ずつまとめて送信される(self):
+        transport = FakeMulticastTransport()
+        tokens = ["token{}".format(num) for num in range(FCM_MULTICAST_LIMIT * 2 + 10)]
+        result = FcmNotificationSender(send_multicast=transport).sendMulticast(tokens, makeNotification())
+        self.assertEqual([len(message.tokens) for message in transport.messages], [FCM_MULTICAST_LIMIT, FCM_MULTICAST_LIMIT, 10])
+        self.assertEqual(result.success_count, len(tokens))
+        self.assertEqual(result.failures, {})
+
+    def test_同じデバイストークンには1回だけ送信される(self):
+        transport = FakeMulticastTransport()
+        result = FcmNotificationSender(send_multicast=transport).sendMulticast(
+            ["token1", "token1", None, "token2"], makeNotification())
+        self.assertEqual(transport.messages[0].tokens, ["token1", "token2"])
+        self.assertEqual(result.success_count, 2)
+
+    def test_UnregisteredErrorのデバイストークンはDeviceTokenから削除される(self):
+        transport = FakeMulticastTransport(unregistered_tokens=["token2"])
+        result = FcmNotificationSender(send_multicast=transport).sendMulticast(["token1", "token2"], makeNotification())
+        self.assertEqual(result.success_count, 1)
+        self.assertEqual(list(result.failures.keys()), ["token2"])
+        self.assertEqual(result.unregistered_tokens, ["token2"])
+        self.assertEqual(DeviceToken.objects.get(user=self.user_obj1).device_token, "token1")
+        self.assertEqual(DeviceToken.objects.get(user=self.user_obj2).device_token, None)
+
+    def test_sendToUsersはデバイストークンがないユーザーには送信しない(self):
+        transport = FakeMulticastTransport()
+        FcmNotificationSender(send_multicast=transport).sendToUsers(
+            [self.user_obj1.id, self.user_obj2.id, self.user_obj3.id],
+            case=FirebaseCloudMessagingCase.CREATED_DM_CONTENT)
+        self.assertEqual(len(transport.messages), 1)
+        self.assertEqual(sorted(transport.messages[0].tokens), ["token1", "token2"])
+        self.assertEqual(transport.messages[0].notification.title, "Su mensaje ha sido recibido.")
@@ -1,5 +1,8 @@
+import os
+from unittest import mock
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
+from django.db import DatabaseError
 from django.test import TestCase
 from rest_framework.test import APIClient
 from prefecturas.load import (
@@ -93,3 +96,93 @@ class GetRegionDataByPointAPIViewTest(TestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
         response = self.client.post("/api/util/region/", data)
         self.assertEqual(response.data["adm1"], EXPECTED)
+
+
+class GetRegionDataByPointListAPIViewTest(TestCase):
+    """テスト対象
+    api/views.py GetRegionDataByPointListAPIView#post
+    endpoint: api/util/region/list/
+    name: -
+    """
+    """テスト項目
+    wkt_pointsを送信した場合、送信した順序でadm1, adm2が返る。
+    pointsを送信した場合、送信した順序でadm1, adm2が返る。
+    座標の数に関わらずクエリは1回である(認証を除く)。
+    LAUNCH_ENVがDOCKERの場合は緯度と経度を入れ替えて判定する。
+    未認証の場合は401が返る。
+    座標の数がMAX_POINTSを超える場合はfailが返る。
+    DBが利用できない場合は503が返る。
+    """
+
+    def setUp(self):
+        DepartamentoInstanceMaker().run()
+        MunicipioInstanceMaker().run()
+        access_user = User.objects.create_user(
+            username="access_user",
+            email="test_access_user@gmail.com",
+            password='12345')
+        Token.objects.create(key="TOKEN_VALUE", user=access_user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token TOKEN_VALUE')
+        # テストのポリゴンは緯度と経度を入れ替えずに読み込まれる(CIRCLECIと同じ)
+        patcher = mock.patch.dict(os.environ, {"LAUNCH_ENV": "CIRCLECI"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_wkt_pointsを送信した場合_送信した順序でadm1とadm2が返る(self):
+        data = {"wkt_points": [
+            "SRID=4326;POINT (-91.51643849909306 14.84320911634316)",
+            "SRID=4326;POINT (-92.3129813 14.9114382)",  # タパチュラの座標
+        ]}
+        response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.data["REGION_LIST"], [
+            {"adm1": "Quetzaltenango", "adm2": "Quetzaltenango"},
+            {"adm1": None, "adm2": None},
+        ])
+
+    def test_pointsを送信した場合_送信した順序でadm1とadm2が返る(self):
+        data = {"points": [
+            {"lat": 14.9114382, "lng": -92.3129813},
+            {"lat": 14.84320911634316, "lng": -91.51643849909306},
+        ]}
+        response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.data["REGION_LIST"], [
+            {"adm1": None, "adm2": None},
+            {"adm1": "Quetzaltenango", "adm2": "Quetzaltenango"},
+        ])
+
+    def test_座標の数に関わらずクエリは1回である(self):
+        data = {"points": [{"lat": 14.84320911634316, "lng": -91.51643849909306}] * 500}
+        with self.assertNumQueries(2):  # Tokenによる認証と地域の判定
+            response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(len(response.data["REGION_LIST"]), 500)
+
+    def test_LAUNCH_ENVがDOCKERの場合は緯度と経度を入れ替えて判定する(self):
+        # DOCKERではポリゴンが(緯度, 経度)で保存されている。テストのポリゴンはそうではないので、
+        # 入れ替えた座標を送ると入れ替えた結果がQuetzaltenangoの座標になる
+        data = {"points": [{"lat": -91.51643849909306, "lng": 14.84320911634316}]}
+        with mock.patch.dict(os.environ, {"LAUNCH_ENV": "DOCKER"}):
+            response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.data["REGION_LIST"], [{"adm1": "Quetzaltenango", "adm2": "Quetzaltenango"}])
+
+        data = {"points": [{"lat": 14.84320911634316, "lng": -91.51643849909306}]}
+        with mock.patch.dict(os.environ, {"LAUNCH_ENV": "DOCKER"}):
+            response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.data["REGION_LIST"], [{"adm1": None, "adm2": None}])
+
+    def test_未認証の場合は401が返る(self):
+        self.client.credentials()
+        data = {"points": [{"lat": 14.84320911634316, "lng": -91.51643849909306}]}
+        response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_座標の数がMAX_POINTSを超える場合はfailが返る(self):
+        data = {"points": [{"lat": 14.84320911634316, "lng": -91.51643849909306}] * 1001}
+        response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.data["result"], "fail")
+
+    def test_DBが利用できない場合は503が返る(self):
+        data = {"points": [{"lat": 14.84320911634316, "lng": -91.51643849909306}]}
+        with mock.patch("prefecturas.resolver.RegionResolver.resolveMany", side_effect=DatabaseError("down")):
+            response = self.client.post("/api/util/region/list/", data, format="json")
+        self.assertEqual(response.status_code, 503)
@@ -1,10 +1,24 @@
 # coding: utf-8
+from unittest import mock
 from django.test import TestCase
 from rest_framework.test import APIClient
 from rest_framework.authtoken.models import Token
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse_lazy
+from django.utils import timezone
+import datetime
 from categories.models import Category
+from direct_messages.models import DirectMessage
+from direct_messages.models import DirectMessageContent
+from feedback.models import Feedback
 from items.models import Item
+from items.home_feed import home_feed_cache
+from api.serializers import ProfileSummarySerializer
+from item_contacts.models import ItemContact
+from profiles.models import Profile
+from solicitudes.models import Solicitud
 from django.contrib.auth.models import User
 from config.tests.utils import (
     pickUp_category_obj_for_test,
@@ -342,3 +356,397 @@ class ItemDetailSerializerAPIViewPATCHTest(TestCase):
         item_obj1_after = Item.objects.get(title=self.item_obj1.title)
         self.assertEqual(item_obj1_after.radius, 1000)
         self.assertNotEqual(item_obj1_before.radius, item_obj1_after.radius)
+
+
+class ItemListAPIViewQueryCountTest(TestCase):
+    """テスト目的
+    記事一覧を返すAPIViewのクエリ数が記事数に依存しないことを担保する
+    """
+    """テスト対象
+    api/querysets.py prefetchForItemSerializer
+    endpoint: 'api/items/list/'
+    name: 'api:item_list'
+    """
+    """テスト項目
+    済 記事が1件の場合と3件の場合で発行されるクエリの数が等しい
+    済 item_contacts, direct_message_contentsは時系列順に出力される
+    """
+
+    def setUp(self):
+        """テスト環境
+        favorite_users, item_contacts, solicitudes, direct_message(direct_message_contents含む)を
+        すべて持つItemオブジェクトを作成する。関連するProfileオブジェクトはfeedbackを持つ。
+        """
+        self.category_obj = Category.objects.create(number="1")
+        self.post_user = User.objects.create_user(username="post_user", email="post_user@gmail.com", password="12345")
+        self.access_user = User.objects.create_user(username="access_user", email="access_user@gmail.com", password="12345")
+        self.post_profile = Profile.objects.get(user=self.post_user)
+        self.access_profile = Profile.objects.get(user=self.access_user)
+        for profile_obj, evaluator in ((self.post_profile, self.access_user), (self.access_profile, self.post_user)):
+            profile_obj.feedback.add(Feedback.objects.create(evaluator=evaluator, content="bien", level=5))
+
+    def createItem(self, n):
+        item_obj = Item.objects.create(
+            user=self.post_user,
+            title="テストアイテム{}".format(n),
+            description="説明です。",
+            category=self.category_obj,
+            adm1="Quetzaltenango",
+            adm2="Quetzaltenango")
+        item_obj.favorite_users.add(self.access_user)
+        for message in ("コメント1", "コメント2"):
+            item_obj.item_contacts.add(ItemContact.objects.create(post_user=self.access_profile, message=message))
+        item_obj.solicitudes.add(Solicitud.objects.create(applicant=self.access_profile, message="申請内容"))
+
+        dm_obj = DirectMessage.objects.create(owner=self.post_profile, participant=self.access_profile)
+        item_obj.direct_message = dm_obj
+        item_obj.save()
+        for profile_obj in (self.post_profile, self.access_profile):
+            dm_obj.direct_message_contents.add(
+                DirectMessageContent.objects.create(content="メッセージ", profile=profile_obj))
+        return item_obj
+
+    def countQueries(self):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get("/api/items/list/")
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_記事が1件の場合と3件の場合で発行されるクエリの数が等しい(self):
+        self.createItem(1)
+        count_with_one_item, response = self.countQueries()
+        self.assertEqual(len(response.data["ITEM_OBJECTS"]), 1)
+
+        self.createItem(2)
+        self.createItem(3)
+        count_with_three_items, response = self.countQueries()
+        self.assertEqual(len(response.data["ITEM_OBJECTS"]), 3)
+        self.assertEqual(count_with_one_item, count_with_three_items)
+
+    def test_item_contactsとdirect_message_contentsは時系列順に出力される(self):
+        self.createItem(1)
+        count, response = self.countQueries()
+        item_data = response.data["ITEM_OBJECTS"][0]
+        self.assertEqual([c["message"] for c in item_data["item_contacts"]], ["コメント1", "コメント2"])
+        profiles = [c["profile"]["user"]["username"] for c in item_data["direct_message"]["direct_message_contents"]]
+        self.assertEqual(profiles, ["post_user", "access_user"])
+
+
+class ItemSummaryViewTest(TestCase):
+    """テスト目的
+    ?view=summaryを指定した場合にカード表示用の簡易なデータが返ることを担保する
+    """
+    """テスト対象
+    api/Views/item_views.py ItemCategoryListAPIView#get
+    endpoint: 'api/items/category/<int:pk>/items/list/'
+    name: -
+    """
+    """テスト項目
+    済 ?view=summaryを指定した場合はカード表示用の項目だけが返る
+    済 ?view=summaryを指定した場合はfavorite_users, item_contacts, solicitudesの件数が返る
+    済 ?view=summaryを指定した場合のクエリは1回である
+    済 ?view=summaryを指定しない場合はItemSerializerの項目が返る
+    """
+    url = "/api/items/category/500/items/list/"
+
+    def setUp(self):
+        category_obj = Category.objects.create(number="1")
+        post_user = User.objects.create_user(username="post_user", email="post_user@gmail.com", password="12345")
+        access_user = User.objects.create_user(username="access_user", email="access_user@gmail.com", password="12345")
+        access_profile = Profile.objects.get(user=access_user)
+        self.item_obj = Item.objects.create(
+            user=post_user,
+            title="テストアイテム",
+            description="説明です。",
+            price=100,
+            category=category_obj,
+            adm1="Quetzaltenango",
+            adm2="Quetzaltenango")
+        self.item_obj.favorite_users.add(access_user)
+        for message in ("コメント1", "コメント2"):
+            self.item_obj.item_contacts.add(ItemContact.objects.create(post_user=access_profile, message=message))
+        self.item_obj.solicitudes.add(Solicitud.objects.create(applicant=access_profile, message="申請内容"))
+
+    def test_view_summaryを指定した場合はカード表示用の項目だけが返る(self):
+        response = APIClient().get(self.url, {"view": "summary"})
+        item_data = response.data["ITEM_OBJECTS"][0]
+        self.assertEqual(set(item_data.keys()), {
+            "id", "title", "price", "category", "adm1", "adm2", "image1", "created_at",
+            "favorite_count", "item_contact_count", "solicitud_count"})
+        self.assertEqual(item_data["id"], self.item_obj.id)
+        self.assertEqual(item_data["category"], "1")
+        self.assertEqual(item_data["image1"], self.item_obj.image1.url)
+
+    def test_view_summaryを指定した場合は関連オブジェクトの件数が返る(self):
+        response = APIClient().get(self.url, {"view": "summary"})
+        item_data = response.data["ITEM_OBJECTS"][0]
+        self.assertEqual(item_data["favorite_count"], 1)
+        self.assertEqual(item_data["item_contact_count"], 2)
+        self.assertEqual(item_data["solicitud_count"], 1)
+
+    def test_view_summaryを指定した場合のクエリは1回である(self):
+        client = APIClient()
+        with self.assertNumQueries(1):
+            client.get(self.url, {"view": "summary"})
+
+    def test_view_summaryを指定しない場合はItemSerializerの項目が返る(self):
+        response = APIClient().get(self.url)
+        item_data = response.data["ITEM_OBJECTS"][0]
+        self.assertEqual(len(item_data["item_contacts"]), 2)
+        self.assertEqual(item_data["category"], {"number": "1"})
+
+
+class ItemKeysetPaginationTest(TestCase):
+    """テスト目的
+    記事一覧のAPIが(created_at, id)のcursorでページ分割されることを担保する
+    """
+    """テスト対象
+    api/pagination.py ItemKeysetPagination
+    endpoint: 'api/items/category/<int:pk>/items/list/'
+    name: -
+    """
+    """テスト項目
+    済 page_sizeを指定した場合はcursorをたどることで全記事が新しい順に重複なく取得できる
+    済 最後のページのNEXT_CURSORはNoneである
+    済 created_atが同じ記事はidの降順に並ぶ
+    済 不正なcursorの場合は404が返る
+    済 page_size, cursorを指定しない場合は従来通り全件が返る
+    """
+    url = "/api/items/category/500/items/list/"
+
+    def setUp(self):
+        category_obj = Category.objects.create(number="1")
+        post_user = User.objects.create_user(username="post_user", email="post_user@gmail.com", password="12345")
+        now = timezone.now()
+        # 4件目と5件目はcreated_atが同じ
+        created_at_list = [now - datetime.timedelta(days=n) for n in (4, 3, 2, 1, 1)]
+        for n, created_at in enumerate(created_at_list):
+            Item.objects.create(
+                user=post_user,
+                title="テストアイテム{}".format(n),
+                description="説明です。",
+                category=category_obj,
+                created_at=created_at)
+        self.expected_ids = list(Item.objects.order_by("-created_at", "-id").values_list("id", flat=True))
+
+    def test_page_sizeを指定した場合はcursorをたどることで全記事が新しい順に重複なく取得できる(self):
+        client = APIClient()
+        ids = []
+        params = {"page_size": 2}
+        for n in range(3):
+            response = client.get(self.url, params)
+            ids += [item_data["id"] for item_data in response.data["ITEM_OBJECTS"]]
+            params["cursor"] = response.data["NEXT_CURSOR"]
+        self.assertEqual(ids, self.expected_ids)
+
+    def test_最後のページのNEXT_CURSORはNoneである(self):
+        response = APIClient().get(self.url, {"page_size": 5})
+        self.assertEqual(len(response.data["ITEM_OBJECTS"]), 5)
+        self.assertIsNone(response.data["NEXT_CURSOR"])
+
+    def test_created_atが同じ記事はidの降順に並ぶ(self):
+        response = APIClient().get(self.url, {"page_size": 1})
+        response = APIClient().get(self.url, {"page_size": 1, "cursor": response.data["NEXT_CURSOR"]})
+        self.assertEqual(response.data["ITEM_OBJECTS"][0]["id"], self.expected_ids[1])
+
+    def test_不正なcursorの場合は404が返る(self):
+        response = APIClient().get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_sizeとcursorを指定しない場合は従来通り全件が返る(self):
+        response = APIClient().get(self.url)
+        self.assertEqual(len(response.data["ITEM_OBJECTS"]), 5)
+        self.assertNotIn("NEXT_CURSOR", response.data)
+
+
+class ItemHomeListAPIViewCacheTest(TestCase):
+    """テスト目的
+    ホーム画面の記事一覧がキャッシュから返され、記事の変更で無効になることを担保する
+    """
+    """テスト対象
+    items/home_feed.py HomeFeedCache
+    endpoint: 'api/items/home/list/'
+    name: "api:item_home_list"
+    """
+    """テスト項目
+    済 summaryでpage_sizeを指定した場合、2回目のリクエストではDBにアクセスしない
+    済 fullはキャッシュした記事のidから出力するので、Profileの変更が次のリクエストで返る
+    済 Profile、Userの変更ではキャッシュは無効にならない
+    済 記事が作成された場合は次のリクエストで作成された記事が返る
+    済 記事が非公開(active=False)になった場合は次のリクエストで記事が返らない
+    済 summaryとfullは別々にキャッシュされる
+    済 page_sizeを指定しないItemSerializerの一覧は記事のidのみキャッシュする
+    済 page_sizeを指定しないsummaryはHOME_FEED_MAX_CACHED_ITEMSを超えるグループをキャッシュしない
+    済 キャッシュした画像のURLはリクエストのホストを含まない
+    """
+    url = "/api/items/home/list/"
+
+    def setUp(self):
+        cache.clear()
+        self.category_obj = Category.objects.create(number="1")
+        self.post_user = User.objects.create_user(username="post_user", email="post_user@gmail.com", password="12345")
+        self.item_obj = self.createItem("テストアイテム1")
+
+    def createItem(self, title):
+        return Item.objects.create(
+            user=self.post_user,
+            title=title,
+            description="説明です。",
+            category=self.category_obj)
+
+    def test_summaryでpage_sizeを指定した場合2回目のリクエストではDBにアクセスしない(self):
+        client = APIClient()
+        client.get(self.url, {"view": "summary", "page_size": 10})
+        with self.assertNumQueries(0):
+            response = client.get(self.url, {"view": "summary", "page_size": 10})
+        self.assertEqual(len(response.data["ITEM_OBJECTS_COSAS"]), 1)
+
+    def test_fullはProfileの変更が次のリクエストで返る(self):
+        client = APIClient()
+        client.get(self.url, {"page_size": 10})
+        self.post_user.username = "renamed_user"
+        self.post_user.save()
+        response = client.get(self.url, {"page_size": 10})
+        self.assertEqual(response.data["ITEM_OBJECTS_COSAS"][0]["user"]["username"], "renamed_user")
+
+    def test_ProfileとUserの変更ではキャッシュは無効にならない(self):
+        client = APIClient()
+        client.get(self.url, {"view": "summary", "page_size": 10})
+        profile_obj = Profile.objects.get(user=self.post_user)
+        profile_obj.description = "自己紹介"
+        profile_obj.save()
+        self.post_user.username = "renamed_user"
+        self.post_user.save()
+        with self.assertNumQueries(0):
+            client.get(self.url, {"view": "summary", "page_size": 10})
+
+    def test_page_sizeを指定しないItemSerializerの一覧は記事のidのみキャッシュする(self):
+        client = APIClient()
+        response = client.get(self.url)
+        self.assertEqual(response.data["ITEM_OBJECTS_COSAS"][0]["id"], self.item_obj.id)
+        buckets = home_feed_cache.getBuckets("api:full:all", lambda category_group: self.fail("キャッシュされていない"))
+        self.assertEqual(buckets["cosas"], ([self.item_obj.id], None))
+
+    def test_page_sizeを指定しないsummaryは上限を超えるグループをキャッシュしない(self):
+        client = APIClient()
+        with mock.patch("api.Views.item_views.HOME_FEED_MAX_CACHED_ITEMS", 0):
+            client.get(self.url, {"view": "summary"})
+            with CaptureQueriesContext(connection) as context:
+                client.get(self.url, {"view": "summary"})
+        self.assertGreater(len(context.captured_queries), 0)
+
+        client.get(self.url, {"view": "summary"})
+        with self.assertNumQueries(0):
+            client.get(self.url, {"view": "summary"})
+
+    def test_キャッシュした画像のURLはリクエストのホストを含まない(self):
+        client = APIClient()
+        client.get(self.url, {"view": "summary", "page_size": 10}, HTTP_HOST="example.com")
+        response = client.get(self.url, {"view": "summary", "page_size": 10}, HTTP_HOST="other.example.com")
+        self.assertEqual(response.data["ITEM_OBJECTS_COSAS"][0]["image1"], self.item_obj.image1.url)
+
+    def test_記事が作成された場合は次のリクエストで作成された記事が返る(self):
+        client = APIClient()
+        client.get(self.url)
+        self.createItem("テストアイテム2")
+        response = client.get(self.url)
+        self.assertEqual([d["title"] for d in response.data["ITEM_OBJECTS_COSAS"]], ["テストアイテム2", "テストアイテム1"])
+
+    def test_記事が非公開になった場合は次のリクエストで記事が返らない(self):
+        client = APIClient()
+        client.get(self.url)
+        self.item_obj.active = False
+        self.item_obj.save()
+        response = client.get(self.url)
+        self.assertEqual(len(response.data["ITEM_OBJECTS_COSAS"]), 0)
+
+    def test_summaryとfullは別々にキャッシュされる(self):
+        client = APIClient()
+        client.get(self.url)
+        response = client.get(self.url, {"view": "summary"})
+        self.assertIn("favorite_count", response.data["ITEM_OBJECTS_COSAS"][0])
+        response = client.get(self.url)
+        self.assertIn("favorite_users", response.data["ITEM_OBJECTS_COSAS"][0])
+
+
+class ItemNormalizedViewTest(TestCase):
+    """テスト目的
+    ?view=normalizedを指定した場合にProfileがidのみで出力され、INCLUDEDにまとめて返ることを担保する
+    """
+    """テスト対象
+    api/serializers.py IncludedProfiles, ProfileReferenceField
+    endpoint: 'api/items/list/', "api/items/<int:pk>/"
+    """
+    """テスト項目
+    済 記事一覧ではitem_contacts, solicitudes, direct_messageのProfileがidで出力され、INCLUDEDに1回だけ出力される
+    済 記事詳細ではprofile_obj_serializerが出品者のProfileのidになり、INCLUDEDに含まれる
+    済 記事一覧のクエリの数は記事数に依存せず、?view=normalizedを指定しない場合より少ない
+    """
+
+    def setUp(self):
+        self.category_obj = Category.objects.create(number="1")
+        self.post_user = User.objects.create_user(username="post_user", email="post_user@gmail.com", password="12345")
+        self.access_user = User.objects.create_user(username="access_user", email="access_user@gmail.com", password="12345")
+        self.post_profile = Profile.objects.get(user=self.post_user)
+        self.access_profile = Profile.objects.get(user=self.access_user)
+        for profile_obj, evaluator in ((self.post_profile, self.access_user), (self.access_profile, self.post_user)):
+            profile_obj.feedback.add(Feedback.objects.create(evaluator=evaluator, content="bien", level=5))
+
+    def createItem(self, n):
+        item_obj = Item.objects.create(
+            user=self.post_user,
+            title="テストアイテム{}".format(n),
+            description="説明です。",
+            category=self.category_obj,
+            adm1="Quetzaltenango",
+            adm2="Quetzaltenango")
+        item_obj.item_contacts.add(ItemContact.objects.create(post_user=self.access_profile, message="コメント"))
+        item_obj.solicitudes.add(Solicitud.objects.create(applicant=self.access_profile, message="申請内容"))
+        dm_obj = DirectMessage.objects.create(owner=self.post_profile, participant=self.access_profile)
+        item_obj.direct_message = dm_obj
+        item_obj.save()
+        dm_obj.direct_message_contents.add(DirectMessageContent.objects.create(content="メッセージ", profile=self.post_profile))
+        return item_obj
+
+    def countQueries(self, url, params=None):
+        client = APIClient()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_記事一覧ではProfileがidで出力されINCLUDEDに1回だけ出力される(self):
+        self.createItem(1)
+        self.createItem(2)
+        count, response = self.countQueries("/api/items/list/", {"view": "normalized"})
+        item_data = response.data["ITEM_OBJECTS"][0]
+        self.assertEqual(item_data["item_contacts"][0]["post_user"], self.access_profile.id)
+        self.assertEqual(item_data["solicitudes"][0]["applicant"], self.access_profile.id)
+        self.assertEqual(item_data["direct_message"]["owner"], self.post_profile.id)
+        self.assertEqual(item_data["direct_message"]["direct_message_contents"][0]["profile"], self.post_profile.id)
+
+        profiles = response.data["INCLUDED"]["profiles"]
+        self.assertEqual(set(profiles.keys()), {str(self.post_profile.id), str(self.access_profile.id)})
+        self.assertEqual(profiles[str(self.post_profile.id)]["username"], "post_user")
+        self.assertNotIn("feedback", profiles[str(self.post_profile.id)])
+        # 差分同期のPROFILESと同じ形式(ProfileSummarySerializer)である
+        self.assertEqual(set(profiles[str(self.post_profile.id)].keys()), set(ProfileSummarySerializer.Meta.fields))
+
+    def test_記事詳細ではprofile_obj_serializerが出品者のProfileのidになる(self):
+        item_obj = self.createItem(1)
+        count, response = self.countQueries("/api/items/{}/".format(item_obj.id), {"view": "normalized"})
+        self.assertEqual(response.data["profile_obj_serializer"], self.post_profile.id)
+        self.assertIn(str(self.post_profile.id), response.data["INCLUDED"]["profiles"])
+        self.assertEqual(response.data["item_obj_serializer"]["id"], item_obj.id)
+
+    def test_記事一覧のクエリの数は記事数に依存せず指定しない場合より少ない(self):
+        self.createItem(1)
+        count_with_one_item, response = self.countQueries("/api/items/list/", {"view": "normalized"})
+        self.createItem(2)
+        self.createItem(3)
+        count_with_three_items, response = self.countQueries("/api/items/list/", {"view": "normalized"})
+        self.assertEqual(count_with_one_item, count_with_three_items)
+
+        count_without_normalized, response = self.countQueries("/api/items/list/")
+        self.assertLess(count_with_three_items, count_without_normalized)
@@ -18,7 +18,11 @@ from api.views import SolicitudListAPIView
 from api.views import SolicitudListAPIViewBySolicitudObjAPIView
 from api.views import SubsolicitudListOrDirectMessageListAPIView
 from api.views import GetRegionDataByPointAPIView
+from api.views import GetRegionDataByPointListAPIView
 from api.views import CustomeRegisterView
+from api.Views.aviso_views import AvisoCheckAllAPIView
+from api.Views.direct_message_views import DirectMessageInboxAPIView
+from api.Views.direct_message_views import DirectMessageReadAPIView
 from api.Views.fcm_views import DeviceTokenDealAPIVeiw
 from api.Views.profile_views import ProfileAPIView
 from api.Views.item_views import ItemListAPIView
@@ -30,6 +34,7 @@ from api.Views.item_views import ItemFavoriteAPIView
 from api.Views.item_views import ItemFavoriteListAPIVIiew
 from api.Views.item_views import ItemCategoryListAPIView
 from api.Views.item_views import ItemCategoryLocalListAPIView
+from api.Views.item_views import ItemSearchAPIView
 
 
 app_name = "api"
@@ -44,6 +49,7 @@ urlpatterns = [
     path('items/home/list/', ItemHomeListAPIView.as_view(), name='item_home_list'),
     path('items/category/<int:pk>/items/list/', ItemCategoryListAPIView.as_view(),),
     path('items/category/<int:pk>/items/list/local/', ItemCategoryLocalListAPIView.as_view(),),
+    path('items/search/', ItemSearchAPIView.as_view(), name='item_search'),
     path('items/<int:pk>/', ItemDetailSerializerAPIView.as_view(), name="item_detail"),
     path('items/user/item_favorite_list/', ItemFavoriteListAPIVIiew.as_view()),
     path('items/test/', TestAPIView.as_view(),),
@@ -58,9 +64,12 @@ urlpatterns = [
     path('area_setting/', AreaSettingApiView.as_view(),),
     path('area_setting_geo/', AreaSettingWithGeoJsonApiView.as_view()),
     path('avisos/list/', AvisosAllListAPIView.as_view(),),
+    path('avisos/check/', AvisoCheckAllAPIView.as_view(),),
     path('contacts/', ContactAPIView.as_view(),),
     # directMessage
     path('item/<int:pk>/direct_message_content_list/', DirectMessageContentListAPIView.as_view(), name='DirectMessageContentListAPIView'),
+    path('direct_messages/inbox/', DirectMessageInboxAPIView.as_view(), name='direct_message_inbox'),
+    path('direct_messages/<int:pk>/read/', DirectMessageReadAPIView.as_view(), name='direct_message_read'),
     path('direct_message_content/<int:pk>/', DirectMessageContentAPIView.as_view(), name='DirectMessageContentAPIView'),
     path('direct_message_content/<int:pk>/ritem/', ItemObjByDirectMessageContentObjPKAPIView.as_view()),
     path('mylist/', MyItemListSerializerAPIView.as_view()),
@@ -73,5 +82,6 @@ urlpatterns = [
     path('solicitudes/solicitud/<int:pk>/solicitud_list/', SolicitudListAPIViewBySolicitudObjAPIView.as_view()),
     path('sub_solicitud_direct/<int:pk>/', SubsolicitudListOrDirectMessageListAPIView.as_view(), name='SubsolicitudListOrDirectMessageListAPIView'),
     path('util/region/', GetRegionDataByPointAPIView.as_view()),
+    path('util/region/list/', GetRegionDataByPointListAPIView.as_view()),
     path("multipoly_test/", PrefecturaAPIView.as_view()),
 ]
@@ -3,6 +3,7 @@ from django.http import Http404
 from django.core.serializers import serialize
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos.error import GEOSException
 from django.shortcuts import redirect
 from avisos.models import Aviso
 from categories.models import Category
@@ -11,25 +12,38 @@ from direct_messages.models import DirectMessageContent
 from items.models import Item
 from item_contacts.models import ItemContact
 from prefecturas.models import Prefectura, Departamento, Municipio, RegionClassed
+from prefecturas.geometry_store import RegionDataUnavailable
+from prefecturas.resolver import RegionResolver, wktToStoredPoint
 from profiles.models import Profile
 from solicitudes.models import Solicitud
 from .serializers import AvisoSerializer
 from .serializers import CategorySerializer
 from .serializers import ContactSerializer
 from .serializers import DirectMessageContentSerializer
+from .serializers import DirectMessageContentSyncSerializer
+from .serializers import IncludedProfiles
 from .serializers import ItemContactSerializer
 from .serializers import ItemSerializer
 from .serializers import ProfileSerializer
+from .serializers import ProfileSummarySerializer
 from .serializers import SolicitudSerializer
 from .utils import getTokenFromHeader
 from .utils import getUserByToken
 from .constants import SerializerContextKey
+from .pagination import AvisoKeysetPagination
+from .querysets import prefetchForAvisoSerializer, resolveAvisoContentObjects
+from .querysets import getDirectMessageContentsSince, getFeedbackPrefetchQuerySet
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.authentication import TokenAuthentication
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.throttling import ScopedRateThrottle
+from django.db import DatabaseError
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_datetime
 import json
 import os
 
@@ -512,60 +526,86 @@ class GetRegionDataByPointAPIView(APIView):
 		pointのwkt値がGuatemala国外のTapachulaの場合、adm1値はNoneになる。
 		pointのwkt値がGuatemala国外のTapachulaの場合、adm2値はNoneになる。		
 		"""
-		adm1 = None
-		adm2 = None
-
 		wkt_point = request.data["wkt_point"]
 		#test_wkt  = "SRID=4326;POINT(45.0000 45.000)"
 		print("request.data[wkt_point]")
 		print(wkt_point)
 
-		launch_env = os.environ.get("LAUNCH_ENV", default="NO_DOCKER")
-		if launch_env == "DOCKER":
-			lng = wkt_point.split(" ")[1].replace("(", "")
-			lat = wkt_point.split(" ")[2].replace(")", "")
-			text = "POINT(" + lat + " " + lng + ")"
-			point = GEOSGeometry(text)
-		elif launch_env == "NO_DOCKER":
-			# 試験的に追加
-			lng = wkt_point.split(" ")[1].replace("(", "")
-			lat = wkt_point.split(" ")[2].replace(")", "")
-			text = "POINT(" + lat + " " + lng + ")"
-			point = GEOSGeometry(text)
-		elif launch_env == "CIRCLECI":
-			point  = GEOSGeometry(wkt_point)
+		# 保存されているポリゴンの軸の順序はLAUNCH_ENVで異なるのでwktToStoredPoint()で合わせる
+		point = wktToStoredPoint(wkt_point)
 
+		#pointオブジェクト作成  WKTフォーマット: "SRID=4326;POINT(-91.5606545 14.8371541)"
 
+		#point  = GEOSGeometry(wkt_point)
 
+		# point-in-polygonの判定はPostGIS側で行う(見つからない場合はNone -> nullを返す)
+		try:
+			adm1, adm2 = RegionResolver().resolve(point)
+		except RegionDataUnavailable:
+			# 判定できない場合はGuatemala国外(null)と区別して503を返す
+			return Response({"detail": "region data is temporarily unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+		return Response({"adm1":adm1, "adm2":adm2})
 
 
-		#pointオブジェクト作成  WKTフォーマット: "SRID=4326;POINT(-91.5606545 14.8371541)"
-		
-		#point  = GEOSGeometry(wkt_point)
 
-		dep_objects = Departamento.objects.all()
-		for dep in dep_objects:
-			#print(dep.geom.geom_type)
-			central = dep.geom.centroid
-			#print(central)
-			#print(type(central))
-			#print(dep.geom.contains(central))
-			#print(point.within(dep.geom))
 
-			if dep.geom.contains(point):
-				adm1 = dep.adm1_es
-				#print("発見")
+class GetRegionDataByPointListAPIView(APIView):
 
-		if adm1 == None:
-			return Response({"adm1":adm1, "adm2": adm2}) #　値としてnullを返す
+	# 座標の数だけpoint-in-polygonの判定を行うので、認証したユーザーのみ、throttle_scopeの回数までとする
+	authentication_classes = (TokenAuthentication,)
+	permission_classes = (permissions.IsAuthenticated,)
+	throttle_classes = (ScopedRateThrottle,)
+	throttle_scope = "region_list"
 
-		rc_obj = RegionClassed.objects.get(departamento__adm1_es=adm1)
-		for muni in rc_obj.municipios.all():
-			if muni.geom.contains(point):
-				adm2 = muni.adm2_es
+	# 1リクエストで受け付ける座標の最大数
+	MAX_POINTS = 1000
 
-		return Response({"adm1":adm1, "adm2":adm2})
+	def post(self, request, *args, **kwargs):
+		"""機能
+		複数の座標に対応するadm1, adm2をまとめて取得する。
+		GetRegionDataByPointAPIViewを座標の数だけ呼び出す代わりに使う。
+
+		request.dataは以下のどちらかの形式とする
+			{"wkt_points": ["SRID=4326;POINT (-91.51 14.84)", ...]}
+			{"points": [{"lat": 14.84, "lng": -91.51}, ...]}
+
+		レスポンスのREGION_LISTはリクエストと同じ順序で{"adm1":..., "adm2":...}を返す。
+		Guatemala国外の座標の場合はadm1, adm2ともにnullとなる。
+
+		endpoint: api/util/region/list/
+		name: -
+		"""
+		"""テスト項目
+		wkt_pointsを送信した場合、送信した順序でadm1, adm2が返る。
+		pointsを送信した場合、送信した順序でadm1, adm2が返る。
+		座標の形式が不適切な場合にはResponse:failが返る。
+		未認証の場合は401が返る。
+		DBが利用できない場合は503が返る。
+		"""
+		try:
+			if "wkt_points" in request.data:
+				coordinates = []
+				for wkt in request.data["wkt_points"]:
+					point = GEOSGeometry(wkt)
+					coordinates.append((point.x, point.y))
+			else:
+				coordinates = [(float(ele["lng"]), float(ele["lat"])) for ele in request.data["points"]]
+		except (KeyError, TypeError, ValueError, AttributeError, GEOSException):
+			return Response({"result": "fail", "detail": "invalid points"})
+
+		if len(coordinates) > self.MAX_POINTS:
+			return Response({"result": "fail", "detail": "too many points"})
+
+		try:
+			regions = RegionResolver().resolveMany(coordinates)
+		except DatabaseError:
+			# GetRegionDataByPointAPIViewと同じく、判定できない場合はGuatemala国外(null)と区別して503を返す
+			return Response({"detail": "region data is temporarily unavailable"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+		serializerContext = {}
+		serializerContext["result"] = "success"
+		serializerContext[SerializerContextKey.REGION_LIST] = [{"adm1": adm1, "adm2": adm2} for adm1, adm2 in regions]
+		return Response(serializerContext)
 
 
 
@@ -618,14 +658,21 @@ class DirectMessageContentListAPIView(APIView):
 	def get(self, request, *args, **kwargs):
 		"""
 		endpoint: item/<int:pk>/direct_message_content_list/
+
+		since_idまたはsinceを指定した場合はそれより新しいメッセージのみを返す(getSyncResponse 参照)。
 		"""
 	
 		serializerContext = {}
 		pk      = self.kwargs["pk"]
 		itemObj = Item.objects.get(id=pk)
 		directMessageObj = DirectMessage.objects.get(item=itemObj)
+
+		if "since_id" in request.query_params or "since" in request.query_params:
+			return self.getSyncResponse(request, directMessageObj)
+
 		#dm_content_objects = DirectMessageContent.objects.filter(dm=directMessageObj)
-		dm_content_objects = directMessageObj.direct_message_contents.all().order_by("created_at")
+		dm_content_objects = directMessageObj.direct_message_contents.all().select_related("profile__user").prefetch_related(
+			Prefetch("profile__feedback", queryset=getFeedbackPrefetchQuerySet())).order_by("created_at", "id")
 		DMCserializer = DirectMessageContentSerializer(dm_content_objects, many=True)
 		serializerContext[SerializerContextKey.DM_CONTENT_OBJECTS_SERIALIZER] = DMCserializer.data
 
@@ -637,6 +684,41 @@ class DirectMessageContentListAPIView(APIView):
 		serializerContext["ACCESS_USER_PROFILE_SERIALIZER"] = profileSerializer.data
 		return Response(serializerContext)
 
+	def getSyncResponse(self, request, directMessageObj):
+		"""機能
+		会話の差分同期。since_id(最後に受け取ったメッセージのid)またはsince(そのcreated_at)より新しいメッセージを
+		古い順に最大DM_CONTENT_SYNC_LIMIT件返す。各メッセージの送信者はProfileのidのみで、
+		owner, participantのProfileはPROFILESに1回だけ出力する。
+
+		Returns:
+			DM_CONTENT_OBJECTS: メッセージのリスト
+			PROFILES: owner, participantのProfile
+			LAST_ID: 次回のsince_id(新しいメッセージがない場合はsince_idのまま)
+			HAS_MORE: Trueの場合はLAST_IDを指定してもう一度取得する
+		"""
+		sinceId = None
+		since   = None
+		try:
+			if request.query_params.get("since_id"):
+				sinceId = int(request.query_params["since_id"])
+			if request.query_params.get("since"):
+				since = parse_datetime(request.query_params["since"])
+				if since is None:
+					raise ValueError
+		except ValueError:
+			return Response({"result": "fail", "detail": "invalid since_id or since"}, status=status.HTTP_400_BAD_REQUEST)
+
+		dm_content_objects, hasMore = getDirectMessageContentsSince(directMessageObj, since_id=sinceId, since=since)
+		profile_objects = Profile.objects.filter(
+			id__in=[directMessageObj.owner_id, directMessageObj.participant_id]).select_related("user").order_by("id")
+
+		serializerContext = {}
+		serializerContext[SerializerContextKey.DM_CONTENT_OBJECTS] = DirectMessageContentSyncSerializer(dm_content_objects, many=True).data
+		serializerContext[SerializerContextKey.PROFILES] = ProfileSummarySerializer(profile_objects, many=True).data
+		serializerContext[SerializerContextKey.LAST_ID] = dm_content_objects[-1].id if dm_content_objects else sinceId
+		serializerContext[SerializerContextKey.HAS_MORE] = hasMore
+		return Response(serializerContext)
+
 
 
 
@@ -739,10 +821,25 @@ class AvisosAllListAPIView(APIView):
 
 		else:
 			serializerContext = {}
-			avisoObjects = Aviso.objects.filter(aviso_user=Profile.objects.get(user=userObj)).order_by("-created_at")
-
+			avisoObjects = Aviso.objects.filter(aviso_user=Profile.objects.get(user=userObj)).order_by("-created_at", "-id")
+
+			# page_size, cursorが指定された場合のみページ分割する(api/pagination.py 参照)
+			pagination = AvisoKeysetPagination(request)
+			if pagination.isRequested():
+				avisoObjects, serializerContext[SerializerContextKey.NEXT_CURSOR] = pagination.paginateQueryset(avisoObjects)
+
+			# ?view=normalizedの場合はaviso_userをidのみで出力し、ProfileはINCLUDEDに1回だけ出力する
+			if IncludedProfiles.isRequested(request):
+				included_profiles = IncludedProfiles()
+				avisoObjects = resolveAvisoContentObjects(list(avisoObjects))
+				serializer = AvisoSerializer(avisoObjects, many=True, context=included_profiles.getContext())
+				serializerContext["AVISO_OBJECTS"] = serializer.data
+				serializerContext[SerializerContextKey.INCLUDED] = included_profiles.serialize()
+				return Response(serializerContext)
+
+			# content_objectはcontent_typeごとにまとめて取得する
+			avisoObjects = resolveAvisoContentObjects(list(prefetchForAvisoSerializer(avisoObjects)))
 			serializer = AvisoSerializer(avisoObjects, many=True)
-			#print(serializer.data)
 			serializerContext["AVISO_OBJECTS"] = serializer.data
 			return Response(serializerContext)
 
@@ -1,7 +1,14 @@
 from django.contrib import admin
-from .models import Aviso
+from .models import Aviso, ArchivedAviso, NotificationOutbox
 
 # Register your models here.
 
 
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ("id", "channel", "recipient", "status", "attempts", "next_attempt_at", "created_at")
+    list_filter = ("status", "channel")
+
+
 admin.site.register(Aviso)
+admin.site.register(NotificationOutbox, NotificationOutboxAdmin)
+admin.site.register(ArchivedAviso)
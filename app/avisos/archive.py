@@ -0,0 +1,66 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from avisos.models import Aviso, ArchivedAviso
+
+
+"""
+既読の古いAvisoをArchivedAvisoに移動するモジュール。
+
+Avisoはコメント、取引申請、ダイレクトメッセージのたびに増え続けるが、画面やAPIで参照されるのは主に最近のものである。
+既読かつ作成からdays日を過ぎたAvisoをbatch_size件ずつ1つのSQL(DELETE ... RETURNINGの結果をINSERT)で移動し、
+avisos_aviso(とそのインデックス)を小さく保つ。
+未読のAvisoは移動しないので、Profile.unread_aviso_countは変わらない。
+"""
+
+ARCHIVE_AVISOS_SQL = """
+WITH moved AS (
+    DELETE FROM {aviso_table}
+    WHERE id IN (
+        SELECT id FROM {aviso_table}
+        WHERE checked AND created_at < %s
+        ORDER BY created_at, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, aviso_user_id, content_type_id, object_id, checked, created_at, item_id, item_title
+)
+INSERT INTO {archive_table}
+    (id, aviso_user_id, content_type_id, object_id, checked, created_at, item_id, item_title, archived_at)
+SELECT id, aviso_user_id, content_type_id, object_id, checked, created_at, item_id, item_title, %s
+FROM moved
+"""
+
+
+def archiveCheckedAvisos(days=None, batch_size=None, max_batches=None):
+    """機能
+    既読かつ作成からdays日を過ぎたAvisoをArchivedAvisoに移動する。
+    1回のトランザクションで移動するのはbatch_size件なので、長時間テーブルをロックすることはない。
+
+    Args:
+        days: int ...指定しない場合はsettings.AVISO_ARCHIVE_DAYS
+        batch_size: int ...指定しない場合はsettings.AVISO_ARCHIVE_BATCH_SIZE
+        max_batches: int ...指定した場合はその回数で終了する(Noneの場合は対象がなくなるまで)
+    Returns:
+        int: 移動したAvisoの数
+    """
+    days = settings.AVISO_ARCHIVE_DAYS if days is None else days
+    batch_size = settings.AVISO_ARCHIVE_BATCH_SIZE if batch_size is None else batch_size
+    cutoff = timezone.now() - timedelta(days=days)
+    sql = ARCHIVE_AVISOS_SQL.format(
+        aviso_table=connection.ops.quote_name(Aviso._meta.db_table),
+        archive_table=connection.ops.quote_name(ArchivedAviso._meta.db_table))
+
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [cutoff, batch_size, timezone.now()])
+                moved = cursor.rowcount
+        archived += moved
+        batches += 1
+        if moved < batch_size:
+            break
+    return archived
@@ -0,0 +1,91 @@
+import json
+from django.db import connection
+
+
+"""
+新しいAvisoやダイレクトメッセージをリアルタイムにクライアントへ送るイベントを発行するモジュール。
+
+イベントはPostgreSQLのNOTIFY(pg_notify)でAVISO_EVENT_CHANNELに発行する。
+NOTIFYはトランザクションがコミットされた時にのみ配信され、ロールバックされた場合は破棄されるので、
+Avisoと同じトランザクション内で発行してよい。
+配信はイベントストリームのプロセス(avisos/stream.py, config/asgi.py)がLISTENして受け取り、接続中のクライアントに送る。
+
+payloadは{"events": [[user_id, event], ...]}のJSONで、1回のNOTIFYで複数のユーザーへのイベントを送る。
+NOTIFYのpayloadは8000バイト未満である必要があるので、MAX_PAYLOAD_BYTESを超える場合は分割する。
+"""
+
+AVISO_EVENT_CHANNEL = "aviso_events"
+MAX_PAYLOAD_BYTES = 7000
+
+EVENT_AVISO = "aviso"
+EVENT_DM_CONTENT = "dm_content"
+
+
+def makeAvisoEvent(aviso_obj, content_type_model):
+    return {
+        "type": EVENT_AVISO,
+        "id": aviso_obj.id,
+        "modelName": content_type_model,
+        "object_id": aviso_obj.object_id,
+        "item_id": aviso_obj.item_id,
+        "item_title": aviso_obj.item_title,
+    }
+
+
+def makeDirectMessageContentEvent(dm_obj, dm_content_obj):
+    return {
+        "type": EVENT_DM_CONTENT,
+        "id": dm_content_obj.id,
+        "direct_message_id": dm_obj.id,
+        "profile_id": dm_content_obj.profile_id,
+        "created_at": dm_content_obj.created_at.isoformat(),
+    }
+
+
+def encodeEventPayloads(user_events):
+    """機能
+    (user_id, event)のリストをNOTIFYのpayload(JSON文字列)のリストに変換する。
+    1つのpayloadはMAX_PAYLOAD_BYTES以下になるように分割する。
+
+    Args:
+        user_events: [(user_id, event), ...]
+    Returns:
+        list: payloadのリスト
+    """
+    payloads = []
+    chunk = []
+    size = 0
+    for user_id, event in user_events:
+        item = json.dumps([user_id, event], ensure_ascii=False, separators=(",", ":"))
+        item_size = len(item.encode("utf-8")) + 1
+        if chunk and size + item_size > MAX_PAYLOAD_BYTES:
+            payloads.append('{"events":[' + ",".join(chunk) + "]}")
+            chunk = []
+            size = 0
+        chunk.append(item)
+        size += item_size
+    if chunk:
+        payloads.append('{"events":[' + ",".join(chunk) + "]}")
+    return payloads
+
+
+def decodeEventPayload(payload):
+    """
+    encodeEventPayloads()で作成したpayloadを[(user_id, event), ...]に戻す
+    """
+    return [(user_id, event) for user_id, event in json.loads(payload)["events"]]
+
+
+def publishEvents(user_events):
+    """機能
+    (user_id, event)のリストをNOTIFYで発行する。現在のトランザクションがコミットされた時に配信される。
+
+    Args:
+        user_events: [(user_id, event), ...]
+    """
+    payloads = encodeEventPayloads(user_events)
+    if len(payloads) == 0:
+        return
+    with connection.cursor() as cursor:
+        for payload in payloads:
+            cursor.execute("SELECT pg_notify(%s, %s)", [AVISO_EVENT_CHANNEL, payload])
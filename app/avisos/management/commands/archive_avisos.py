@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from avisos.archive import archiveCheckedAvisos
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py archive_avisos
+    python manage.py archive_avisos --days 30 --batch-size 500
+
+    既読かつ作成から指定日数(デフォルトはsettings.AVISO_ARCHIVE_DAYS)を過ぎたAvisoをArchivedAvisoに移動する。
+    cronなどで1日1回実行する。
+    """
+
+    help = "既読の古いAvisoをArchivedAvisoに移動する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None, help="作成からの日数")
+        parser.add_argument("--batch-size", type=int, default=None, help="1回のトランザクションで移動する件数")
+
+    def handle(self, *args, **options):
+        archived = archiveCheckedAvisos(days=options["days"], batch_size=options["batch_size"])
+        self.stdout.write("{}件のAvisoをアーカイブしました".format(archived))
@@ -0,0 +1,28 @@
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db.models import CharField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from avisos.models import Aviso, AVISO_ITEM_LOOKUPS
+from items.models import Item
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py backfill_aviso_item
+
+    Aviso.item, Aviso.item_titleを追加する前に作成されたAvisoに通知対象の記事と記事タイトルを設定する。
+    通知対象のモデル(content_type)ごとに1回のUPDATEで設定する。記事が削除されているAvisoは設定されない。
+    """
+
+    help = "Aviso.item, Aviso.item_titleを通知対象から設定する"
+
+    def handle(self, *args, **options):
+        for model, model_name, lookup in AVISO_ITEM_LOOKUPS:
+            item_objects = Item.objects.filter(**{lookup: OuterRef("object_id")}).order_by()
+            updated = Aviso.objects.filter(
+                content_type=ContentType.objects.get_for_model(model), item__isnull=True).update(
+                item=Subquery(item_objects.values("id")[:1]),
+                item_title=Coalesce(Subquery(item_objects.values("title")[:1], output_field=CharField()), Value("")))
+            self.stdout.write("{} : {}件を修正しました".format(model_name, updated))
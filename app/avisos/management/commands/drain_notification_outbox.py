@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from avisos.outbox import NotificationOutboxWorker
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py drain_notification_outbox
+    python manage.py drain_notification_outbox --loop --interval 1
+
+    NotificationOutboxに保存された送信待ちの通知(FCM, email)を送信する。
+    --loopを指定した場合は常駐し、送信待ちの通知がなければinterval秒待ってから再度確認する。
+    """
+
+    help = "送信待ちの通知(FCM, email)を送信する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="常駐して送信を続ける")
+        parser.add_argument("--interval", type=float, default=1, help="送信待ちの通知がない場合に待つ秒数")
+
+    def handle(self, *args, **options):
+        worker = NotificationOutboxWorker()
+        if options["loop"]:
+            worker.run(interval=options["interval"])
+            return
+        result = worker.drain()
+        self.stdout.write("送信 {sent}件 / 再送待ち {retry}件 / dead {dead}件".format(**result))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from avisos.outbox import purgeNotificationOutbox
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py purge_notification_outbox
+    python manage.py purge_notification_outbox --sent-days 3 --dead-days 14 --batch-size 500
+
+    送信済み(sent)と送信を諦めた(dead)古い通知をNotificationOutboxから削除する。
+    drain_notification_outbox --loopで常駐するワーカーも1時間ごとに実行しているので、ワーカーを動かしていない場合に使う。
+    """
+
+    help = "送信済み、deadの古い通知をNotificationOutboxから削除する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sent-days", type=int, default=None, help="送信からの日数")
+        parser.add_argument("--dead-days", type=int, default=None, help="deadの通知の作成からの日数")
+        parser.add_argument("--batch-size", type=int, default=None, help="1回のDELETEで削除する件数")
+
+    def handle(self, *args, **options):
+        purged = purgeNotificationOutbox(
+            sent_days=options["sent_days"], dead_days=options["dead_days"], batch_size=options["batch_size"])
+        self.stdout.write("{}件の通知を削除しました".format(purged))
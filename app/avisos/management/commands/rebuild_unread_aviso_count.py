@@ -0,0 +1,29 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+from avisos.models import Aviso
+from avisos.unread import aviso_unread_cache
+from profiles.models import Profile
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py rebuild_unread_aviso_count
+
+    Profile.unread_aviso_countをAvisoの未読数から再計算する。
+    unread_aviso_countを追加する前に作成されたAvisoがある場合や、管理画面でAvisoを編集した場合に実行する。
+    全Profileを1回のUPDATEで更新する。
+    """
+
+    help = "Profile.unread_aviso_countをAvisoの未読数から再計算する"
+
+    def handle(self, *args, **options):
+        unread_count = Aviso.objects.filter(aviso_user=OuterRef("pk"), checked=False).order_by().values(
+            "aviso_user").annotate(count=Count("pk")).values("count")[:1]
+        updated = Profile.objects.update(
+            unread_aviso_count=Coalesce(Subquery(unread_count, output_field=IntegerField()), 0))
+        # update()ではシグナルが発火しないのでキャッシュを直接無効にする
+        aviso_unread_cache.invalidate(Profile.objects.values_list("user_id", flat=True))
+        self.stdout.write("{}件のProfileを更新しました".format(updated))
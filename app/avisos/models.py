@@ -1,18 +1,23 @@
 from api.models import DeviceToken
-from api.firebase_cloud_messaging import FireBaseMassagingDeal
 from api.constants import FirebaseCloudMessagingCase
-from django.db import models
-from django.db.models.signals import post_save, m2m_changed
+from avisos.events import makeAvisoEvent, makeDirectMessageContentEvent, publishEvents
+from avisos.unread import aviso_unread_cache
+from collections import Counter
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.core.mail import send_mail
+from django.contrib.postgres.fields import JSONField
+from django.utils import timezone
 from items.models import Item
+from item_contacts.models import ItemContact
 from prefecturas.models import Municipio, Departamento, RegionClassed
 from profiles.models import Profile
 from solicitudes.models import Solicitud
 from direct_messages.models import DirectMessageContent, DirectMessage
-import firebase_admin
 
 
 class Aviso(models.Model):
@@ -25,24 +30,254 @@ class Aviso(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
     checked = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now=True)
+    # 作成日時。既読にしても変更されない
+    created_at = models.DateTimeField(auto_now_add=True)
+    # 通知対象の記事と作成時の記事タイトル。一覧やリダイレクトでcontent_objectからManyToManyFieldを辿らずに済むよう
+    # 作成時に保存する(既存のAvisoは python manage.py backfill_aviso_item で設定する)
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True, blank=True)
+    item_title = models.CharField(max_length=45, blank=True, default="")
+
+    class Meta:
+        indexes = [
+            # ユーザーごとの通知一覧(全件、未読のみ)を新しい順に取得するためのインデックス
+            models.Index(fields=["aviso_user", "checked", "-created_at"], name="aviso_user_checked_created"),
+            # アーカイブ対象(既読かつ古いもの)を取得するための部分インデックス
+            models.Index(fields=["created_at"], name="aviso_checked_created", condition=Q(checked=True)),
+        ]
 
     def __str__(self):
         return str(self.aviso_user)
 
 
-def sendMail(subject, content, message_to):
+class ArchivedAviso(models.Model):
+    '''
+    archive_avisosコマンドでAvisoから移動した既読の古い通知。idはAvisoのidをそのまま使う。
+    avisos_avisoの行数を抑えるために分けているので、画面やAPIでは使わない。
+    '''
+    id = models.IntegerField(primary_key=True)
+    aviso_user = models.ForeignKey(Profile, on_delete=models.CASCADE, null=True)
+    content_type = models.ForeignKey(ContentType, on_delete=models.PROTECT, null=True)
+    object_id = models.PositiveIntegerField()
+    checked = models.BooleanField(default=True)
+    created_at = models.DateTimeField()
+    item = models.ForeignKey(Item, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    item_title = models.CharField(max_length=45, blank=True, default="")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.aviso_user)
+
+
+# Avisoの通知対象のモデル: (モデル, AvisoSerializerのmodelName, 通知対象のidを記事から辿るlookup)
+AVISO_ITEM_LOOKUPS = (
+    (ItemContact, "ItemContact", "item_contacts__id"),
+    (Solicitud, "Solicitud", "solicitudes__id"),
+    (DirectMessage, "DirectMessage", "direct_message__id"),
+    (DirectMessageContent, "DirectMessageContent", "direct_message__direct_message_contents__id"),
+)
+
+
+def resolveAvisoItem(aviso_obj):
+    """機能
+    aviso_objの通知対象の記事を返す。
+    Aviso.itemが設定されていない場合(Aviso.itemを追加する前に作成され、backfill_aviso_itemを実行していないAvisoなど)は
+    通知対象(content_type, object_id)からAVISO_ITEM_LOOKUPSで記事を取得し、Aviso.item, Aviso.item_titleに保存する。
+
+    Args:
+        aviso_obj: Avisoオブジェクト
+    Returns:
+        Itemオブジェクト (記事が削除されている場合はNone)
+
+    コピペ
+        item_obj = resolveAvisoItem(aviso_obj)
     """
-    sendgridによるメールを送信する
+    if aviso_obj.item_id is not None:
+        return aviso_obj.item
+
+    model_name = ContentType.objects.get_for_id(aviso_obj.content_type_id).model
+    for model, _, lookup in AVISO_ITEM_LOOKUPS:
+        if model._meta.model_name != model_name:
+            continue
+        item_obj = Item.objects.filter(**{lookup: aviso_obj.object_id}).order_by().first()
+        if item_obj is not None:
+            Aviso.objects.filter(id=aviso_obj.id).update(item=item_obj, item_title=item_obj.title)
+            aviso_obj.item = item_obj
+            aviso_obj.item_title = item_obj.title
+        return item_obj
+    return None
+
+
+def addUnreadAvisoCount(profile_ids, delta, user_ids=None):
+    """機能
+    ProfileのProfile.unread_aviso_count(未読のAvisoの数)にdeltaを加え、コミット後に未読数のキャッシュを無効にする。
+    profile_idsに同じidが複数含まれる場合はその回数分加える。増減量が同じProfileは1回のUPDATEで更新する。
+
+    Args:
+        profile_ids: AvisoのProfileのidのリスト
+        delta: 1(Avisoの作成) または -1(既読、削除)
+        user_ids: ProfileのUserのid。分かっている場合に渡すとProfileを取得するクエリを省略できる
     """
-    message_from = "from@sharexela.ga"
-    send_mail(subject, content, message_from, message_to)
+    counts = Counter(profile_id for profile_id in profile_ids if profile_id is not None)
+    if len(counts) == 0:
+        return
 
+    amounts = {}
+    for profile_id, count in counts.items():
+        amounts.setdefault(count * delta, []).append(profile_id)
+    for amount, ids in amounts.items():
+        Profile.objects.filter(id__in=ids).update(unread_aviso_count=Greatest(F("unread_aviso_count") + amount, 0))
 
-def itemitemcontact_m2m_changed_receiver(sender, instance, action, *args, **kwargs):
+    if user_ids is None:
+        user_ids = Profile.objects.filter(id__in=list(counts)).values_list("user_id", flat=True)
+    invalidateAvisoUnreadCache(user_ids)
+
+
+def invalidateAvisoUnreadCache(user_ids):
+    user_ids = list(user_ids)
+    aviso_unread_cache.invalidate(user_ids)
+    # コミット前の値で作成されたキャッシュを無効にするため、コミット後にもう一度無効にする
+    transaction.on_commit(lambda: aviso_unread_cache.invalidate(user_ids))
+
+
+def markAvisoChecked(aviso_obj):
+    """機能
+    aviso_objを既読にし、未読だった場合はunread_aviso_countを1つ減らす。
+    同時に既読にされた場合でもUPDATEの件数で判定するので二重に減ることはない。
+
+    Returns:
+        bool: 未読から既読に変更した場合はTrue
+    """
+    with transaction.atomic():
+        updated = Aviso.objects.filter(id=aviso_obj.id, checked=False).update(checked=True)
+        aviso_obj.checked = True
+        if updated == 0:
+            return False
+        addUnreadAvisoCount([aviso_obj.aviso_user_id], -1)
+    return True
+
+
+def markAvisosChecked(profile_obj, content_type_model=None, item_id=None):
+    """機能
+    profile_objの未読のAvisoを1回のUPDATEで既読にし、unread_aviso_countを更新する。
+    content_type_model, item_idを指定した場合はその通知対象、記事のAvisoのみ既読にする。
+
+    Args:
+        profile_obj: Profileオブジェクト
+        content_type_model: 通知対象のモデル名("itemcontact", "solicitud", "directmessage", "directmessagecontent")
+        item_id: 記事のid
+    Returns:
+        (int, int): 既読にしたAvisoの数, 更新後の未読のAvisoの数
+    Raises:
+        ValueError: content_type_modelが通知対象のモデル名でない場合
+    """
+    aviso_objects = Aviso.objects.filter(aviso_user=profile_obj, checked=False)
+    if content_type_model:
+        models_by_name = {model._meta.model_name: model for model, model_name, lookup in AVISO_ITEM_LOOKUPS}
+        if content_type_model not in models_by_name:
+            raise ValueError("invalid content_type: {}".format(content_type_model))
+        aviso_objects = aviso_objects.filter(content_type=ContentType.objects.get_for_model(models_by_name[content_type_model]))
+    if item_id is not None:
+        aviso_objects = aviso_objects.filter(item_id=item_id)
+
+    profile_objects = Profile.objects.filter(id=profile_obj.id)
+    with transaction.atomic():
+        checked_count = aviso_objects.update(checked=True)
+        if not content_type_model and item_id is None:
+            # 全て既読にした場合は未読数は0になる(ずれていた場合もここで修正される)
+            profile_objects.update(unread_aviso_count=0)
+        elif checked_count > 0:
+            profile_objects.update(unread_aviso_count=Greatest(F("unread_aviso_count") - checked_count, 0))
+        unread_count = profile_objects.values_list("unread_aviso_count", flat=True).get()
+        invalidateAvisoUnreadCache([profile_obj.user_id])
+    return checked_count, unread_count
+
+
+OUTBOX_CHANNEL_FCM = "fcm"
+OUTBOX_CHANNEL_EMAIL = "email"
+OUTBOX_CHANNEL_CHOICE = (
+    (OUTBOX_CHANNEL_FCM, "FCM"),
+    (OUTBOX_CHANNEL_EMAIL, "Email"),
+)
+
+OUTBOX_STATUS_PENDING = "pending"
+# ワーカーが取得して送信中。next_attempt_atまでに結果が記録されない場合(ワーカーの停止など)は再び取得される
+OUTBOX_STATUS_SENDING = "sending"
+OUTBOX_STATUS_SENT = "sent"
+OUTBOX_STATUS_DEAD = "dead"
+OUTBOX_STATUS_CHOICE = (
+    (OUTBOX_STATUS_PENDING, "Pending"),
+    (OUTBOX_STATUS_SENDING, "Sending"),
+    (OUTBOX_STATUS_SENT, "Sent"),
+    (OUTBOX_STATUS_DEAD, "Dead"),
+)
+
+
+class NotificationOutbox(models.Model):
+    '''
+    送信待ちの通知(FCM, email)。Avisoと同じトランザクションで作成し、
+    コミット後にワーカープロセス(python manage.py drain_notification_outbox)が送信する。
+    リクエストの処理中にFCMやSendGridへの通信は行わない。送信処理は avisos/outbox.py 参照。
+    '''
+    channel = models.CharField(max_length=16, choices=OUTBOX_CHANNEL_CHOICE)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE)
+    payload = JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=OUTBOX_STATUS_CHOICE, default=OUTBOX_STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # ワーカーが送信待ちの通知を取得するためのインデックス
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_status_next_attempt"),
+        ]
+
+    def __str__(self):
+        return "{} {} {}".format(self.channel, self.recipient_id, self.status)
+
+
+def enqueueNotification(user_obj, case, subject, content, data=None):
+    """機能
+    user_objへのFCMとemailの通知をNotificationOutboxに追加する。
+    Avisoの作成と同じトランザクション内で呼び出すので、ロールバックされた場合は通知も送信されない。
+
+    Args:
+        user_obj: 通知を送るUserオブジェクト
+        case: FirebaseCloudMessagingCaseの値
+        subject: メールの件名
+        content: メールの本文
+        data: FCMのdata(dict)
+    """
+    enqueueNotifications([user_obj.id], case, subject, content, data=data)
+
+
+def enqueueNotifications(user_ids, case, subject, content, data=None):
+    """機能
+    複数のユーザーへの同じ内容の通知を1回のINSERTでNotificationOutboxに追加する。
+
+    Args:
+        user_ids: 通知を送るUserのidのリスト
+    """
+    outbox_objects = []
+    for user_id in user_ids:
+        outbox_objects.append(NotificationOutbox(
+            channel=OUTBOX_CHANNEL_FCM,
+            recipient_id=user_id,
+            payload={"case": case, "data": data or {}}))
+        outbox_objects.append(NotificationOutbox(
+            channel=OUTBOX_CHANNEL_EMAIL,
+            recipient_id=user_id,
+            payload={"subject": subject, "content": content}))
+    NotificationOutbox.objects.bulk_create(outbox_objects)
+
+
+def itemitemcontact_m2m_changed_receiver(sender, instance, action, pk_set, *args, **kwargs):
     """機能
     item_obj.item_contactsにItemContactオブジェクトを追加した時に
     通知するユーザー毎にAvisoオブジェクトを生成する。
+    コメント数、通知するユーザー数に関わらず発行されるクエリの数は一定である(Aviso, NotificationOutboxはbulk_create)。
     """
     """テスト項目
 
@@ -57,41 +292,47 @@ def itemitemcontact_m2m_changed_receiver(sender, instance, action, *args, **kwar
     item_contact_objectsに記事作成者(owner_user)が含まれていない場合、記事作成者がprofilesに含まれる。
 
     """
-    if action == "post_add":
-        item_obj = instance
-        owner_user = Profile.objects.get(user=item_obj.user)
-        item_contact_objects = item_obj.item_contacts.all().order_by('timestamp')
-        item_contact_obj = item_contact_objects.last()
-        profiles = [item_contact.post_user for item_contact in item_contact_objects]
-        profiles.append(owner_user)
-        profiles = set(profiles)
-        for profile_obj in profiles:
-            if profile_obj == item_contact_obj.post_user:
-                continue
-            aviso_user = profile_obj
+    if action != "post_add" or not pk_set:
+        return
+    if type(instance) != Item:
+        return
 
-            Aviso.objects.create(
-                aviso_user=aviso_user,
-                content_type=ContentType.objects.get_for_model(item_obj.item_contacts.all().last()),
-                object_id=item_obj.item_contacts.all().last().id
-                )
-
-            # data = {"item_obj":item_obj.title }
-            fcmd_obj = FireBaseMassagingDeal()
-            fcmd_obj.getDeviceToken(aviso_user.user)
-            fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.ITEMCONTACT_ADDED_TO_ITEM)
-            # fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.ITEMCONTACT_ADDED_TO_ITEM, data=data)
-            fcmd_obj.makeMessage()
-            try:
-                fcmd_obj.sendMessage()
-            except firebase_admin._messaging_utils.UnregisteredError:
-                print("Firebaseのエラー")
-
-            # emailを送信するロジックを挿入
-            subject = "ShareXekla Siguió un comentario"
-            content = item_obj.title + "\n"
-            message_to = [aviso_user.user.email]
-            sendMail(subject, content, message_to)	
+    item_obj = instance
+    # 追加されたItemContact(コメント送信者)
+    item_contact_obj = ItemContact.objects.only("id", "post_user_id").get(id=max(pk_set))
+
+    # 記事作成者とこれまでのコメント送信者(重複なし)からコメント送信者を除いたものを1回のクエリで取得する
+    contact_profile_ids = item_obj.item_contacts.order_by().values("post_user_id").distinct()
+    recipients = list(
+        Profile.objects.filter(Q(id__in=contact_profile_ids) | Q(user_id=item_obj.user_id)).exclude(
+            id=item_contact_obj.post_user_id).values_list("id", "user_id"))
+    if len(recipients) == 0:
+        return
+
+    content_type = ContentType.objects.get_for_model(ItemContact)
+    with transaction.atomic():
+        aviso_objects = Aviso.objects.bulk_create([
+            Aviso(
+                aviso_user_id=profile_id, content_type=content_type, object_id=item_contact_obj.id,
+                item=item_obj, item_title=item_obj.title)
+            for profile_id, user_id in recipients
+        ])
+        # bulk_createではpost_saveが発火しないのでイベントもここで発行する(NOTIFYは1回)
+        publishEvents([
+            (user_id, makeAvisoEvent(aviso_obj, content_type.model))
+            for (profile_id, user_id), aviso_obj in zip(recipients, aviso_objects)
+        ])
+        # bulk_createではpost_saveが発火しないので未読数を直接更新する
+        addUnreadAvisoCount(
+            [profile_id for profile_id, user_id in recipients], 1,
+            user_ids=[user_id for profile_id, user_id in recipients])
+
+        # FCMとemailはコミット後にワーカーが送信する
+        enqueueNotifications(
+            [user_id for profile_id, user_id in recipients],
+            case=FirebaseCloudMessagingCase.ITEMCONTACT_ADDED_TO_ITEM,
+            subject="ShareXekla Siguió un comentario",
+            content=item_obj.title + "\n")
 
 
 m2m_changed.connect(itemitemcontact_m2m_changed_receiver, sender=Item.item_contacts.through)
@@ -119,23 +360,20 @@ def itemsolicitudes_m2m_changed_receiver(sender, instance, action, pk_set, *args
         # item_contact_obj = item_contact_objects.last()
 
         aviso_user = owner_user
-        Aviso.objects.create(
-            aviso_user=aviso_user,
-            content_type=ContentType.objects.get_for_model(item_obj.solicitudes.all().last()),
-            object_id=added_pk)
-
-        data = {"item_obj": item_obj.title}
-        fcmd_obj = FireBaseMassagingDeal()
-        fcmd_obj.getDeviceToken(aviso_user.user)
-        fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_SOLICITUD, data=data)
-        fcmd_obj.makeMessage()
-        fcmd_obj.sendMessage()
+        with transaction.atomic():
+            Aviso.objects.create(
+                aviso_user=aviso_user,
+                content_type=ContentType.objects.get_for_model(Solicitud),
+                object_id=added_pk,
+                item=item_obj,
+                item_title=item_obj.title)
 
-        # emailを送信するロジックを挿入
-        subject = "ShareXekla Solicitud de transacción"
-        content = item_obj.title + "\n"
-        message_to = [aviso_user.user.email]
-        sendMail(subject, content, message_to)
+            enqueueNotification(
+                aviso_user.user,
+                case=FirebaseCloudMessagingCase.CREATED_SOLICITUD,
+                subject="ShareXekla Solicitud de transacción",
+                content=item_obj.title + "\n",
+                data={"item_obj": item_obj.title})
 
 
 m2m_changed.connect(itemsolicitudes_m2m_changed_receiver, sender=Item.solicitudes.through)
@@ -192,35 +430,27 @@ def directmessage_post_save_receiver(sender, instance, created, *args, **kwargs)
 
     dm_obj = instance
     aviso_user = dm_obj.participant
-    Aviso.objects.create(
-        aviso_user=aviso_user,
-        content_type=ContentType.objects.get_for_model(dm_obj),
-        object_id=dm_obj.id,
-        )
-
-    # aviso_obj.aviso_user.add(aviso_user)
-
-    try:
-        item_obj = Item.objects.get(direct_message__id=dm_obj.id)
-
-        # item_obj = dm_obj.item_set.all().first()
-        data = {"item_obj": item_obj.title}
-        fcmd_obj = FireBaseMassagingDeal()
-        fcmd_obj.getDeviceToken(aviso_user.user)
-        # fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE)
-        fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE, data=data)
-        fcmd_obj.makeMessage()
-        fcmd_obj.sendMessage()
+    # solicitud_post_save_receiverから作成された場合はまだ記事に紐付けられていないのでNone
+    item_obj = Item.objects.filter(direct_message__id=dm_obj.id).first()
+    with transaction.atomic():
+        Aviso.objects.create(
+            aviso_user=aviso_user,
+            content_type=ContentType.objects.get_for_model(dm_obj),
+            object_id=dm_obj.id,
+            item=item_obj,
+            item_title=item_obj.title if item_obj is not None else "",
+            )
 
-        # emailの送信を実装
-        subject = "ShareXela Ha sido elegido para hacer negocios con usted"
-        content = item_obj.title + "\n"
-        message_to = [aviso_user.user.email]
-        sendMail(subject, content, message_to)
+        if item_obj is None:
+            # sub_item_post_save_receiver()でAvisoに記事を設定し、fcmとemailの通知を作成する
+            return
 
-    except:
-        # sub_item_post_save_receiver()を使ってfcmとemailを送信する
-        pass
+        enqueueNotification(
+            aviso_user.user,
+            case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE,
+            subject="ShareXela Ha sido elegido para hacer negocios con usted",
+            content=item_obj.title + "\n",
+            data={"item_obj": item_obj.title})
 
 
 post_save.connect(directmessage_post_save_receiver, sender=DirectMessage)
@@ -239,21 +469,23 @@ def sub_item_post_save_receiver(sender, instance, created, update_fields, *args,
     if "direct_message" in update_fields:
 
         item_obj = instance
-        aviso_user = getattr(instance, '_aviso_user', None)  # participantに該当する
+        # directmessage_post_save_receiverで記事なしで作成されたAvisoに記事を設定する
+        if item_obj.direct_message_id is not None:
+            Aviso.objects.filter(
+                content_type=ContentType.objects.get_for_model(DirectMessage),
+                object_id=item_obj.direct_message_id,
+                item__isnull=True).update(item=item_obj, item_title=item_obj.title)
 
-        data = {"item_obj": item_obj.title}
-        fcmd_obj = FireBaseMassagingDeal()
-        fcmd_obj.getDeviceToken(aviso_user.user)
-        # fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE)
-        fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE, data=data)
-        fcmd_obj.makeMessage()
-        fcmd_obj.sendMessage()
+        aviso_user = getattr(instance, '_aviso_user', None)  # participantに該当する
+        if aviso_user is None:
+            return
 
-        # emailの送信
-        subject = "ShareXeka Ha sido elegido para hacer negocios con usted"
-        content = item_obj.title + "\n"
-        message_to = [aviso_user.user.email]
-        sendMail(subject, content, message_to)
+        enqueueNotification(
+            aviso_user.user,
+            case=FirebaseCloudMessagingCase.CREATED_DIRECTMESSAGE,
+            subject="ShareXeka Ha sido elegido para hacer negocios con usted",
+            content=item_obj.title + "\n",
+            data={"item_obj": item_obj.title})
 
 
 post_save.connect(sub_item_post_save_receiver, sender=Item)
@@ -280,33 +512,68 @@ def dm_content_m2m_receiver(sender, instance, action, pk_set, *args, **kwargs):
         else:
             aviso_user = dm_obj.participant
 
-        Aviso.objects.create(
-            aviso_user=aviso_user,
-            content_type=ContentType.objects.get_for_model(dm_content_obj),   
-            object_id=dm_content_obj.id,
-            )
-
         item_obj = Item.objects.get(direct_message=dm_obj)
-        data = {"item_obj": item_obj.title}
-
-        fcmd_obj = FireBaseMassagingDeal()
-        fcmd_obj.getDeviceToken(aviso_user.user)
-        # fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DM_CONTENT)
-        fcmd_obj.makeNotification(case=FirebaseCloudMessagingCase.CREATED_DM_CONTENT, data=data)
-        fcmd_obj.makeMessage()
-        fcmd_obj.sendMessage()
-
-        # emailの送信を実装
-        subject = "ShareXela Tiene un mensaje"
-        content = item_obj.title + "\n"
-        message_to = [aviso_user.user.email]
-        sendMail(subject, content, message_to)
+        content_type = ContentType.objects.get_for_model(dm_content_obj)
+        with transaction.atomic():
+            # 未読のメッセージは会話ごとにDirectMessage.*_last_read_message_idで数えるので、
+            # Avisoは会話ごとに未読のものを1つだけ作成する(既読にするとmarkDirectMessageReadで既読になる)
+            # 同じ会話に同時にメッセージが送信された場合に両方がexists()でFalseとなり2つ作成されないように、
+            # DirectMessageの行をロックしてから確認する(ロックはトランザクションの終了まで保持される)
+            list(DirectMessage.objects.select_for_update().filter(id=dm_obj.id).values_list("id", flat=True))
+            has_unread_aviso = Aviso.objects.filter(
+                aviso_user=aviso_user, content_type=content_type, item=item_obj, checked=False).exists()
+            if has_unread_aviso is False:
+                Aviso.objects.create(
+                    aviso_user=aviso_user,
+                    content_type=content_type,
+                    object_id=dm_content_obj.id,
+                    item=item_obj,
+                    item_title=item_obj.title,
+                    )
+
+            publishEvents([(aviso_user.user_id, makeDirectMessageContentEvent(dm_obj, dm_content_obj))])
+
+            enqueueNotification(
+                aviso_user.user,
+                case=FirebaseCloudMessagingCase.CREATED_DM_CONTENT,
+                subject="ShareXela Tiene un mensaje",
+                content=item_obj.title + "\n",
+                data={"item_obj": item_obj.title})
 
 
 m2m_changed.connect(dm_content_m2m_receiver, sender=DirectMessage.direct_message_contents.through)
 # m2m_changed.connect(itemsolicitudes_m2m_changed_receiver, sender=DirectMessage.direct_message_contents.through)
 
 
+def aviso_post_save_receiver(sender, instance, created, *args, **kwargs):
+    """
+    未読のAvisoが作成されたらaviso_userのunread_aviso_countを1つ増やし、イベントストリームに通知する
+    """
+    if created is False or instance.checked is True or instance.aviso_user_id is None:
+        return
+    user_id = instance.aviso_user.user_id
+    addUnreadAvisoCount([instance.aviso_user_id], 1, user_ids=[user_id])
+    content_type_model = None
+    if instance.content_type_id is not None:
+        content_type_model = ContentType.objects.get_for_id(instance.content_type_id).model
+    publishEvents([(user_id, makeAvisoEvent(instance, content_type_model))])
+
+
+post_save.connect(aviso_post_save_receiver, sender=Aviso)
+
+
+def aviso_post_delete_receiver(sender, instance, *args, **kwargs):
+    """
+    未読のAvisoが削除されたらaviso_userのunread_aviso_countを1つ減らす
+    """
+    if instance.checked is True or instance.aviso_user_id is None:
+        return
+    addUnreadAvisoCount([instance.aviso_user_id], -1)
+
+
+post_delete.connect(aviso_post_delete_receiver, sender=Aviso)
+
+
 def user_post_save_receiver(sender, instance, created, *args, **kwargs):
     """
     userオブジェクトが生成されたら自動的にProfileオブジェクトを生成する仕組み
@@ -0,0 +1,311 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from api.fcm_sender import FcmNotificationSender, makeNotification
+from firebase_admin import messaging
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from avisos.models import (
+    NotificationOutbox,
+    OUTBOX_CHANNEL_FCM,
+    OUTBOX_CHANNEL_EMAIL,
+    OUTBOX_STATUS_PENDING,
+    OUTBOX_STATUS_SENDING,
+    OUTBOX_STATUS_SENT,
+    OUTBOX_STATUS_DEAD,
+)
+
+
+"""
+NotificationOutboxに保存された通知を送信するモジュール。
+
+通知はリクエストのトランザクション内でNotificationOutboxに保存され(avisos/models.py enqueueNotification)、
+コミット後にワーカープロセスがdrain()で送信する。
+
+python manage.py drain_notification_outbox          # 送信待ちの通知を1回送信して終了する
+python manage.py drain_notification_outbox --loop   # ワーカーとして常駐する(docker-compose の worker)
+
+送信に失敗した通知はattemptsを1つ増やし、BACKOFF_BASE_SECONDS * 2^(attempts-1)秒後(最大BACKOFF_MAX_SECONDS)に再送する。
+MAX_ATTEMPTS回失敗した通知、またはNotificationPermanentErrorが送出された通知はstatusをdeadにして再送しない。
+deadの通知は管理画面で確認できる。
+
+送信はトランザクションの外で行う。短いトランザクションで通知のstatusをsendingにし、
+next_attempt_atをLEASE_SECONDS秒後(リース)にしてから送信し、結果は通知ごとに記録する。
+送信中にワーカーが停止した場合は、送信済みの通知の結果は残り、未記録の通知はリースが切れた後に再び送信される。
+
+sentの通知はsettings.NOTIFICATION_OUTBOX_SENT_RETENTION_DAYS日、deadの通知はNOTIFICATION_OUTBOX_DEAD_RETENTION_DAYS日を
+過ぎるとpurgeNotificationOutbox()で削除する(ワーカーがPURGE_INTERVAL_SECONDSごとに実行する)。
+"""
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 60 * 60
+DRAIN_BATCH_SIZE = 100
+# 取得した通知の送信結果を記録するまでの猶予。過ぎた場合は他のワーカーが再び取得する
+LEASE_SECONDS = 5 * 60
+MAX_ERROR_LENGTH = 2000
+# 常駐するワーカーが古いsent, deadの通知を削除する間隔
+PURGE_INTERVAL_SECONDS = 60 * 60
+
+
+class NotificationPermanentError(Exception):
+    """
+    再送しても成功しない通知(登録が解除されたデバイストークンなど)でsinkが送出する
+    """
+    pass
+
+
+class FcmNotificationSink(object):
+
+    """
+    FcmNotificationSenderを使ってFCMの通知を送信する。
+    sendBatch()は同じcaseの通知をまとめてsend_multicastで送信するので、ワーカーはsend()ではなくこちらを使う。
+    """
+
+    def __init__(self, sender=None):
+        self.sender = sender if sender is not None else FcmNotificationSender()
+
+    def send(self, outbox_obj):
+        error = self.sendBatch([outbox_obj])[outbox_obj.id]
+        if error is not None:
+            raise error
+
+    def sendBatch(self, outbox_objects):
+        """機能
+        outbox_objectsをcaseごとにまとめて送信する。デバイストークンがないユーザーへの通知は送信せずに成功とする。
+
+        Returns:
+            dict: outbox_obj.idをキー、送信に失敗した場合は例外、成功した場合はNoneを値とする辞書
+        """
+        tokens = self.sender.getDeviceTokens({outbox_obj.recipient_id for outbox_obj in outbox_objects})
+        groups = {}
+        for outbox_obj in outbox_objects:
+            groups.setdefault(outbox_obj.payload.get("case"), []).append(outbox_obj)
+
+        errors = {}
+        for case, case_objects in groups.items():
+            result = self.sender.sendMulticast(
+                [tokens.get(outbox_obj.recipient_id) for outbox_obj in case_objects], makeNotification(case))
+            for outbox_obj in case_objects:
+                error = result.failures.get(tokens.get(outbox_obj.recipient_id))
+                if isinstance(error, messaging.UnregisteredError):
+                    error = NotificationPermanentError(str(error))
+                errors[outbox_obj.id] = error
+        return errors
+
+
+class EmailNotificationSink(object):
+
+    """
+    sendgridによるメールを送信する
+    """
+
+    MESSAGE_FROM = "from@sharexela.ga"
+
+    def send(self, outbox_obj):
+        email = outbox_obj.recipient.email
+        if not email:
+            raise NotificationPermanentError("recipient has no email address")
+        payload = outbox_obj.payload
+        send_mail(payload.get("subject", ""), payload.get("content", ""), self.MESSAGE_FROM, [email])
+
+
+def getDefaultSinks():
+    return {
+        OUTBOX_CHANNEL_FCM: FcmNotificationSink(),
+        OUTBOX_CHANNEL_EMAIL: EmailNotificationSink(),
+    }
+
+
+def getBackoffSeconds(attempts):
+    return min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+
+
+class NotificationOutboxWorker(object):
+
+    """ *使用方法*
+
+    from avisos.outbox import NotificationOutboxWorker
+
+    worker = NotificationOutboxWorker()
+    result = worker.drain()         # {"sent": 3, "retry": 1, "dead": 0}
+    worker.run(interval=1)          # 常駐する
+
+    テストではsinksに偽のsink(send(outbox_obj)を持つオブジェクト)を渡すことで、FCMやSMTPに接続せずに確認できる。
+        worker = NotificationOutboxWorker(sinks={"fcm": fake_fcm_sink, "email": fake_mail_sink})
+
+    送信待ちの通知はSELECT ... FOR UPDATE SKIP LOCKEDで取得してstatusをsendingにするので、
+    複数のワーカーを同時に動かしても同じ通知を二重に送信しない。FCMやSMTPへの通信中は行ロックやトランザクションを保持しない。
+    """
+
+    def __init__(self, sinks=None, batch_size=DRAIN_BATCH_SIZE):
+        self.sinks = sinks if sinks is not None else getDefaultSinks()
+        self.batch_size = batch_size
+
+    def drain(self):
+        """機能
+        送信時刻を過ぎた送信待ちの通知がなくなるまで送信する。
+
+        Returns:
+            dict: 送信した数(sent), 再送待ちにした数(retry), deadにした数(dead)
+        """
+        result = {"sent": 0, "retry": 0, "dead": 0}
+        while True:
+            batch_result = self.drainBatch()
+            if sum(batch_result.values()) == 0:
+                return result
+            for key, value in batch_result.items():
+                result[key] += value
+
+    def drainBatch(self):
+        result = {"sent": 0, "retry": 0, "dead": 0}
+        outbox_objects = self.claimBatch()
+        channels = {}
+        for outbox_obj in outbox_objects:
+            if outbox_obj.attempts > MAX_ATTEMPTS:
+                # 送信中にワーカーが停止し続けた通知
+                result[self.markDead(outbox_obj, NotificationPermanentError("lease expired"))] += 1
+                continue
+            channels.setdefault(outbox_obj.channel, []).append(outbox_obj)
+        for channel, channel_objects in channels.items():
+            for outbox_obj, error in self.sendChannel(channel, channel_objects):
+                result[self.recordResult(outbox_obj, error)] += 1
+        return result
+
+    def claimBatch(self):
+        """機能
+        送信時刻を過ぎた送信待ちの通知と、リースが切れた送信中の通知を最大batch_size件取得し、
+        statusをsending、next_attempt_atをリースの期限にしてattemptsを1つ増やす。
+        行ロックはこのトランザクションの間のみ保持する。
+
+        Returns:
+            list: NotificationOutboxオブジェクトのリスト
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            outbox_objects = list(
+                NotificationOutbox.objects.select_for_update(skip_locked=True, of=("self",)).select_related(
+                    "recipient").filter(
+                    status__in=(OUTBOX_STATUS_PENDING, OUTBOX_STATUS_SENDING), next_attempt_at__lte=now).order_by(
+                    "next_attempt_at", "id")[:self.batch_size])
+            lease_until = now + timedelta(seconds=LEASE_SECONDS)
+            NotificationOutbox.objects.filter(id__in=[outbox_obj.id for outbox_obj in outbox_objects]).update(
+                status=OUTBOX_STATUS_SENDING, next_attempt_at=lease_until, attempts=F("attempts") + 1)
+        for outbox_obj in outbox_objects:
+            outbox_obj.status = OUTBOX_STATUS_SENDING
+            outbox_obj.next_attempt_at = lease_until
+            outbox_obj.attempts += 1
+        return outbox_objects
+
+    def sendChannel(self, channel, outbox_objects):
+        """機能
+        同じchannelの通知を送信する。sinkがsendBatch()を持つ場合はまとめて送信する。
+
+        Returns:
+            [(outbox_obj, 例外またはNone), ...]
+        """
+        sink = self.sinks.get(channel)
+        if sink is None:
+            error = NotificationPermanentError("unknown channel: {}".format(channel))
+            return [(outbox_obj, error) for outbox_obj in outbox_objects]
+
+        if hasattr(sink, "sendBatch"):
+            try:
+                errors = sink.sendBatch(outbox_objects)
+            except Exception as e:
+                return [(outbox_obj, e) for outbox_obj in outbox_objects]
+            return [(outbox_obj, errors.get(outbox_obj.id)) for outbox_obj in outbox_objects]
+
+        results = []
+        for outbox_obj in outbox_objects:
+            try:
+                sink.send(outbox_obj)
+            except Exception as e:
+                results.append((outbox_obj, e))
+                continue
+            results.append((outbox_obj, None))
+        return results
+
+    def recordResult(self, outbox_obj, error):
+        """機能
+        送信結果をoutbox_objに保存する。attemptsはclaimBatch()で増やしている。
+        通知ごとに1回のUPDATE(autocommit)で記録するので、途中で停止しても記録済みの結果は失われない。
+
+        Args:
+            error: 送信に失敗した場合は例外、成功した場合はNone
+        Returns:
+            str: "sent", "retry", "dead"のいずれか
+        """
+        if isinstance(error, NotificationPermanentError):
+            return self.markDead(outbox_obj, error)
+        if error is not None:
+            if outbox_obj.attempts >= MAX_ATTEMPTS:
+                return self.markDead(outbox_obj, error)
+            outbox_obj.status = OUTBOX_STATUS_PENDING
+            outbox_obj.next_attempt_at = timezone.now() + timedelta(seconds=getBackoffSeconds(outbox_obj.attempts))
+            outbox_obj.last_error = self.formatError(error)
+            outbox_obj.save(update_fields=["attempts", "status", "next_attempt_at", "last_error"])
+            return "retry"
+
+        outbox_obj.status = OUTBOX_STATUS_SENT
+        outbox_obj.sent_at = timezone.now()
+        outbox_obj.save(update_fields=["attempts", "status", "sent_at"])
+        return "sent"
+
+    def markDead(self, outbox_obj, error):
+        outbox_obj.status = OUTBOX_STATUS_DEAD
+        outbox_obj.last_error = self.formatError(error)
+        outbox_obj.save(update_fields=["attempts", "status", "last_error"])
+        return "dead"
+
+    def formatError(self, error):
+        return "{}: {}".format(type(error).__name__, error)[:MAX_ERROR_LENGTH]
+
+    def run(self, interval=1):
+        last_purged_at = None
+        while True:
+            # drain()は送信待ちの通知がなくなるまで送信するので、その後interval秒待つ
+            self.drain()
+            if last_purged_at is None or time.monotonic() - last_purged_at >= PURGE_INTERVAL_SECONDS:
+                purgeNotificationOutbox()
+                last_purged_at = time.monotonic()
+            time.sleep(interval)
+
+
+def purgeNotificationOutbox(sent_days=None, dead_days=None, batch_size=None):
+    """機能
+    送信から(sent_at)sent_days日を過ぎたsentの通知と、作成から(created_at)dead_days日を過ぎたdeadの通知を削除する。
+    batch_size件ずつ削除するので、長時間テーブルをロックすることはない。
+
+    Args:
+        sent_days: int ...指定しない場合はsettings.NOTIFICATION_OUTBOX_SENT_RETENTION_DAYS
+        dead_days: int ...指定しない場合はsettings.NOTIFICATION_OUTBOX_DEAD_RETENTION_DAYS
+        batch_size: int ...指定しない場合はsettings.NOTIFICATION_OUTBOX_PURGE_BATCH_SIZE
+    Returns:
+        int: 削除した通知の数
+
+    コピペ
+        purged = purgeNotificationOutbox()
+    """
+    sent_days = settings.NOTIFICATION_OUTBOX_SENT_RETENTION_DAYS if sent_days is None else sent_days
+    dead_days = settings.NOTIFICATION_OUTBOX_DEAD_RETENTION_DAYS if dead_days is None else dead_days
+    batch_size = settings.NOTIFICATION_OUTBOX_PURGE_BATCH_SIZE if batch_size is None else batch_size
+    now = timezone.now()
+    targets = (
+        NotificationOutbox.objects.filter(status=OUTBOX_STATUS_SENT, sent_at__lt=now - timedelta(days=sent_days)),
+        NotificationOutbox.objects.filter(status=OUTBOX_STATUS_DEAD, created_at__lt=now - timedelta(days=dead_days)),
+    )
+
+    purged = 0
+    for queryset in targets:
+        while True:
+            ids = list(queryset.order_by("id").values_list("id", flat=True)[:batch_size])
+            if len(ids) == 0:
+                break
+            deleted, _ = NotificationOutbox.objects.filter(id__in=ids).delete()
+            purged += deleted
+            if len(ids) < batch_size:
+                break
+    return purged
@@ -0,0 +1,297 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, connections
+from avisos.events import AVISO_EVENT_CHANNEL, decodeEventPayload
+
+
+"""
+新しいAvisoとダイレクトメッセージをServer-Sent Events(SSE)でクライアントに送るモジュール。
+
+    GET /api/events/stream/   (Authorization: Token <key> またはログイン中のセッション)
+
+    event: ready
+    data: {"user_id": 1}
+
+    event: aviso
+    data: {"type": "aviso", "id": 10, "modelName": "itemcontact", ...}
+
+AvisoEventStreamAppはDjangoのビューではなくASGIアプリケーション(config/asgi.py)で、uvicornのプロセスで動かす。
+1つの接続はasyncio.Queue 1つとコルーチン1つなので、1プロセスで数千の待機中の接続を保持できる。
+DBにアクセスするのは接続時の認証のみで、イベントの待機中はDBの接続を使わない。
+
+イベントはavisos/events.pyでNOTIFYされ、PostgresEventListenerがプロセスごとに1つの接続でLISTENし、
+AvisoEventBroker(プロセス内のpub/sub)を通して該当ユーザーの接続に配る。
+テストではAvisoEventBrokerに直接publish()することで、PostgreSQLのLISTENや外部のブローカーなしで確認できる。
+"""
+
+logger = logging.getLogger(__name__)
+
+# 接続ごとに保持するイベントの上限。超えた場合は古いイベントから捨てる(クライアントはAPIで再取得できる)
+SUBSCRIBER_QUEUE_SIZE = 100
+# プロキシにタイムアウトで切断されないようにコメント行を送る間隔
+KEEPALIVE_SECONDS = 25
+# 切断されたクライアントが再接続するまでの時間(ミリ秒)
+RETRY_MILLISECONDS = 3000
+LISTENER_RECONNECT_SECONDS = 5
+
+_db_executor = ThreadPoolExecutor(max_workers=4)
+
+
+class AvisoEventBroker(object):
+
+    """ *使用方法*
+
+    from avisos.stream import AvisoEventBroker
+
+    broker = AvisoEventBroker()
+    queue = broker.subscribe(user_id)
+    broker.publish([(user_id, {"type": "aviso", ...})])
+    event = await queue.get()
+    broker.unsubscribe(user_id, queue)
+
+    同じユーザーが複数の端末、タブから接続した場合はそれぞれのqueueにイベントを送る。
+    イベントループのスレッドからのみ呼び出す。
+    """
+
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = {}
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if len(queues) == 0:
+            del self.subscribers[user_id]
+
+    def publish(self, user_events):
+        """機能
+        接続中のユーザーにイベントを送る。接続していないユーザーへのイベントは捨てる。
+
+        Args:
+            user_events: [(user_id, event), ...]
+        Returns:
+            int: イベントを送ったqueueの数
+        """
+        delivered = 0
+        for user_id, event in user_events:
+            for queue in self.subscribers.get(user_id, ()):
+                if queue.full():
+                    # 読み出しが遅いクライアントのために他の接続を止めないよう、古いイベントを捨てる
+                    queue.get_nowait()
+                queue.put_nowait(event)
+                delivered += 1
+        return delivered
+
+    def getConnectionCount(self):
+        return sum(len(queues) for queues in self.subscribers.values())
+
+
+class PostgresEventListener(object):
+
+    """ *使用方法*
+
+    listener = PostgresEventListener(broker)
+    await listener.start()      # config/asgi.pyのlifespanで呼び出す
+    listener.stop()
+
+    AVISO_EVENT_CHANNELをLISTENする専用の接続を1つ作成し、通知をbroker.publish()に渡す。
+    接続はイベントループのadd_reader()で待つので、スレッドは使わない。切断された場合は再接続する。
+    """
+
+    def __init__(self, broker, using="default"):
+        self.broker = broker
+        self.using = using
+        self.connection = None
+        self.loop = None
+
+    async def start(self):
+        self.loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await self.loop.run_in_executor(_db_executor, self.connect)
+                return
+            except Exception:
+                logger.exception("failed to LISTEN %s, retrying", AVISO_EVENT_CHANNEL)
+                await asyncio.sleep(LISTENER_RECONNECT_SECONDS)
+
+    def connect(self):
+        db_connection = connections[self.using]
+        self.connection = db_connection.get_new_connection(db_connection.get_connection_params())
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute("LISTEN {}".format(AVISO_EVENT_CHANNEL))
+        self.loop.call_soon_threadsafe(self.loop.add_reader, self.connection.fileno(), self.onReadable)
+
+    def onReadable(self):
+        try:
+            self.connection.poll()
+        except Exception:
+            logger.exception("LISTEN connection lost, reconnecting")
+            self.stop()
+            self.loop.create_task(self.start())
+            return
+        while self.connection.notifies:
+            notify = self.connection.notifies.pop(0)
+            try:
+                self.broker.publish(decodeEventPayload(notify.payload))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("invalid payload on %s: %r", AVISO_EVENT_CHANNEL, notify.payload)
+
+    def stop(self):
+        if self.connection is None:
+            return
+        try:
+            self.loop.remove_reader(self.connection.fileno())
+        except Exception:
+            pass
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+
+
+def getHeader(scope, name):
+    for key, value in scope.get("headers", []):
+        if key.decode("latin-1").lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def authenticateScope(scope):
+    """機能
+    ASGIのscopeからユーザーを特定する。
+    Authorizationヘッダーの認証トークンを優先し、ない場合はセッションのCookieを使う。
+    EventSource(ブラウザ)はヘッダーを指定できないので、Androidはヘッダー、webはセッションを想定している。
+    クエリ文字列(?token=)のトークンはアクセスログやプロキシのログに残るので受け付けない。
+
+    Returns:
+        int: user_id (認証できない場合はNone)
+    """
+    from rest_framework.authtoken.models import Token
+
+    close_old_connections()
+    try:
+        token = None
+        authorization = getHeader(scope, "authorization")
+        if authorization and authorization.startswith("Token "):
+            token = authorization.split(" ", 1)[1].strip()
+        if token:
+            token_obj = Token.objects.select_related("user").filter(key=token).first()
+            if token_obj is None or token_obj.user.is_active is False:
+                return None
+            return token_obj.user_id
+
+        cookie = SimpleCookie(getHeader(scope, "cookie") or "")
+        morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+        if morsel is None:
+            return None
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        user_obj = get_user(SimpleNamespace(session=session_store(morsel.value)))
+        if user_obj.is_anonymous:
+            return None
+        return user_obj.id
+    finally:
+        close_old_connections()
+
+
+def formatEvent(event_name, data):
+    return "event: {}\ndata: {}\n\n".format(
+        event_name, json.dumps(data, ensure_ascii=False, separators=(",", ":"))).encode("utf-8")
+
+
+class AvisoEventStreamApp(object):
+
+    """ *使用方法*
+
+    broker = AvisoEventBroker()
+    application = AvisoEventStreamApp(broker)        # ASGIアプリケーション
+
+    authenticateにはscopeを受け取りuser_id(またはNone)を返す関数を渡す。テストではDBを使わない関数を渡せる。
+    authenticateは同期関数で、スレッドプールで実行する。
+    """
+
+    def __init__(self, broker, authenticate=authenticateScope, keepalive_seconds=KEEPALIVE_SECONDS):
+        self.broker = broker
+        self.authenticate = authenticate
+        self.keepalive_seconds = keepalive_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        if scope["method"] != "GET":
+            await self.sendError(send, 405)
+            return
+
+        loop = asyncio.get_event_loop()
+        user_id = await loop.run_in_executor(_db_executor, self.authenticate, scope)
+        if user_id is None:
+            await self.sendError(send, 401)
+            return
+
+        queue = self.broker.subscribe(user_id)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    # nginxでバッファリングしない
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            await send({
+                "type": "http.response.body",
+                "body": "retry: {}\n".format(RETRY_MILLISECONDS).encode("utf-8") + formatEvent("ready", {"user_id": user_id}),
+                "more_body": True,
+            })
+            await self.streamEvents(queue, receive, send)
+        finally:
+            self.broker.unsubscribe(user_id, queue)
+
+    async def streamEvents(self, queue, receive, send):
+        """
+        クライアントが切断する(http.disconnect)まで、queueのイベントを送り続ける
+        """
+        disconnected = asyncio.ensure_future(self.waitDisconnect(receive))
+        try:
+            while not disconnected.done():
+                getter = asyncio.ensure_future(queue.get())
+                done, pending = await asyncio.wait(
+                    [getter, disconnected], timeout=self.keepalive_seconds, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    event = getter.result()
+                    body = formatEvent(event.get("type", "message"), event)
+                else:
+                    getter.cancel()
+                    if disconnected in done:
+                        return
+                    body = b": keepalive\n\n"
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            disconnected.cancel()
+
+    async def waitDisconnect(self, receive):
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def sendError(self, send, status):
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b""})
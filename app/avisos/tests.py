@@ -8,7 +8,28 @@ from django.test import Client
 from django.urls import reverse, reverse_lazy
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from avisos.models import Aviso
+from avisos.models import (
+    Aviso, ArchivedAviso, NotificationOutbox, markAvisoChecked, markAvisosChecked,
+    OUTBOX_CHANNEL_FCM, OUTBOX_CHANNEL_EMAIL,
+    OUTBOX_STATUS_PENDING, OUTBOX_STATUS_SENDING, OUTBOX_STATUS_SENT, OUTBOX_STATUS_DEAD,
+)
+from config.utils import add_aviso_objects
+from avisos.archive import archiveCheckedAvisos
+from avisos.events import encodeEventPayloads, decodeEventPayload, EVENT_AVISO, EVENT_DM_CONTENT, MAX_PAYLOAD_BYTES
+from avisos.stream import AvisoEventBroker, AvisoEventStreamApp, authenticateScope
+from avisos.outbox import NotificationOutboxWorker, NotificationPermanentError, MAX_ATTEMPTS, LEASE_SECONDS, purgeNotificationOutbox
+import asyncio
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from item_contacts.models import ItemContact
+from direct_messages.models import DirectMessageContent
 from categories.models import Category
 from api.models import DeviceToken
 from items.models import Item
@@ -20,7 +41,7 @@ from config.tests.utils import (
     create_user_for_test, create_user_data,
     create_item_for_test, create_item_data,
     create_solicitud_for_test, create_solicitud_data,
-    create_direct_message_for_test
+    create_direct_message_for_test, FakeNotificationSink,
 )
 
 
@@ -133,6 +154,273 @@ class AvisosListViewTestCase(TestCase):
         self.assertEqual(avisos_response.count(), 4)
 
 
+class AvisoUnreadCountTest(TestCase):
+
+    """テスト対象
+    avisos/models.py addUnreadAvisoCount, markAvisoChecked
+    avisos/views.py AvisoCheckingView#get
+    config/utils.py add_aviso_objects
+    """
+    """テスト項目
+    Avisoが作成されるとProfile.unread_aviso_countが増える
+    AvisoCheckingViewで既読にするとunread_aviso_countが1つ減り、2回目は減らない
+    add_aviso_objectsは2回目以降はDBにクエリを発行せず、既読にすると新しい未読数を返す
+    rebuild_unread_aviso_countでunread_aviso_countがAvisoの未読数に修正される
+    """
+
+    def setUp(self):
+        cache.clear()
+        category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        self.contact_user = User.objects.create_user(username="contact_user", email="test_contact_user@gmail.com", password='12345')
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム１", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        for num in range(3):
+            item_contact_obj = ItemContact.objects.create(
+                post_user=Profile.objects.get(user=self.contact_user), message="コメント{}".format(num))
+            self.item_obj.item_contacts.add(item_contact_obj)
+
+    def getUnreadCount(self):
+        return Profile.objects.get(user=self.post_user).unread_aviso_count
+
+    def getContext(self):
+        request = RequestFactory().get("/")
+        request.user = self.post_user
+        return add_aviso_objects(request, {})
+
+    def test_Avisoが作成されるとunread_aviso_countが増える(self):
+        self.assertEqual(self.getUnreadCount(), 3)
+        self.assertEqual(Profile.objects.get(user=self.contact_user).unread_aviso_count, 0)
+
+    def test_AvisoCheckingViewで既読にするとunread_aviso_countが1つ減る(self):
+        aviso_obj = Aviso.objects.filter(aviso_user__user=self.post_user).first()
+        self.client = Client()
+        self.client.login(username="post_user", password='12345')
+        self.client.get(reverse("avisos:aviso_check", args=(aviso_obj.id,)))
+        self.assertEqual(self.getUnreadCount(), 2)
+        self.assertTrue(Aviso.objects.get(id=aviso_obj.id).checked)
+        # 既読のAvisoをもう一度選択しても減らない
+        self.client.get(reverse("avisos:aviso_check", args=(aviso_obj.id,)))
+        self.assertEqual(self.getUnreadCount(), 2)
+
+    def test_add_aviso_objectsは2回目以降クエリを発行しない(self):
+        context = self.getContext()
+        self.assertEqual(context["aviso_count"], 3)
+        self.assertEqual(len(context["aviso_objects"]), 3)
+        with CaptureQueriesContext(connection) as queries:
+            context = self.getContext()
+        self.assertEqual(len(queries.captured_queries), 0)
+        self.assertEqual(context["aviso_count"], 3)
+
+        markAvisoChecked(Aviso.objects.filter(aviso_user__user=self.post_user).first())
+        self.assertEqual(self.getContext()["aviso_count"], 2)
+
+    def test_rebuild_unread_aviso_countでAvisoの未読数に修正される(self):
+        Profile.objects.filter(user=self.post_user).update(unread_aviso_count=100)
+        aviso_obj = Aviso.objects.filter(aviso_user__user=self.post_user).order_by("id").first()
+        Aviso.objects.filter(id=aviso_obj.id).update(checked=True)
+        call_command("rebuild_unread_aviso_count", stdout=StringIO())
+        self.assertEqual(self.getUnreadCount(), 2)
+
+
+class AvisoItemSnapshotTest(TestCase):
+
+    """テスト対象
+    avisos/models.py Aviso.item, Aviso.item_title
+    avisos/views.py AvisoCheckingView#get
+    avisos/management/commands/backfill_aviso_item.py
+    """
+    """テスト項目
+    コメント、取引申請、DirectMessage、ダイレクトメッセージのAvisoに記事と記事タイトルが保存される
+    AvisoCheckingViewはAviso.itemの記事の詳細ページにリダイレクトする
+    AvisoCheckingViewはAviso.itemが設定されていない場合は通知対象から記事を辿ってリダイレクトする
+    backfill_aviso_itemで記事が設定されていないAvisoに記事と記事タイトルが設定される
+    """
+
+    def setUp(self):
+        self.category_obj = pickUp_category_obj_for_test()
+        self.post_user_obj, self.post_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="post_user"))
+        self.item_obj = create_item_for_test(self.post_user_obj, create_item_data(self.category_obj))
+        self.contact_user_obj, self.contact_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="contact_user"))
+
+    def test_各Avisoに記事と記事タイトルが保存される(self):
+        create_item_contact_for_test(self.contact_user_obj)
+        solicitud_obj = create_solicitud_for_test(self.item_obj, self.contact_user_obj, create_solicitud_data(message=None))
+        dm_obj, item_obj = create_direct_message_for_test(solicitud_obj)
+
+        aviso_objects = Aviso.objects.all()
+        self.assertEqual(
+            sorted(aviso_objects.values_list("content_type__model", flat=True)),
+            ["directmessage", "itemcontact", "solicitud"])
+        for aviso_obj in aviso_objects:
+            self.assertEqual(aviso_obj.item_id, self.item_obj.id)
+            self.assertEqual(aviso_obj.item_title, self.item_obj.title)
+
+    def test_AvisoCheckingViewはAviso_itemの記事詳細ページにリダイレクトする(self):
+        create_item_contact_for_test(self.contact_user_obj)
+        aviso_obj = Aviso.objects.get(aviso_user=self.post_profile_obj)
+        self.client = Client()
+        self.client.login(username=self.post_user_obj.username, password='1234tweet')
+        response = self.client.get(reverse("avisos:aviso_check", args=(aviso_obj.id,)))
+        self.assertRedirects(
+            response, reverse(ViewName.ITEM_DETAIL, args=(self.item_obj.id,)), fetch_redirect_response=False)
+
+    def test_Aviso_itemが設定されていない場合は通知対象から記事を辿ってリダイレクトする(self):
+        solicitud_obj = create_solicitud_for_test(self.item_obj, self.contact_user_obj, create_solicitud_data(message=None))
+        Aviso.objects.update(item=None, item_title="")
+        aviso_obj = Aviso.objects.get(aviso_user=self.post_profile_obj, content_type__model="solicitud")
+        self.client = Client()
+        self.client.login(username=self.post_user_obj.username, password='1234tweet')
+        response = self.client.get(reverse("avisos:aviso_check", args=(aviso_obj.id,)))
+        self.assertRedirects(
+            response, reverse(ViewName.SOLICITUD_LIST, args=(self.item_obj.id,)), fetch_redirect_response=False)
+        # 辿った記事はAvisoに保存される
+        aviso_obj.refresh_from_db()
+        self.assertEqual(aviso_obj.item_id, self.item_obj.id)
+        self.assertEqual(aviso_obj.item_title, self.item_obj.title)
+
+    def test_backfill_aviso_itemで記事と記事タイトルが設定される(self):
+        create_item_contact_for_test(self.contact_user_obj)
+        Aviso.objects.update(item=None, item_title="")
+        call_command("backfill_aviso_item", stdout=StringIO())
+        aviso_obj = Aviso.objects.get(aviso_user=self.post_profile_obj)
+        self.assertEqual(aviso_obj.item_id, self.item_obj.id)
+        self.assertEqual(aviso_obj.item_title, self.item_obj.title)
+
+
+class AvisoArchiveTest(TestCase):
+
+    """テスト対象
+    avisos/models.py Aviso.created_at
+    avisos/archive.py archiveCheckedAvisos
+    """
+    """テスト項目
+    既読にしてもcreated_atは変更されない
+    既読かつdays日を過ぎたAvisoのみArchivedAvisoに移動される
+    batch_size件ずつ移動され、対象がなくなるまで繰り返す
+    """
+
+    def setUp(self):
+        category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        contact_user = User.objects.create_user(username="contact_user", email="test_contact_user@gmail.com", password='12345')
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム１", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        for num in range(5):
+            item_contact_obj = ItemContact.objects.create(
+                post_user=Profile.objects.get(user=contact_user), message="コメント{}".format(num))
+            self.item_obj.item_contacts.add(item_contact_obj)
+        self.aviso_ids = list(Aviso.objects.order_by("id").values_list("id", flat=True))
+
+    def test_既読にしてもcreated_atは変更されない(self):
+        aviso_obj = Aviso.objects.get(id=self.aviso_ids[0])
+        created_at = aviso_obj.created_at
+        markAvisoChecked(aviso_obj)
+        aviso_obj = Aviso.objects.get(id=self.aviso_ids[0])
+        aviso_obj.checked = True
+        aviso_obj.save()
+        self.assertEqual(Aviso.objects.get(id=self.aviso_ids[0]).created_at, created_at)
+
+    def test_既読かつdays日を過ぎたAvisoのみ移動される(self):
+        old = timezone.now() - timedelta(days=31)
+        # 0~2: 既読かつ古い, 3: 未読かつ古い, 4: 既読かつ新しい
+        Aviso.objects.filter(id__in=self.aviso_ids[:4]).update(created_at=old)
+        Aviso.objects.filter(id__in=self.aviso_ids[:3] + self.aviso_ids[4:]).update(checked=True)
+
+        archived = archiveCheckedAvisos(days=30, batch_size=2)
+        self.assertEqual(archived, 3)
+        self.assertEqual(sorted(Aviso.objects.values_list("id", flat=True)), self.aviso_ids[3:])
+        self.assertEqual(sorted(ArchivedAviso.objects.values_list("id", flat=True)), self.aviso_ids[:3])
+        archived_aviso_obj = ArchivedAviso.objects.get(id=self.aviso_ids[0])
+        self.assertEqual(archived_aviso_obj.item_id, self.item_obj.id)
+        self.assertEqual(archived_aviso_obj.aviso_user, Profile.objects.get(user=self.post_user))
+        self.assertEqual(archived_aviso_obj.created_at, old)
+
+        # 対象がなくなった後は何も移動しない
+        self.assertEqual(archiveCheckedAvisos(days=30, batch_size=2), 0)
+
+
+class AvisoCheckAllTest(TestCase):
+
+    """テスト対象
+    avisos/models.py markAvisosChecked
+    avisos/views.py AvisoCheckAllView#post
+
+    endpoint: /avisos/checking/all/
+    name: "avisos:aviso_check_all"
+    """
+    """テスト項目
+    指定なしの場合は全ての未読のAvisoが1回のUPDATEで既読になり、unread_aviso_countが0になる
+    content_type, itemを指定した場合はそのAvisoのみ既読になり、unread_aviso_countが既読にした数だけ減る
+    不正なcontent_typeの場合はValueErrorを送出し、Avisoは変更されない
+    Ajaxの場合は未読数と既読にした数を返し、add_aviso_objectsも新しい未読数を返す
+    """
+
+    def setUp(self):
+        cache.clear()
+        category_obj = pickUp_category_obj_for_test()
+        self.post_user_obj, self.post_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="post_user"))
+        self.contact_user_obj, self.contact_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="contact_user"))
+        self.item_obj = create_item_for_test(self.post_user_obj, create_item_data(category_obj))
+        self.other_item_obj = Item.objects.create(
+            user=self.post_user_obj, title="テストアイテム２", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        # item_objにコメント2件と取引申請1件, other_item_objにコメント1件
+        for item_obj, num in ((self.item_obj, 0), (self.item_obj, 1), (self.other_item_obj, 2)):
+            item_obj.item_contacts.add(
+                ItemContact.objects.create(post_user=self.contact_profile_obj, message="コメント{}".format(num)))
+        create_solicitud_for_test(self.item_obj, self.contact_user_obj, create_solicitud_data(message=None))
+
+    def getUnreadCount(self):
+        return Profile.objects.get(id=self.post_profile_obj.id).unread_aviso_count
+
+    def test_指定なしの場合は全てのAvisoが既読になる(self):
+        self.assertEqual(self.getUnreadCount(), 4)
+        with CaptureQueriesContext(connection) as queries:
+            checked_count, unread_count = markAvisosChecked(self.post_profile_obj)
+        update_queries = [query for query in queries.captured_queries
+                          if query["sql"].startswith('UPDATE "avisos_aviso"')]
+        self.assertEqual(len(update_queries), 1)
+        self.assertEqual((checked_count, unread_count), (4, 0))
+        self.assertEqual(self.getUnreadCount(), 0)
+        self.assertFalse(Aviso.objects.filter(aviso_user=self.post_profile_obj, checked=False).exists())
+
+    def test_content_typeとitemを指定した場合はそのAvisoのみ既読になる(self):
+        checked_count, unread_count = markAvisosChecked(self.post_profile_obj, "itemcontact", self.item_obj.id)
+        self.assertEqual((checked_count, unread_count), (2, 2))
+        self.assertEqual(
+            sorted(Aviso.objects.filter(aviso_user=self.post_profile_obj, checked=False).values_list(
+                "content_type__model", "item_id")),
+            sorted([("itemcontact", self.other_item_obj.id), ("solicitud", self.item_obj.id)]))
+
+        checked_count, unread_count = markAvisosChecked(self.post_profile_obj, item_id=self.other_item_obj.id)
+        self.assertEqual((checked_count, unread_count), (1, 1))
+        self.assertEqual(self.getUnreadCount(), 1)
+
+    def test_不正なcontent_typeの場合はValueErrorを送出する(self):
+        with self.assertRaises(ValueError):
+            markAvisosChecked(self.post_profile_obj, "user")
+        self.assertEqual(Aviso.objects.filter(aviso_user=self.post_profile_obj, checked=False).count(), 4)
+
+    def test_Ajaxの場合は未読数と既読にした数を返す(self):
+        request = RequestFactory().get("/")
+        request.user = self.post_user_obj
+        self.assertEqual(add_aviso_objects(request, {})["aviso_count"], 4)
+
+        self.client = Client()
+        self.client.login(username=self.post_user_obj.username, password='1234tweet')
+        response = self.client.post(
+            reverse("avisos:aviso_check_all"), {"content_type": "solicitud"}, HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.json(), {"aviso_count": 3, "checked_count": 1})
+        self.assertEqual(add_aviso_objects(request, {})["aviso_count"], 3)
+
+        response = self.client.post(reverse("avisos:aviso_check_all"))
+        self.assertRedirects(response, reverse(ViewName.AVISO_ALL), fetch_redirect_response=False)
+        self.assertEqual(self.getUnreadCount(), 0)
+
+
 ##################################################
 #           2. シグナルに関するテスト               ##
 ##################################################
@@ -601,6 +889,373 @@ class UserPostSaveTest(TestCase):
         self.assertEqual(device_token_obj.device_token, None)
 
 
+class ItemContactFanOutQueryCountTest(TestCase):
+
+    """テスト対象
+    avisos/models.py itemitemcontact_m2m_changed_receiver
+    """
+    """テスト項目
+    コメント送信者の数に関わらずコメント追加時に発行されるクエリの数は一定である
+    同じユーザーが複数回コメントしてもAvisoは重複せず、コメント送信者自身には作成されない
+    """
+
+    def setUp(self):
+        category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム１", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        self.commenter = User.objects.create_user(username="commenter", email="commenter@gmail.com", password='12345')
+
+    def addItemContact(self, user_obj):
+        item_contact_obj = ItemContact.objects.create(post_user=Profile.objects.get(user=user_obj), message="コメントです")
+        with CaptureQueriesContext(connection) as context:
+            self.item_obj.item_contacts.add(item_contact_obj)
+        return len(context.captured_queries)
+
+    def addContactUsers(self, start, count):
+        for num in range(start, start + count):
+            user_obj = User.objects.create_user(
+                username="contact_user{}".format(num), email="contact_user{}@gmail.com".format(num), password='12345')
+            self.addItemContact(user_obj)
+
+    def test_コメント送信者の数に関わらず発行されるクエリの数は一定である(self):
+        self.addContactUsers(0, 2)
+        query_count_with_2_users = self.addItemContact(self.commenter)
+
+        self.addContactUsers(2, 20)
+        query_count_with_22_users = self.addItemContact(self.commenter)
+        self.assertEqual(query_count_with_2_users, query_count_with_22_users)
+        self.assertLessEqual(query_count_with_22_users, 10)
+
+    def test_同じユーザーが複数回コメントしてもAvisoは重複しない(self):
+        self.addContactUsers(0, 3)
+        self.addItemContact(self.commenter)
+        self.addItemContact(self.commenter)
+        item_contact_obj = self.item_obj.item_contacts.order_by("timestamp", "id").last()
+        aviso_objects = Aviso.objects.filter(object_id=item_contact_obj.id, content_type=ContentType.objects.get_for_model(ItemContact))
+        aviso_users = sorted(aviso_objects.values_list("aviso_user__user__username", flat=True))
+        # 記事作成者と3人のコメント送信者(commenter自身は含まない)
+        self.assertEqual(aviso_users, ["contact_user0", "contact_user1", "contact_user2", "post_user"])
+
+
+#################################################
+#         3. 通知のoutboxに関するテスト           ##
+#################################################
+
+class NotificationOutboxTest(TestCase):
+
+    """テスト対象
+    avisos/models.py enqueueNotification
+    avisos/outbox.py NotificationOutboxWorker#drain
+    """
+    """テスト項目
+    コメントが追加されるとAvisoと同時にFCMとemailの通知がNotificationOutboxに保存され、リクエスト中には送信されない
+    drain()で送信待ちの通知がsinkに送信されstatusがsentになる
+    送信に失敗した通知は再送待ちになり、next_attempt_atが未来の時刻になる
+    MAX_ATTEMPTS回失敗した通知はdeadになる
+    NotificationPermanentErrorが送出された通知は再送せずにdeadになる
+    バッチの途中でワーカーが停止しても送信済みの通知はsentのまま残り、残りの通知はリースが切れた後に再び送信される
+    通知の送信中はトランザクションを保持しない
+    sent_days日を過ぎたsentの通知、dead_days日を過ぎたdeadの通知のみbatch_size件ずつ削除される
+    """
+
+    def setUp(self):
+        """テスト環境
+        記事作成者(post_user)の記事にcontact_userがコメントする
+        """
+        category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password='12345')
+        self.contact_user = User.objects.create_user(username="contact_user", email="test_contact_user@gmail.com", password='12345')
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム１", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        self.fake_fcm_sink = FakeNotificationSink()
+        self.fake_mail_sink = FakeNotificationSink()
+
+    def addItemContact(self):
+        item_contact_obj = ItemContact.objects.create(
+            post_user=Profile.objects.get(user=self.contact_user), message="コメントです")
+        self.item_obj.item_contacts.add(item_contact_obj)
+
+    def makeWorker(self):
+        return NotificationOutboxWorker(sinks={
+            OUTBOX_CHANNEL_FCM: self.fake_fcm_sink,
+            OUTBOX_CHANNEL_EMAIL: self.fake_mail_sink,
+        })
+
+    def test_コメントが追加されるとFCMとemailの通知がoutboxに保存され送信はされない(self):
+        self.addItemContact()
+        self.assertEqual(Aviso.objects.count(), 1)
+        outbox_objects = NotificationOutbox.objects.all()
+        self.assertEqual(
+            sorted(outbox_objects.values_list("channel", flat=True)), sorted([OUTBOX_CHANNEL_EMAIL, OUTBOX_CHANNEL_FCM]))
+        for outbox_obj in outbox_objects:
+            self.assertEqual(outbox_obj.recipient, self.post_user)
+            self.assertEqual(outbox_obj.status, OUTBOX_STATUS_PENDING)
+        self.assertEqual(self.fake_fcm_sink.calls + self.fake_mail_sink.calls, 0)
+
+    def test_drainで送信待ちの通知が送信されstatusがsentになる(self):
+        self.addItemContact()
+        result = self.makeWorker().drain()
+        self.assertEqual(result, {"sent": 2, "retry": 0, "dead": 0})
+        self.assertEqual(len(self.fake_fcm_sink.sent), 1)
+        self.assertEqual(self.fake_mail_sink.sent[0][0], self.post_user)
+        self.assertEqual(self.fake_mail_sink.sent[0][1]["subject"], "ShareXekla Siguió un comentario")
+        self.assertEqual(NotificationOutbox.objects.filter(status=OUTBOX_STATUS_SENT).count(), 2)
+        # 送信済みの通知は再送しない
+        self.assertEqual(self.makeWorker().drain(), {"sent": 0, "retry": 0, "dead": 0})
+
+    def test_送信に失敗した通知は再送待ちになる(self):
+        self.fake_mail_sink = FakeNotificationSink(fail_count=1)
+        self.addItemContact()
+        result = self.makeWorker().drain()
+        self.assertEqual(result, {"sent": 1, "retry": 1, "dead": 0})
+        outbox_obj = NotificationOutbox.objects.get(channel=OUTBOX_CHANNEL_EMAIL)
+        self.assertEqual(outbox_obj.status, OUTBOX_STATUS_PENDING)
+        self.assertEqual(outbox_obj.attempts, 1)
+        self.assertTrue(outbox_obj.next_attempt_at > timezone.now())
+        self.assertIn("ConnectionError", outbox_obj.last_error)
+
+        # 再送時刻を過ぎると送信される
+        NotificationOutbox.objects.filter(id=outbox_obj.id).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.makeWorker().drain(), {"sent": 1, "retry": 0, "dead": 0})
+        self.assertEqual(NotificationOutbox.objects.get(id=outbox_obj.id).attempts, 2)
+
+    def test_MAX_ATTEMPTS回失敗した通知はdeadになる(self):
+        self.fake_mail_sink = FakeNotificationSink(fail_count=MAX_ATTEMPTS)
+        self.addItemContact()
+        NotificationOutbox.objects.filter(channel=OUTBOX_CHANNEL_EMAIL).update(attempts=MAX_ATTEMPTS - 1)
+        result = self.makeWorker().drain()
+        self.assertEqual(result, {"sent": 1, "retry": 0, "dead": 1})
+        self.assertEqual(NotificationOutbox.objects.get(channel=OUTBOX_CHANNEL_EMAIL).status, OUTBOX_STATUS_DEAD)
+
+    def test_NotificationPermanentErrorの通知は再送せずにdeadになる(self):
+        self.fake_fcm_sink = FakeNotificationSink(fail_count=1, error=NotificationPermanentError("unregistered"))
+        self.addItemContact()
+        result = self.makeWorker().drain()
+        self.assertEqual(result, {"sent": 1, "retry": 0, "dead": 1})
+        outbox_obj = NotificationOutbox.objects.get(channel=OUTBOX_CHANNEL_FCM)
+        self.assertEqual(outbox_obj.status, OUTBOX_STATUS_DEAD)
+        self.assertEqual(outbox_obj.attempts, 1)
+
+    def test_バッチの途中でワーカーが停止しても送信済みの結果は残り残りはリースの後に再送される(self):
+        # FCM(先に取得される)の送信後、emailの送信中にワーカーが停止する
+        self.fake_mail_sink = FakeNotificationSink(fail_count=1, error=KeyboardInterrupt("worker stopped"))
+        self.addItemContact()
+        with self.assertRaises(KeyboardInterrupt):
+            self.makeWorker().drain()
+
+        fcm_outbox_obj = NotificationOutbox.objects.get(channel=OUTBOX_CHANNEL_FCM)
+        self.assertEqual(fcm_outbox_obj.status, OUTBOX_STATUS_SENT)
+        mail_outbox_obj = NotificationOutbox.objects.get(channel=OUTBOX_CHANNEL_EMAIL)
+        self.assertEqual(mail_outbox_obj.status, OUTBOX_STATUS_SENDING)
+        self.assertEqual(mail_outbox_obj.attempts, 1)
+        self.assertTrue(mail_outbox_obj.next_attempt_at > timezone.now() + timedelta(seconds=LEASE_SECONDS - 60))
+
+        # リースの間は他のワーカーも取得しない
+        self.assertEqual(self.makeWorker().drain(), {"sent": 0, "retry": 0, "dead": 0})
+
+        # リースが切れると再び送信される
+        NotificationOutbox.objects.filter(id=mail_outbox_obj.id).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.makeWorker().drain(), {"sent": 1, "retry": 0, "dead": 0})
+        mail_outbox_obj.refresh_from_db()
+        self.assertEqual(mail_outbox_obj.status, OUTBOX_STATUS_SENT)
+        self.assertEqual(mail_outbox_obj.attempts, 2)
+        self.assertEqual(len(self.fake_fcm_sink.sent), 1)
+
+    def test_通知はトランザクションの外で送信される(self):
+        self.addItemContact()
+        savepoint_depths = []
+
+        class RecordingSink(FakeNotificationSink):
+            def send(self, outbox_obj):
+                savepoint_depths.append(len(connection.savepoint_ids))
+                super().send(outbox_obj)
+
+        # TestCase自体のトランザクション内で実行されるので、drain()を呼び出す時点のsavepointの深さと比較する
+        depth = len(connection.savepoint_ids)
+        worker = NotificationOutboxWorker(sinks={
+            OUTBOX_CHANNEL_FCM: RecordingSink(), OUTBOX_CHANNEL_EMAIL: RecordingSink()})
+        self.assertEqual(worker.drain(), {"sent": 2, "retry": 0, "dead": 0})
+        self.assertEqual(savepoint_depths, [depth, depth])
+
+    def test_古いsentとdeadの通知のみ削除される(self):
+        for num in range(3):
+            self.addItemContact()
+        outbox_ids = list(NotificationOutbox.objects.order_by("id").values_list("id", flat=True))
+        self.assertEqual(len(outbox_ids), 6)
+        old = timezone.now() - timedelta(days=31)
+        # 0~2: 古いsent, 3: 新しいsent, 4: 古いdead, 5: 古いpending
+        NotificationOutbox.objects.filter(id__in=outbox_ids[:3]).update(status=OUTBOX_STATUS_SENT, sent_at=old)
+        NotificationOutbox.objects.filter(id=outbox_ids[3]).update(status=OUTBOX_STATUS_SENT, sent_at=timezone.now())
+        NotificationOutbox.objects.filter(id=outbox_ids[4]).update(status=OUTBOX_STATUS_DEAD, created_at=old)
+        NotificationOutbox.objects.filter(id=outbox_ids[5]).update(created_at=old)
+
+        self.assertEqual(purgeNotificationOutbox(sent_days=7, dead_days=30, batch_size=2), 4)
+        self.assertEqual(sorted(NotificationOutbox.objects.values_list("id", flat=True)), outbox_ids[3:4] + outbox_ids[5:])
+        # 対象がなくなった後は何も削除しない
+        self.assertEqual(purgeNotificationOutbox(sent_days=7, dead_days=30, batch_size=2), 0)
+
 
+#################################################
+#       4. イベントストリームに関するテスト          ##
+#################################################
+
+class AvisoEventPublishTest(TestCase):
+
+    """テスト対象
+    avisos/models.py aviso_post_save_receiver, itemitemcontact_m2m_changed_receiver, dm_content_m2m_receiver
+    avisos/events.py encodeEventPayloads, decodeEventPayload
+    """
+    """テスト項目
+    コメントが追加されると通知するユーザーごとにavisoイベントが1回のpublishEventsで発行される
+    取引申請のAvisoが作成されるとavisoイベントが発行される
+    ダイレクトメッセージが送信されると相手にdm_contentイベントが発行される
+    payloadはMAX_PAYLOAD_BYTES以下に分割され、元のイベントに戻せる
+    """
 
+    def setUp(self):
+        self.category_obj = pickUp_category_obj_for_test()
+        self.post_user_obj, self.post_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="post_user"))
+        self.item_obj = create_item_for_test(self.post_user_obj, create_item_data(self.category_obj))
+        self.contact_user_obj, self.contact_profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="contact_user"))
+
+    def getPublishedEvents(self, publish_events):
+        return [user_event for call in publish_events.call_args_list for user_event in call[0][0]]
+
+    def test_コメントが追加されるとavisoイベントが発行される(self):
+        with mock.patch("avisos.models.publishEvents") as publish_events:
+            self.item_obj.item_contacts.add(
+                ItemContact.objects.create(post_user=self.contact_profile_obj, message="コメント"))
+        self.assertEqual(publish_events.call_count, 1)
+        aviso_obj = Aviso.objects.get(aviso_user=self.post_profile_obj)
+        user_id, event = self.getPublishedEvents(publish_events)[0]
+        self.assertEqual(user_id, self.post_user_obj.id)
+        self.assertEqual(event["type"], EVENT_AVISO)
+        self.assertEqual(event["id"], aviso_obj.id)
+        self.assertEqual(event["modelName"], "itemcontact")
+        self.assertEqual(event["item_title"], self.item_obj.title)
+
+    def test_取引申請のAvisoが作成されるとavisoイベントが発行される(self):
+        with mock.patch("avisos.models.publishEvents") as publish_events:
+            create_solicitud_for_test(self.item_obj, self.contact_user_obj, create_solicitud_data(message=None))
+        events = [event for user_id, event in self.getPublishedEvents(publish_events) if user_id == self.post_user_obj.id]
+        self.assertEqual([event["modelName"] for event in events], ["solicitud"])
+
+    def test_ダイレクトメッセージが送信されると相手にdm_contentイベントが発行される(self):
+        solicitud_obj = create_solicitud_for_test(self.item_obj, self.contact_user_obj, create_solicitud_data(message=None))
+        dm_obj, item_obj = create_direct_message_for_test(solicitud_obj)
+        with mock.patch("avisos.models.publishEvents") as publish_events:
+            dm_content_obj = DirectMessageContent.objects.create(content="hola", profile=dm_obj.owner)
+            dm_obj.direct_message_contents.add(dm_content_obj)
+        published = self.getPublishedEvents(publish_events)
+        self.assertIn(
+            (dm_obj.participant.user_id, EVENT_DM_CONTENT, dm_content_obj.id),
+            [(user_id, event["type"], event["id"]) for user_id, event in published])
+        self.assertNotIn(dm_obj.owner.user_id, [user_id for user_id, event in published])
+
+    def test_payloadは分割され元のイベントに戻せる(self):
+        user_events = [(num, {"type": EVENT_AVISO, "id": num, "item_title": "テストアイテム" * 5}) for num in range(200)]
+        payloads = encodeEventPayloads(user_events)
+        self.assertTrue(len(payloads) > 1)
+        for payload in payloads:
+            self.assertTrue(len(payload.encode("utf-8")) <= MAX_PAYLOAD_BYTES + 20)
+        self.assertEqual(
+            [user_event for payload in payloads for user_event in decodeEventPayload(payload)], user_events)
+
+
+class AvisoEventStreamAppTest(TestCase):
 
+    """テスト対象
+    avisos/stream.py AvisoEventBroker, AvisoEventStreamApp, authenticateScope
+
+    endpoint: /api/events/stream/ (config/asgi.py)
+    """
+    """テスト項目
+    接続したユーザーにはreadyと本人宛てのイベントのみがSSEで送られる
+    切断するとbrokerから購読が解除される
+    認証できない場合は401が返る
+    Authorizationヘッダーのトークンで認証し、クエリ文字列(?token=)のトークンでは認証しない
+    同じユーザーの複数の接続にイベントが送られ、queueが一杯の場合は古いイベントを捨てる
+    """
+
+    SCOPE = {"type": "http", "method": "GET", "path": "/api/events/stream/", "headers": [], "query_string": b""}
+
+    def setUp(self):
+        self.broker = AvisoEventBroker()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def runStream(self, user_id, user_events):
+        """
+        user_idで接続し、user_eventsをpublishした後に切断する。送信されたASGIのメッセージを返す。
+        """
+        app = AvisoEventStreamApp(self.broker, authenticate=lambda scope: user_id, keepalive_seconds=5)
+        messages = []
+        receive_queue = []
+
+        async def receive():
+            return await receive_queue[0].get()
+
+        async def send(message):
+            messages.append(message)
+
+        async def scenario():
+            receive_queue.append(asyncio.Queue())
+            task = asyncio.ensure_future(app(dict(self.SCOPE), receive, send))
+            for _ in range(100):
+                if self.broker.getConnectionCount() > 0 or task.done():
+                    break
+                await asyncio.sleep(0.01)
+            self.broker.publish(user_events)
+            await asyncio.sleep(0.05)
+            await receive_queue[0].put({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 1)
+
+        self.loop.run_until_complete(scenario())
+        return messages
+
+    def test_本人宛てのイベントのみがSSEで送られる(self):
+        messages = self.runStream(1, [(1, {"type": "aviso", "id": 10}), (2, {"type": "aviso", "id": 20})])
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream; charset=utf-8"), messages[0]["headers"])
+        body = b"".join(message.get("body", b"") for message in messages[1:])
+        self.assertIn(b'event: ready\ndata: {"user_id":1}\n\n', body)
+        self.assertIn(b'event: aviso\ndata: {"type":"aviso","id":10}\n\n', body)
+        self.assertNotIn(b'"id":20', body)
+
+    def test_切断するとbrokerから購読が解除される(self):
+        self.runStream(1, [])
+        self.assertEqual(self.broker.getConnectionCount(), 0)
+        self.assertEqual(self.broker.publish([(1, {"type": "aviso", "id": 10})]), 0)
+
+    def test_認証できない場合は401が返る(self):
+        messages = self.runStream(None, [])
+        self.assertEqual(messages[0]["status"], 401)
+        self.assertEqual(self.broker.getConnectionCount(), 0)
+
+    def test_ヘッダーのトークンで認証しクエリ文字列のトークンでは認証しない(self):
+        from rest_framework.authtoken.models import Token
+        user_obj, _ = create_user_for_test(create_user_data(prefix_user_emailaddress="stream"))
+        token_obj, _ = Token.objects.get_or_create(user=user_obj)
+
+        header_scope = dict(self.SCOPE, headers=[(b"authorization", "Token {}".format(token_obj.key).encode("latin-1"))])
+        self.assertEqual(authenticateScope(header_scope), user_obj.id)
+        query_scope = dict(self.SCOPE, query_string="token={}".format(token_obj.key).encode("latin-1"))
+        self.assertIsNone(authenticateScope(query_scope))
+
+    def test_同じユーザーの複数の接続にイベントが送られる(self):
+        broker = AvisoEventBroker(queue_size=2)
+
+        async def scenario():
+            queue1 = broker.subscribe(1)
+            queue2 = broker.subscribe(1)
+            self.assertEqual(broker.publish([(1, {"id": num}) for num in range(3)]), 6)
+            return [queue1.get_nowait()["id"] for _ in range(queue1.qsize())], queue2.qsize()
+
+        ids, queue2_size = self.loop.run_until_complete(scenario())
+        self.assertEqual(ids, [1, 2])
+        self.assertEqual(queue2_size, 2)
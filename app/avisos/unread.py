@@ -0,0 +1,71 @@
+import time
+from django.core.cache import cache
+
+
+"""
+navbarに表示する未読のAvisoの数と最新の未読Avisoをユーザーごとにキャッシュするモジュール。
+
+未読数はProfile.unread_aviso_countに保存し、Avisoの作成、既読、削除時にavisos/models.pyで同じトランザクション内で更新する。
+キャッシュのキーにはユーザーごとのバージョン番号を含めている。Profile.unread_aviso_countを更新するとコミット後に
+invalidate()が呼ばれバージョン番号が1つ進むので、コミット前のデータで作成された値が以降のリクエストで使われることはない。
+(items/home_feed.pyと同じ仕組み)
+"""
+
+AVISO_UNREAD_VERSION_CACHE_KEY = "avisos:unread:version:{user_id}"
+AVISO_UNREAD_CACHE_KEY = "avisos:unread:{user_id}:{version}"
+AVISO_UNREAD_TIMEOUT = 60 * 60 * 24
+# navbarに表示する最新の未読Avisoの数
+AVISO_UNREAD_LATEST_COUNT = 5
+
+
+class AvisoUnreadCache(object):
+
+    """ *使用方法*
+
+    from avisos.unread import aviso_unread_cache
+
+    summary = aviso_unread_cache.getSummary(user_obj.id, lambda: {"count": 3, "latest": [...]})
+    summary["count"], summary["latest"]
+
+    aviso_unread_cache.invalidate([user_obj.id, ...])
+
+    キャッシュにない場合のみbuilder()を呼び出して作成し、保存する。
+    """
+
+    def getVersion(self, user_id):
+        key = AVISO_UNREAD_VERSION_CACHE_KEY.format(user_id=user_id)
+        version = cache.get(key)
+        if version is None:
+            # バージョン番号がキャッシュから消えた場合に過去の番号を再利用しないよう時刻を使う
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        return version
+
+    def getSummary(self, user_id, builder):
+        """機能
+        ユーザーの未読Avisoの数と最新の未読Avisoを返す。
+
+        Args:
+            user_id: int
+            builder: {"count": int, "latest": list}を返す関数
+        Returns:
+            dict
+        """
+        key = AVISO_UNREAD_CACHE_KEY.format(user_id=user_id, version=self.getVersion(user_id))
+        summary = cache.get(key)
+        if summary is None:
+            summary = builder()
+            cache.set(key, summary, AVISO_UNREAD_TIMEOUT)
+        return summary
+
+    def invalidate(self, user_ids):
+        for user_id in set(user_ids):
+            key = AVISO_UNREAD_VERSION_CACHE_KEY.format(user_id=user_id)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, int(time.time() * 1000), None)
+
+
+# プロセス内で共有するインスタンス
+aviso_unread_cache = AvisoUnreadCache()
@@ -2,6 +2,7 @@ from django.urls import path
 from .views import AvisosAllListView
 from .views import AvisosListView
 from .views import AvisoCheckingView
+from .views import AvisoCheckAllView
 
 
 app_name = "avisos"
@@ -10,4 +11,5 @@ urlpatterns = [
     path('all/', AvisosAllListView.as_view(), name='avisos_alllist'),
     path('aviso/', AvisosListView.as_view(), name='avisos_list'),
     path('checking/<int:pk>', AvisoCheckingView.as_view(), name='aviso_check'),
+    path('checking/all/', AvisoCheckAllView.as_view(), name='aviso_check_all'),
 ]
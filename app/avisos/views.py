@@ -1,11 +1,9 @@
-from avisos.models import Aviso
+from avisos.models import Aviso, markAvisoChecked, markAvisosChecked, resolveAvisoItem
 from config.utils import paginate_queryset
 from config.constants import ContextKey, ViewName
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.views.generic import View
-from direct_messages.models import DirectMessageContent
-from direct_messages.models import DirectMessage
-from items.models import Item
 from profiles.models import Profile
 
 
@@ -30,11 +28,11 @@ class AvisosAllListView(View):
         else:
 
             context = {}
-            aviso_objects = Aviso.objects.filter(aviso_user=Profile.objects.get(user=request.user)).order_by("-created_at")
-            aviso_count = Aviso.objects.filter(aviso_user=Profile.objects.get(user=request.user)).filter(checked=False).count()
+            profile_obj = Profile.objects.get(user=request.user)
+            aviso_objects = Aviso.objects.filter(aviso_user=profile_obj).select_related("content_type").order_by("-created_at")
             page_obj = paginate_queryset(request, aviso_objects)
             context[ContextKey.AVISO_OBJECTS] = page_obj.object_list
-            context["aviso_count"] = aviso_count
+            context["aviso_count"] = profile_obj.unread_aviso_count
             context[ContextKey.PAGE_OBJ] = page_obj
             context["type"] = "ALL"
             return render(request, 'avisos/avisos_prototype.html', context)
@@ -56,10 +54,11 @@ class AvisosListView(View):
             return redirect('profiles:profile_creating')
         else:
             context = {}
-            aviso_objects = Aviso.objects.filter(aviso_user=Profile.objects.get(user=request.user)).filter(checked=False).order_by("-created_at")
+            profile_obj = Profile.objects.get(user=request.user)
+            aviso_objects = Aviso.objects.filter(aviso_user=profile_obj).filter(checked=False).select_related("content_type").order_by("-created_at")
             page_obj = paginate_queryset(request, aviso_objects)
             context[ContextKey.AVISO_OBJECTS] = page_obj.object_list
-            context["aviso_count"] = aviso_objects.count()
+            context["aviso_count"] = profile_obj.unread_aviso_count
             context[ContextKey.PAGE_OBJ] = page_obj
             context["type"] = "FILTERED"
             return render(request, 'avisos/avisos_prototype.html', context)
@@ -72,39 +71,68 @@ class AvisoCheckingView(View):
         Aviso一覧ページからAvisoを選択すると関連する通知対象のオブジェクトページにリダイレクトする
 
         pkからavisoオブジェクトをgetで取り出す。
-        取り出したオブジェクトのcheckedをTrueに変更する。
+        取り出したオブジェクトのcheckedをTrueに変更する(未読数も1つ減らす)。
         objectに基づいて各avisoの詳細ページにリダイレクトをかける。
         """
         pk = self.kwargs["pk"]
-        aviso_obj = Aviso.objects.get(id=pk)
-        aviso_obj.checked = True
-        aviso_obj.save()
+        aviso_obj = Aviso.objects.select_related("content_type", "item").get(id=pk)
+        markAvisoChecked(aviso_obj)
 
         # aviso_objがなんのモデルを擁しているかを判定し、リダイレクトをかける
-        # print(aviso_obj.content_type.model)
+        # 記事はAviso.itemから取得するので、ItemContact等のManyToManyFieldを辿る必要はない
+        # (Aviso.itemが設定されていない古いAvisoのみresolveAvisoItem()で通知対象から辿る)
+        model = aviso_obj.content_type.model
 
         # ダイレクトメッセージページにリダイレクトする
-        if aviso_obj.content_type.model == "directmessagecontent":
+        if model == "directmessage":
+            return redirect(ViewName.DIRECT_MESSAGE_DETAIL, aviso_obj.object_id)
 
-            pk = aviso_obj.object_id
-            dmc_obj = DirectMessageContent.objects.get(id=pk)
-            dm_obj = DirectMessage.objects.get(direct_message_contents__id=dmc_obj.id)
-            return redirect(ViewName.DIRECT_MESSAGE_DETAIL, dm_obj.pk)
+        item_obj = resolveAvisoItem(aviso_obj)
+        if item_obj is None:
+            # 記事が削除された通知
+            return redirect(ViewName.AVISO_ALL)
 
         # ダイレクトメッセージページにリダイレクトする
-        elif aviso_obj.content_type.model == "directmessage":
-            pk = aviso_obj.object_id
-            dm_obj = DirectMessage.objects.get(id=pk)
-            return redirect(ViewName.DIRECT_MESSAGE_DETAIL, dm_obj.pk)
+        if model == "directmessagecontent" and item_obj.direct_message_id is not None:
+            return redirect(ViewName.DIRECT_MESSAGE_DETAIL, item_obj.direct_message_id)
 
         # 申請者を選ぶページにリダイレクトする
-        elif aviso_obj.content_type.model == "solicitud":
-            solicitud_obj_pk = aviso_obj.object_id
-            item_obj = Item.objects.get(solicitudes__id=solicitud_obj_pk)
+        elif model == "solicitud":
             return redirect(ViewName.SOLICITUD_LIST, item_obj.pk)
 
         # 詳細記事ページにリダイレクトする
-        elif aviso_obj.content_type.model == 'itemcontact':
-            item_contact_obj_pk = aviso_obj.object_id
-            item_obj = Item.objects.get(item_contacts__id=item_contact_obj_pk)
-            return redirect(ViewName.ITEM_DETAIL, item_obj.id)
+        return redirect(ViewName.ITEM_DETAIL, item_obj.id)
+
+
+class AvisoCheckAllView(View):
+
+    def post(self, request, *args, **kwargs):
+        """機能
+        未読のAvisoをまとめて既読にする(1回のUPDATE)。
+        POSTでcontent_type(通知対象のモデル名), item(記事のid)を指定した場合はそのAvisoのみ既読にする。
+
+        endpoint: /avisos/checking/all/
+        name: "avisos:aviso_check_all"
+
+        Ajaxの場合は{"aviso_count": 未読数, "checked_count": 既読にした数}を返し、それ以外はAviso一覧ページにリダイレクトする。
+        """
+        if request.user.is_anonymous is True:
+            return redirect(ViewName.ACCOUNT_LOGIN)
+
+        profile_obj = Profile.objects.filter(user=request.user).first()
+        if profile_obj is None:
+            return redirect('profiles:profile_creating')
+
+        content_type_model = request.POST.get("content_type") or None
+        item_id = request.POST.get("item") or None
+        try:
+            item_id = int(item_id) if item_id is not None else None
+            checked_count, aviso_count = markAvisosChecked(profile_obj, content_type_model, item_id)
+        except ValueError:
+            if request.is_ajax():
+                return JsonResponse({"result": "fail"}, status=400)
+            return redirect(ViewName.AVISO_ALL)
+
+        if request.is_ajax():
+            return JsonResponse({"aviso_count": aviso_count, "checked_count": checked_count})
+        return redirect(ViewName.AVISO_ALL)
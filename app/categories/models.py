@@ -31,6 +31,42 @@ CATEGORY_CHOICE = (
 
 """
 
+CATEGORY_GROUP_COSAS = 500
+CATEGORY_GROUP_HABITACION = 600
+CATEGORY_GROUP_TRABAJO = 700
+CATEGORY_GROUP_TIENDA = 800
+
+CATEGORY_GROUP_CHOICE = (
+    (CATEGORY_GROUP_COSAS, "Las Cosas"),
+    (CATEGORY_GROUP_HABITACION, "Habitacion"),
+    (CATEGORY_GROUP_TRABAJO, "Trabajo"),
+    (CATEGORY_GROUP_TIENDA, "Empresas y Servicios"),
+)
+
+# グループとカテゴリー番号の対応
+CATEGORY_GROUPS = {
+    CATEGORY_GROUP_COSAS: ("1", "2", "3"),
+    CATEGORY_GROUP_HABITACION: ("4", "5", "6", "7"),
+    CATEGORY_GROUP_TRABAJO: ("8", "9"),
+    CATEGORY_GROUP_TIENDA: ("10",),
+}
+
+
+def getCategoryGroup(number):
+    """機能
+    カテゴリー番号が属するグループ(500, 600, 700, 800)を返す。
+
+    Args:
+        number: str... Category.number
+    Returns:
+        int: どのグループにも属さない場合はNone
+    """
+    for group, numbers in CATEGORY_GROUPS.items():
+        if number in numbers:
+            return group
+    return None
+
+
 class Category(models.Model):
     number = models.CharField(max_length=30, choices=CATEGORY_CHOICE, unique=True)
 
@@ -0,0 +1,54 @@
+"""
+ASGI config for share_xela project.
+
+新しいAvisoとダイレクトメッセージをSSEで送るイベントストリーム(avisos/stream.py)のみを提供する。
+それ以外のページ、APIはこれまで通りgunicorn(config/wsgi.py)で提供し、nginxで/api/events/をこちらに振り分ける。
+
+    uvicorn config.asgi:application --host 0.0.0.0 --port 8001
+"""
+import os
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.dev_settings')
+django.setup()
+
+from avisos.stream import AvisoEventBroker, AvisoEventStreamApp, PostgresEventListener  # noqa: E402
+
+EVENT_STREAM_PATH = "/api/events/stream/"
+
+
+class EventStreamApplication(object):
+
+    """
+    lifespanでPostgresEventListenerを開始、停止し、EVENT_STREAM_PATHへのリクエストをAvisoEventStreamAppに渡す
+    """
+
+    def __init__(self):
+        self.broker = AvisoEventBroker()
+        self.listener = PostgresEventListener(self.broker)
+        self.stream_app = AvisoEventStreamApp(self.broker)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] == "http" and scope["path"] == EVENT_STREAM_PATH:
+            await self.stream_app(scope, receive, send)
+            return
+        if scope["type"] == "http":
+            await send({"type": "http.response.start", "status": 404, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.listener.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.listener.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = EventStreamApplication()
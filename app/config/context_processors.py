@@ -0,0 +1,12 @@
+from django.conf import settings
+
+
+def aviso_event_stream(request):
+    """機能
+    navbar.htmlで新しいAvisoを受け取るイベントストリームのURLをテンプレートに渡す。
+    settings.AVISO_EVENT_STREAM_URLが空の場合(nginxとconfig/asgi.pyを動かしていない開発環境)は接続しない。
+
+    Returns:
+        dict: {"aviso_event_stream_url": URL または ""}
+    """
+    return {"aviso_event_stream_url": getattr(settings, "AVISO_EVENT_STREAM_URL", "")}
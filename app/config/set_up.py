@@ -9,6 +9,7 @@ from prefecturas.load import (
     PrefecturaInstanceMaker, MunicipioInstanceMaker,
     DepartamentoInstanceMaker, RegionClassedInstanceMaker
 )
+from prefecturas.geometry_store import prepared_geometry_store
 from categories.models import CATEGORY_CHOICE, Category
 
 
@@ -36,6 +37,9 @@ def main():
     if RegionClassed.objects.all().count() == 0:
         RegionClassedInstanceMaker().departamentoRelatedMunicipio()
 
+    # prefecturasのデータを読み込み直したのでprepared geometryを破棄する
+    prepared_geometry_store.invalidate()
+
     # Categoryインスタンスの作成
     for ele in CATEGORY_CHOICE:
         value = ele[0]
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'rest_auth',
     'corsheaders',    
     'django.contrib.gis',
+    'django.contrib.postgres',
     'djgeojson',
     'phonenumber_field',
     'tempus_dominus',
@@ -99,6 +100,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'config.context_processors.aviso_event_stream',
             ],
         },
     },
@@ -283,6 +285,10 @@ REST_FRAMEWORK = {
         #'rest_framework.permissions.IsAuthenticated',
         #'rest_framework.permissions.AllowAny',
        ),
+    # throttle_scopeを指定したAPIViewの1ユーザーあたりの回数の上限
+    'DEFAULT_THROTTLE_RATES': {
+        'region_list': '30/minute',   # api/util/region/list/ (GetRegionDataByPointListAPIView)
+        },
     }
 
 
@@ -343,3 +349,34 @@ DEFAULT_FROM_EMAIL = 'no-reply <no-reply@sharexela.ga>'
 
 # FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880
 FILE_UPLOAD_MAX_MEMORY_SIZE = 9437184
+
+
+#####################################
+####       Avisoのアーカイブ        ####
+#####################################
+# python manage.py archive_avisos で既読かつ作成からAVISO_ARCHIVE_DAYS日を過ぎたAvisoを
+# ArchivedAvisoに移動する(avisos/archive.py 参照)。1回のトランザクションで移動する件数はAVISO_ARCHIVE_BATCH_SIZE件。
+
+AVISO_ARCHIVE_DAYS = int(os.environ.get("AVISO_ARCHIVE_DAYS", 90))
+AVISO_ARCHIVE_BATCH_SIZE = int(os.environ.get("AVISO_ARCHIVE_BATCH_SIZE", 1000))
+
+
+#####################################
+####    NotificationOutboxの削除    ####
+#####################################
+# 送信済み(sent)、送信を諦めた(dead)通知を削除するまでの日数(avisos/outbox.py purgeNotificationOutbox 参照)。
+# deadの通知は管理画面で原因を確認できるように長めに残す。
+
+NOTIFICATION_OUTBOX_SENT_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_OUTBOX_SENT_RETENTION_DAYS", 7))
+NOTIFICATION_OUTBOX_DEAD_RETENTION_DAYS = int(os.environ.get("NOTIFICATION_OUTBOX_DEAD_RETENTION_DAYS", 30))
+NOTIFICATION_OUTBOX_PURGE_BATCH_SIZE = int(os.environ.get("NOTIFICATION_OUTBOX_PURGE_BATCH_SIZE", 1000))
+
+
+#####################################
+####    Avisoのイベントストリーム     ####
+#####################################
+# webのnavbarが新しいAvisoを受け取るイベントストリーム(config/asgi.py)のURL。
+# nginxが/api/events/をuvicornに振り分ける環境(docker-compose.prod.yml)でのみ設定する。
+# 空の場合はnavbarからEventSourceで接続しない(未読数はページの表示時に更新される)。
+
+AVISO_EVENT_STREAM_URL = os.environ.get("AVISO_EVENT_STREAM_URL", "")
@@ -114,3 +114,7 @@ LOGGING = {
         },
     },
 }
+
+
+# nginx(docker-compose.prod.yml)が/api/events/をeventsサービス(config/asgi.py)に振り分ける
+AVISO_EVENT_STREAM_URL = os.environ.get("AVISO_EVENT_STREAM_URL", "/api/events/stream/")
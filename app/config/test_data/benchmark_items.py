@@ -0,0 +1,106 @@
+import random
+import time
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from categories.models import Category
+from config.settings.dev_settings import DEBUG
+from config.test_data.make_data import TestData
+from items.models import Item
+from prefecturas.list_data import DEPARTAMENTO_CHOICES
+
+
+"""
+python manage.py shell
+from config.test_data.benchmark_items import main
+
+main()                     # 記事が100万件に満たない場合は作成してから測定する
+main(item_count=200000, repeat=50)
+
+Item.Meta.indexesの部分インデックス(WHERE active)がある場合とない場合で
+記事一覧のクエリのEXPLAIN ANALYZEの結果と実行時間(p50, p99)を表示する。
+インデックスがない場合の測定はトランザクション内でDROP INDEXし、測定後にロールバックするので
+インデックスが削除されたままになることはない。ただし測定中はitems_itemがロックされるので開発環境でのみ実行する。
+"""
+
+# 測定対象のインデックス(items/models.py Item.Meta.indexes)
+BENCHMARK_INDEX_NAMES = [
+    "item_cat_created_act",
+    "item_adm1_cat_created_act",
+    "item_user_created_act",
+]
+PAGE_SIZE = 20
+
+
+def make_queries(category_obj, adm1, user_obj):
+    """
+    測定するクエリを返す。一覧画面のクエリと同じ条件(active=True, -created_at順)にしている。
+    """
+    return [
+        ("category", Item.objects.filter(category=category_obj, active=True).order_by("-created_at", "-id")[:PAGE_SIZE]),
+        ("adm1+category", Item.objects.filter(adm1=adm1, category=category_obj, active=True).order_by("-created_at", "-id")[:PAGE_SIZE]),
+        ("user", Item.objects.filter(user=user_obj, active=True).order_by("-created_at", "-id")[:PAGE_SIZE]),
+    ]
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[int(round(ratio * (len(values) - 1)))]
+
+
+def measure(queries, repeat):
+    """
+    Returns:
+        [(クエリ名, EXPLAIN ANALYZEの結果, p50(ms), p99(ms)), ...]
+    """
+    results = []
+    for name, queryset in queries:
+        plan = queryset.explain(analyze=True, buffers=True)
+        latencies = []
+        for num in range(repeat):
+            start = time.perf_counter()
+            list(queryset.all())
+            latencies.append((time.perf_counter() - start) * 1000)
+        results.append((name, plan, percentile(latencies, 0.5), percentile(latencies, 0.99)))
+    return results
+
+
+def report(title, results):
+    print("=" * 80)
+    print(title)
+    for name, plan, p50, p99 in results:
+        print("-" * 80)
+        print("{} : p50 {:.2f}ms / p99 {:.2f}ms".format(name, p50, p99))
+        print(plan)
+
+
+def main(item_count=1000000, repeat=200):
+    if DEBUG is not True:
+        return
+    print("記事一覧のクエリの性能を測定するスクリプトを実行")
+
+    existing = Item.objects.count()
+    if existing < item_count:
+        TestData().make_bulk_items(count=item_count - existing)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE {}".format(Item._meta.db_table))
+
+    # インデックスの有無で同じ条件のクエリを比較する
+    queries = make_queries(
+        random.choice(list(Category.objects.all())),
+        random.choice(DEPARTAMENTO_CHOICES)[0],
+        User.objects.filter(username__startswith="bench_").order_by("?").first())
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for index_name in BENCHMARK_INDEX_NAMES:
+                cursor.execute("DROP INDEX IF EXISTS {}".format(connection.ops.quote_name(index_name)))
+        before = measure(queries, repeat)
+        transaction.set_rollback(True)
+
+    after = measure(queries, repeat)
+    report("インデックスなし", before)
+    report("インデックスあり", after)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 from items.models import Item
 from config.settings.dev_settings import DEBUG
+import datetime
 import random
+from django.utils import timezone
+from categories.models import getCategoryGroup
+from prefecturas.list_data import DEPARTAMENTO_CHOICES
 from django.contrib.auth.models import User
 # from items.models import Item
 from categories.models import Category
@@ -229,6 +233,39 @@ class TestData(object):
                 adm2=profile_obj.adm2
                 )
 
+    def make_bulk_items(self, count=1000000, batch_size=10000, user_count=1000):
+        """
+        性能測定(config/test_data/benchmark_items.py)のために大量の記事をbulk_createで作成する。
+        bulk_createではItem.save()とシグナルが実行されないので、category_groupはここで設定する。
+        created_atは過去2年間に分散させ、1割の記事は非公開(active=False)とする。
+        """
+        for num in range(User.objects.filter(username__startswith="bench_").count(), user_count):
+            User.objects.create(username="bench_{}".format(num), email="bench_{}@zzzmail.com".format(num), password="12345")
+        user_ids = list(User.objects.filter(username__startswith="bench_").values_list("id", flat=True))
+        categories = list(Category.objects.all())
+        adm1_list = [adm1 for adm1, label in DEPARTAMENTO_CHOICES]
+        now = timezone.now()
+
+        created = 0
+        while created < count:
+            items = []
+            for num in range(min(batch_size, count - created)):
+                category_obj = random.choice(categories)
+                items.append(Item(
+                    user_id=random.choice(user_ids),
+                    category=category_obj,
+                    category_group=getCategoryGroup(category_obj.number),
+                    title=random.choice(title_cosa_list),
+                    description="benchmark",
+                    adm0="GUATEMALA",
+                    adm1=random.choice(adm1_list),
+                    created_at=now - datetime.timedelta(seconds=random.randint(0, 60 * 60 * 24 * 730)),
+                    active=random.random() >= 0.1,
+                    ))
+            Item.objects.bulk_create(items, batch_size=batch_size)
+            created += len(items)
+            print("{}件の記事を作成しました".format(created))
+
 
 def main():
     if DEBUG is True:
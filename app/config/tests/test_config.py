@@ -1,5 +1,6 @@
 from django.test import TestCase
 from django.test import Client
+from django.test import override_settings
 from django.urls import reverse, reverse_lazy
 from config.constants import ViewName
 from config.constants import TemplateName
@@ -10,7 +11,12 @@ from django.contrib.auth.models import User
 from profiles.models import Profile
 from solicitudes.models import Solicitud
 from solicitudes.forms import SolicitudModelForm
+from prefecturas.load import DepartamentoInstanceMaker, MunicipioInstanceMaker
+from prefecturas.geometry_store import prepared_geometry_store
+from config.utils import is_in_Guatemala
+import os
 import random
+from unittest import mock
 from config.tests.utils import *
 
 
@@ -117,3 +123,67 @@ class HowtoViewGETTest(TestCase):
         response = self.client.get(reverse_lazy(ViewName.HOWTO), follow=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(TemplateName.HOWTO in get_templates_by_response(response))  # *3
+
+
+class NavbarAvisoEventStreamTest(TestCase):
+    """テスト対象
+    config/context_processors.py aviso_event_stream
+    config/templates/config/include/navbar.html
+    """
+    """テスト項目
+    AVISO_EVENT_STREAM_URLが空の場合はnavbarからイベントストリームに接続しない
+    AVISO_EVENT_STREAM_URLが設定されている場合は認証ユーザーのnavbarがそのURLに接続する
+    """
+
+    def setUp(self):
+        self.user_obj, self.profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="test1"))
+        self.client = Client()
+        self.assertTrue(self.client.login(username="test1", password='1234tweet'))
+
+    @override_settings(AVISO_EVENT_STREAM_URL="")
+    def test_AVISO_EVENT_STREAM_URLが空の場合はEventSourceで接続しない(self):
+        response = self.client.get(reverse_lazy(ViewName.HOWTO), follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "EventSource(")
+
+    @override_settings(AVISO_EVENT_STREAM_URL="/api/events/stream/")
+    def test_AVISO_EVENT_STREAM_URLが設定されている場合はそのURLに接続する(self):
+        response = self.client.get(reverse_lazy(ViewName.HOWTO), follow=True)
+        self.assertContains(response, 'new EventSource("/api/events/stream/")')
+
+
+class IsInGuatemalaTest(TestCase):
+    """テスト対象
+    config/utils.py is_in_Guatemala
+    """
+    """テスト項目
+    pointがGuatemala国内の場合はTrueを返す
+    pointがGuatemala国外の場合はFalseを返す
+    2回目以降の判定ではDepartamentoのポリゴンをDBから読み込まない
+    LAUNCH_ENVがDOCKERの場合は緯度と経度を入れ替えて判定する
+    """
+
+    def setUp(self):
+        DepartamentoInstanceMaker().run()
+        MunicipioInstanceMaker().run()
+        prepared_geometry_store.invalidate()
+        # テストのポリゴンは緯度と経度を入れ替えずに読み込まれる(CIRCLECIと同じ)ので、実行環境のLAUNCH_ENVに依存しないように固定する
+        patcher = mock.patch.dict(os.environ, {"LAUNCH_ENV": "CIRCLECI"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pointがGuatemala国内の場合はTrueを返す(self):
+        self.assertTrue(is_in_Guatemala("SRID=4326;POINT (-91.51643849909306 14.84320911634316)"))
+
+    def test_pointがGuatemala国外の場合はFalseを返す(self):
+        self.assertFalse(is_in_Guatemala("SRID=4326;POINT (-92.3129813 14.9114382)"))
+
+    def test_2回目以降の判定ではDBに問い合わせない(self):
+        is_in_Guatemala("SRID=4326;POINT (-91.51643849909306 14.84320911634316)")
+        with self.assertNumQueries(0):
+            self.assertTrue(is_in_Guatemala("SRID=4326;POINT (-91.51643849909306 14.84320911634316)"))
+
+    def test_LAUNCH_ENVがDOCKERの場合は緯度と経度を入れ替えて判定する(self):
+        with mock.patch.dict(os.environ, {"LAUNCH_ENV": "DOCKER"}):
+            self.assertTrue(is_in_Guatemala("SRID=4326;POINT (14.84320911634316 -91.51643849909306)"))
+            self.assertFalse(is_in_Guatemala("SRID=4326;POINT (-91.51643849909306 14.84320911634316)"))
@@ -420,3 +420,29 @@ def create_item_for_android_test(key, data):
 
     item_obj = Item.objects.get(title=dictItem_data["title"])
     return item_obj
+
+
+class FakeNotificationSink(object):
+    """機能
+    avisos.outbox.NotificationOutboxWorkerに渡す偽のsink。FCMやSMTPに接続せずに送信内容を記録する。
+
+    Args:
+        fail_count: int ...最初のfail_count回の送信で例外を送出する
+        error: 送出する例外(Noneの場合はConnectionError)
+
+    コピペ
+        fake_fcm_sink, fake_mail_sink = FakeNotificationSink(), FakeNotificationSink()
+        worker = NotificationOutboxWorker(sinks={"fcm": fake_fcm_sink, "email": fake_mail_sink})
+    """
+
+    def __init__(self, fail_count=0, error=None):
+        self.fail_count = fail_count
+        self.error = error
+        self.sent = []
+        self.calls = 0
+
+    def send(self, outbox_obj):
+        self.calls += 1
+        if self.calls <= self.fail_count:
+            raise self.error if self.error is not None else ConnectionError("fake sink error")
+        self.sent.append((outbox_obj.recipient, outbox_obj.payload))
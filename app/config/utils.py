@@ -1,10 +1,11 @@
 import platform
 import os
 from avisos.models import Aviso
+from avisos.unread import aviso_unread_cache, AVISO_UNREAD_LATEST_COUNT
 from profiles.models import Profile
-from prefecturas.models import Departamento
+from prefecturas.geometry_store import prepared_geometry_store
+from prefecturas.resolver import wktToStoredPoint
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.contrib.gis.geos import GEOSGeometry
 
 
 ################################################
@@ -48,18 +49,33 @@ def paginate_queryset(request, queryset, count=12):
 ########################################################
 
 
+def get_aviso_unread_summary(user_obj):
+    """
+    未読のAvisoの数(Profile.unread_aviso_count)と最新の未読Avisoを取得する。
+    Profileがない場合はNoneを返す。
+    """
+    profile_obj = Profile.objects.filter(user=user_obj).only("id", "unread_aviso_count").first()
+    if profile_obj is None:
+        return None
+    latest = list(
+        Aviso.objects.filter(aviso_user=profile_obj, checked=False).select_related(
+            "content_type").order_by("-created_at")[:AVISO_UNREAD_LATEST_COUNT])
+    return {"count": profile_obj.unread_aviso_count, "latest": latest}
+
+
 def add_aviso_objects(request, context):
     """
     navbarに表示させるavisoオブジェクトをcontextに追加する
+    未読数と最新の未読Avisoはキャッシュから取得するので、通常はDBへのクエリは発行されない(avisos/unread.py 参照)
 
     """
     if request.user.is_anonymous == True:
         return context
-    elif Profile.objects.filter(user=request.user).exists() == False :
+    summary = aviso_unread_cache.getSummary(request.user.id, lambda: get_aviso_unread_summary(request.user))
+    if summary is None:
         return context
-    aviso_objects = Aviso.objects.filter(aviso_user=Profile.objects.get(user=request.user)).filter(checked=False)
-    context["aviso_objects"] = aviso_objects
-    context["aviso_count"] = aviso_objects.count()
+    context["aviso_objects"] = summary["latest"]
+    context["aviso_count"] = summary["count"]
     return context
 
 
@@ -83,21 +99,9 @@ def wkt2point(wkt):
     原因が分からないが、環境をDockerを使う場合と使わない場合でwktの値が変わってしまう現象が見られた。
     したがってDockerとそれ以外でpointオブジェクトを生成する方法を変える仕組みに変更する
     またデータオブジェクトを生成するときはこのpoint値を使ってはいけない現象も確認された。。。
+    LAUNCH_ENVごとの軸の扱いはprefecturas.resolver.wktToStoredPoint()にまとめている(CIRCLECIでは入れ替えない)。
     """
-    launch_env = os.environ.get("LAUNCH_ENV", default="NO_DOCKER")
-    print(launch_env)
-    if launch_env == "DOCKER":
-        lng = wkt.split(" ")[1].replace("(", "")
-        lat = wkt.split(" ")[2].replace(")", "")
-        text = "POINT(" + lat + " " + lng + ")"
-        point = GEOSGeometry(text)
-    elif launch_env == "NO_DOCKER":
-        # point  = GEOSGeometry(wkt)
-        lng = wkt.split(" ")[1].replace("(", "")
-        lat = wkt.split(" ")[2].replace(")", "")
-        text = "POINT(" + lat + " " + lng + ")"
-        point = GEOSGeometry(text)
-    return point
+    return wktToStoredPoint(wkt)
 
 
 
@@ -113,18 +117,12 @@ def is_in_Guatemala(wkt):
     """機能
     戻り値がTrueの場合pointが示すデータはguatemala内に存在するデータであり、
     Falseの場合は存在しないデータである。
+
+    判定にはプロセス内に保持したprepared geometry(全Departamentoを結合した国境)を使うので
+    呼び出す度にDepartamentoのポリゴンをDBから読み込むことはない。
     """
     point = wkt2point(wkt)
-    # pointが各departamentoに含まれているかチェックする/含まれればresultをTrueに変更する
-    # print("そもそもココ通る？？")
-    dep_objects = Departamento.objects.all()
-    for dep in dep_objects:
-        # print("within調査")
-        # print(dep.geom.contains(point))
-        if dep.geom.contains(point):
-            return True
-
-    return False
+    return prepared_geometry_store.isInGuatemala(point)
 
 
 ################################################
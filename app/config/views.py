@@ -3,7 +3,7 @@ from django.views.generic import View
 from categories.models import Category
 from profiles.models import Profile
 from items.models import Item
-from django.db.models import Q
+from items.home_feed import home_feed_cache
 from .forms import UsernameChangeForm, EmailAddressChangeForm
 from django.contrib.auth.models import User
 from allauth.account.models import EmailAddress
@@ -28,17 +28,17 @@ class HomeKaizenView(View):
         name: 'home'
         """
 
-        item_objects_cosas = Item.objects.filter(Q(category__number="1")|Q(category__number="2")|Q(category__number="3")).exclude(active=False).order_by("-created_at")[:4]
-        item_objects_habitacion = Item.objects.filter(Q(category__number="4")|Q(category__number="5")|Q(category__number="6")|Q(category__number="7")).exclude(active=False).order_by("-created_at")[:4]
-        item_objects_trabajo = Item.objects.filter(Q(category__number="8")|Q(category__number="9")).exclude(active=False).order_by("-created_at")[:4]
-        item_objects_tienda = Item.objects.filter(category__number="10").exclude(active=False).order_by("-created_at")[:4]        
+        # 記事一覧はキャッシュから取得する。キャッシュにない場合のみDBから取得する
+        buckets = home_feed_cache.getBuckets(
+            "web",
+            lambda category_group: list(Item.objects.filter(category_group=category_group, active=True).select_related("category").order_by("-created_at")[:4]))
 
         # データの格納
         context = {}
-        context[SerializerContextKey.ITEM_OBJECTS_COSAS] = item_objects_cosas
-        context[SerializerContextKey.ITEM_OBJECTS_HABITACION] = item_objects_habitacion
-        context[SerializerContextKey.ITEM_OBJECTS_TRABAJO] = item_objects_trabajo
-        context[SerializerContextKey.ITEM_OBJECTS_TIENDA] = item_objects_tienda
+        context[SerializerContextKey.ITEM_OBJECTS_COSAS] = buckets["cosas"]
+        context[SerializerContextKey.ITEM_OBJECTS_HABITACION] = buckets["habitacion"]
+        context[SerializerContextKey.ITEM_OBJECTS_TRABAJO] = buckets["trabajo"]
+        context[SerializerContextKey.ITEM_OBJECTS_TIENDA] = buckets["tienda"]
 
         # avisoオブジェクトデータの格納        
         context = add_aviso_objects(request, context)
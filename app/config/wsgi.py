@@ -12,3 +12,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.dev_settings')
 
 application = get_wsgi_application()
+
+# DBが利用できない時の地域判定(prefecturas/resolver.py)とis_in_Guatemalaで使うポリゴンを
+# 最初のリクエストを待たずに別のスレッドで読み込んでおく(gunicornのworkerごとに1回)
+from prefecturas.geometry_store import prepared_geometry_store  # noqa: E402
+
+prepared_geometry_store.loadInBackground()
@@ -0,0 +1,176 @@
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from avisos.models import markAvisosChecked
+from items.models import Item
+from profiles.models import Profile
+from .models import DirectMessage, DirectMessageContent
+
+
+"""
+ユーザーのダイレクトメッセージの会話(DirectMessage)を最後のメッセージの新しい順に一覧するモジュール。
+
+1行には記事のタイトル、相手のProfile、最後のメッセージの抜粋と日時、未読数を含め、
+ページ全体を1つのSQL(最後のメッセージはLATERAL JOIN、未読数は相関サブクエリ)で取得する。
+並び順は(last_activity, id)の降順で、前のページの最後の行より古い行を取得するキーセットページネーションを行う。
+last_activityは最後のメッセージのcreated_at(メッセージがない場合はDirectMessageのcreated_at)である。
+
+未読数は自分のlast_read_message_id(DirectMessage.owner_last_read_message_id, participant_last_read_message_id)より
+新しい相手のメッセージの数で、中間テーブルの(directmessage_id, directmessagecontent_id)のユニークインデックスの範囲で数える。
+last_read_message_idはmarkDirectMessageRead()で進める。
+"""
+
+INBOX_SNIPPET_LENGTH = 100
+
+INBOX_SQL = """
+SELECT * FROM (
+    SELECT
+        dm.id AS id,
+        dm.created_at AS created_at,
+        item.id AS item_id,
+        item.title AS item_title,
+        other.id AS other_profile_id,
+        other_user.username AS other_username,
+        other.image AS other_image,
+        last_content.id AS last_message_id,
+        LEFT(last_content.content, %(snippet_length)s) AS last_message,
+        last_content.profile_id AS last_message_profile_id,
+        last_content.created_at AS last_message_at,
+        COALESCE(last_content.created_at, dm.created_at) AS last_activity,
+        (
+            SELECT COUNT(*) FROM {through} unread_through
+            INNER JOIN {content} unread_content ON unread_content.id = unread_through.directmessagecontent_id
+            WHERE unread_through.directmessage_id = dm.id
+                AND unread_through.directmessagecontent_id > (
+                    CASE WHEN dm.owner_id = %(profile_id)s
+                    THEN dm.owner_last_read_message_id ELSE dm.participant_last_read_message_id END)
+                AND unread_content.profile_id IS DISTINCT FROM %(profile_id)s
+        ) AS unread_count
+    FROM {direct_message} dm
+    LEFT JOIN {item} item ON item.direct_message_id = dm.id
+    LEFT JOIN {profile} other ON other.id = (
+        CASE WHEN dm.owner_id = %(profile_id)s THEN dm.participant_id ELSE dm.owner_id END)
+    LEFT JOIN {user} other_user ON other_user.id = other.user_id
+    LEFT JOIN LATERAL (
+        SELECT content.id, content.content, content.profile_id, content.created_at
+        FROM {through} through
+        INNER JOIN {content} content ON content.id = through.directmessagecontent_id
+        WHERE through.directmessage_id = dm.id
+        ORDER BY content.created_at DESC, content.id DESC
+        LIMIT 1
+    ) last_content ON TRUE
+    WHERE dm.owner_id = %(profile_id)s OR dm.participant_id = %(profile_id)s
+) inbox
+WHERE %(before_at)s::timestamptz IS NULL OR (inbox.last_activity, inbox.id) < (%(before_at)s, %(before_id)s)
+ORDER BY inbox.last_activity DESC, inbox.id DESC
+LIMIT %(limit)s
+"""
+
+
+def getInboxSql():
+    quote_name = connection.ops.quote_name
+    return INBOX_SQL.format(
+        direct_message=quote_name(DirectMessage._meta.db_table),
+        item=quote_name(Item._meta.db_table),
+        profile=quote_name(Profile._meta.db_table),
+        user=quote_name(User._meta.db_table),
+        through=quote_name(DirectMessage.direct_message_contents.through._meta.db_table),
+        content=quote_name(DirectMessageContent._meta.db_table),
+    )
+
+
+class DirectMessageInbox(object):
+
+    """ *使用方法*
+
+    from direct_messages.inbox import DirectMessageInbox
+
+    inbox = DirectMessageInbox(profile_obj)
+    rows, next_position = inbox.getPage(page_size=20)
+    rows, next_position = inbox.getPage(before=next_position, page_size=20)
+
+    rowsは辞書のリストで、キーはINBOX_SQLのSELECTの列名である。
+    next_positionは次のページを取得するための(last_activity, id)で、最後のページの場合はNoneである。
+    """
+
+    def __init__(self, profile_obj):
+        self.profile_obj = profile_obj
+
+    def getPage(self, before=None, page_size=20):
+        before_at, before_id = before if before is not None else (None, None)
+        params = {
+            "profile_id": self.profile_obj.id,
+            "snippet_length": INBOX_SNIPPET_LENGTH,
+            "before_at": before_at,
+            "before_id": before_id,
+            # 1件多く取得して次のページがあるか判定する
+            "limit": page_size + 1,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(getInboxSql(), params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        next_position = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_position = (rows[-1]["last_activity"], rows[-1]["id"])
+        return rows, next_position
+
+
+def getLastReadFieldName(dm_obj, profile_obj):
+    """
+    profile_objのlast_read_message_idのフィールド名を返す。会話の参加者でない場合はNone
+    """
+    if dm_obj.owner_id == profile_obj.id:
+        return "owner_last_read_message_id"
+    if dm_obj.participant_id == profile_obj.id:
+        return "participant_last_read_message_id"
+    return None
+
+
+def getUnreadMessageCount(dm_obj, profile_obj, last_read_message_id):
+    """
+    last_read_message_idより新しい相手のメッセージの数を中間テーブルのインデックスの範囲で数える
+    """
+    return DirectMessage.direct_message_contents.through.objects.filter(
+        directmessage_id=dm_obj.id, directmessagecontent_id__gt=last_read_message_id).exclude(
+        directmessagecontent__profile_id=profile_obj.id).count()
+
+
+def markDirectMessageRead(dm_obj, profile_obj, message_id=None):
+    """機能
+    profile_objのlast_read_message_idをmessage_idまで進め、その会話のダイレクトメッセージのAvisoを既読にする。
+    last_read_message_idは大きくなる方向にのみ更新する(古いmessage_idを指定しても戻らない)。
+
+    Args:
+        dm_obj: DirectMessageオブジェクト
+        profile_obj: owner または participantのProfileオブジェクト
+        message_id: 読んだメッセージのid。指定しない場合は会話の最新のメッセージ
+    Returns:
+        (int, int): 更新後のlast_read_message_id, 未読数
+    Raises:
+        ValueError: profile_objが会話の参加者でない場合、message_idが会話のメッセージでない場合
+    """
+    field_name = getLastReadFieldName(dm_obj, profile_obj)
+    if field_name is None:
+        raise ValueError("profile is not a participant of the direct message")
+
+    through_objects = DirectMessage.direct_message_contents.through.objects.filter(directmessage_id=dm_obj.id)
+    if message_id is None:
+        latest = through_objects.order_by("-directmessagecontent_id").values_list(
+            "directmessagecontent_id", flat=True).first()
+        message_id = latest or 0
+    elif not through_objects.filter(directmessagecontent_id=message_id).exists():
+        raise ValueError("message does not belong to the direct message")
+
+    with transaction.atomic():
+        DirectMessage.objects.filter(id=dm_obj.id).update(**{field_name: Greatest(F(field_name), message_id)})
+        last_read_message_id = DirectMessage.objects.filter(id=dm_obj.id).values_list(field_name, flat=True).get()
+        unread_count = getUnreadMessageCount(dm_obj, profile_obj, last_read_message_id)
+        item_id = Item.objects.filter(direct_message_id=dm_obj.id).values_list("id", flat=True).first()
+        if item_id is not None and unread_count == 0:
+            markAvisosChecked(profile_obj, "directmessagecontent", item_id)
+    setattr(dm_obj, field_name, last_read_message_id)
+    return last_read_message_id, unread_count
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db.models import IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from direct_messages.models import DirectMessage
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py backfill_direct_message_last_read
+
+    DirectMessage.owner_last_read_message_id, participant_last_read_message_idを追加する前に作成された会話の
+    既存のメッセージを既読にする(会話の最新のメッセージのidを設定する)。
+    どちらも0(未設定)の会話のみを1回のUPDATEで設定するので、何度実行しても既に読まれた位置は変わらない。
+    """
+
+    help = "既存の会話のlast_read_message_idを最新のメッセージのidに設定する"
+
+    def handle(self, *args, **options):
+        through_model = DirectMessage.direct_message_contents.through
+        latest_ids = through_model.objects.filter(directmessage_id=OuterRef("pk")).order_by().values(
+            "directmessage_id").annotate(latest_id=Max("directmessagecontent_id")).values("latest_id")
+        latest_id = Coalesce(Subquery(latest_ids, output_field=IntegerField()), Value(0))
+        updated = DirectMessage.objects.filter(
+            owner_last_read_message_id=0, participant_last_read_message_id=0).update(
+            owner_last_read_message_id=latest_id, participant_last_read_message_id=latest_id)
+        self.stdout.write("{}件の会話を既読にしました".format(updated))
@@ -12,6 +12,13 @@ class DirectMessageContent(models.Model):
 	profile    = models.ForeignKey(Profile, on_delete=models.PROTECT, null=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 
+	class Meta:
+		indexes = [
+			# 会話の差分同期(api/querysets.py getDirectMessageContentsSince)でcreated_atより後のメッセージを取得するためのインデックス
+			# 中間テーブルは(directmessage_id, directmessagecontent_id)のユニークインデックスを使う
+			models.Index(fields=["created_at", "id"], name="dm_content_created_id"),
+		]
+
 	def __str__(self):
 		return self.content
 
@@ -25,6 +32,10 @@ class DirectMessage(models.Model):
 	is_feedbacked_by_owner       = models.BooleanField(default=False)
 	is_feedbacked_by_participant = models.BooleanField(default=False)
 	created_at                   = models.DateTimeField(auto_now_add=True)
+	# owner, participantがそれぞれ最後に読んだDirectMessageContentのid(0は未読)。
+	# 未読数はこれより大きいidの相手のメッセージの数で、中間テーブルのインデックスの範囲で数える(direct_messages/inbox.py 参照)
+	owner_last_read_message_id       = models.PositiveIntegerField(default=0)
+	participant_last_read_message_id = models.PositiveIntegerField(default=0)
 
 
 	def __str__(self):
@@ -603,3 +603,48 @@ class DirectMessageDetailViewPOSTTest(TestCase):
 
 
 
+
+
+
+
+class GetDirectMessageByUserListViewTest(TestCase):
+
+    """テスト対象
+    direct_messages/views.py GetDirectMessageByUserListView#get
+    endpoint: direct_messages/list/
+    name: 'direct_messages:dm_list'
+    """
+
+    """テスト項目
+    未認証ユーザーによるアクセスはloginにredirectする
+    owner, participantのどちらの場合も自分の会話が記事のタイトルと最後のメッセージとともに表示される
+    """
+
+    def setUp(self):
+        category_obj = Category.objects.create(number="Donar o vender")
+        self.post_user = User.objects.create_user(username="post_user", email="test_post_user@gmail.com", password="12345")
+        self.participant = User.objects.create_user(username="participant", email="test_participant@gmail.com", password="12345")
+        self.item_obj = Item.objects.create(
+            user=self.post_user, title="テストアイテム", description="説明です。",
+            category=category_obj, adm0="huh", adm1="cmks", adm2="dks")
+        self.dm_obj = DirectMessage.objects.create(
+            owner=Profile.objects.get(user=self.post_user), participant=Profile.objects.get(user=self.participant))
+        self.item_obj.direct_message = self.dm_obj
+        self.item_obj.save()
+        dm_content_obj = DirectMessageContent.objects.create(content="hola", profile=Profile.objects.get(user=self.participant))
+        self.dm_obj.direct_message_contents.add(dm_content_obj)
+
+    def test_should_redirect_ACCOUNT_LOGIN_for_anonymous_user(self):
+        response = self.client.get(reverse_lazy("direct_messages:dm_list"))
+        self.assertRedirects(response, reverse(ViewName.ACCOUNT_LOGIN), fetch_redirect_response=False)
+
+    def test_should_show_dm_rows_for_owner_and_participant(self):
+        for username in ("post_user", "participant"):
+            self.client = Client()
+            self.assertTrue(self.client.login(username=username, password="12345"))
+            response = self.client.get(reverse_lazy("direct_messages:dm_list"))
+            rows = response.context["dm_rows"]
+            self.assertEqual([row["id"] for row in rows], [self.dm_obj.id])
+            self.assertEqual(rows[0]["item_title"], "テストアイテム")
+            self.assertEqual(rows[0]["last_message"], "hola")
+            self.assertContains(response, reverse("direct_messages:dm_detail", args=(self.dm_obj.id,)))
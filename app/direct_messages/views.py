@@ -7,6 +7,10 @@ from items.models import Item
 from .models import DirectMessage
 from .models import DirectMessageContent
 from .forms import DirectMessageContentModelForm
+from .inbox import DirectMessageInbox, markDirectMessageRead
+from api.pagination import DirectMessageInboxPagination
+from django.http import Http404
+from rest_framework.exceptions import NotFound
 
 
 from config.constants import ViewName
@@ -47,6 +51,8 @@ class DirectMessageDetailView(View):
 		if dm_obj.owner != access_user_profile_obj and dm_obj.participant != access_user_profile_obj:
 			return redirect(ViewName.HOME)
 
+		# 表示したメッセージまで既読にする
+		markDirectMessageRead(dm_obj, access_user_profile_obj)
 
 
 		context = {}
@@ -117,19 +123,32 @@ class DirectMessageDetailView(View):
 
 class GetDirectMessageByUserListView(View):
 
-	def get(self, request, *args, **kwargs):		
-		#request.userをキーにDirectMessageオブジェクトを取り出し表示する
-		context = {}
+	def get(self, request, *args, **kwargs):
+		"""機能
+		ユーザーの会話(DirectMessage)を最後のメッセージの新しい順に表示する(direct_messages/inbox.py 参照)
+
+	    endpoint: direct_messages/list/?cursor=...
+	    name: 'direct_messages:dm_list'
+		"""
+		if request.user.is_anonymous:
+			return redirect(ViewName.ACCOUNT_LOGIN)
 
-		post_user_dm_queryset = DirectMessage.objects.filter(post_user=request.user)
-		solicitud_user_dm_queryset = DirectMessage.objects.filter(solicitud_user=request.user)
-		dm_qs = DirectMessage.objects.none()
-		dm_qs = dm_qs.union(post_user_dm_queryset, solicitud_user_dm_queryset)
-		context["dm_qs"] = dm_qs
+		profile_obj = Profile.objects.filter(user=request.user).first()
+		if profile_obj is None:
+			return redirect('profiles:profile_creating')
+
+		try:
+			rows, next_cursor = DirectMessageInboxPagination(request).paginateInbox(DirectMessageInbox(profile_obj))
+		except NotFound:
+			raise Http404("Invalid cursor")
+
+		context = {}
+		context["dm_rows"] = rows
+		context["next_cursor"] = next_cursor
 		context["type"] = "messages"
-		#return render(request, "direct_messages/dm_list.html", context)
-		return render(request, "avisos/avisos_list.html" ,context)
-		
+		context = add_aviso_objects(request, context)
+		return render(request, "direct_messages/dm_list.html", context)
+
 
 
 
@@ -17,6 +17,9 @@ from favorite.models        import Favorite
 from profiles.models        import Profile
 from solicitudes.models     import Solicitud
 import django
+from io import StringIO
+from django.core.management import call_command
+from api.serializers import ProfileSummarySerializer
 
 
 
@@ -358,4 +361,82 @@ class FeedbackViewTest(TestCase):
         # 記事主のProfile_feedbackにFeedbackオブジェクトが追加されるかチェックする
         new_count = Profile.objects.get(user=post_user_obj).feedback.all().count()
         self.assertEqual(new_count, feedback_count+1)
-       
\ No newline at end of file
+       
+
+
+class ProfileRatingTest(TestCase):
+
+    """テスト対象
+    feedback.views.py FeedbackView (feedback:feedback)
+    profiles/models.py addProfileFeedback, rebuildProfileRating
+    profiles/management/commands/rebuild_profile_rating.py
+    api/serializers.py ProfileSummarySerializer
+    """
+
+    """テスト項目
+    済 フィードバックを入力すると取引相手のProfile.rating_count, rating_sum, rating_averageが更新される
+    済 取得後に評価されてもProfileのsave()で評価の集計を上書きしない
+    済 rebuild_profile_ratingでfeedbackから再計算される
+    済 ProfileSummarySerializerはfeedbackの一覧を出力せず評価の集計を出力する
+    """
+
+    def setUp(self):
+        category_obj = pickUp_category_obj_for_test()
+        self.post_user_obj, self.post_user_profile_obj = create_user_for_test(
+            create_user_data(prefix_user_emailaddress="post_user"))
+        item_obj = create_item_for_test(self.post_user_obj, create_item_data(category_obj))
+        self.participant_obj, self.participant_profile_obj = create_user_for_test(
+            create_user_data(prefix_user_emailaddress="participant"))
+        solicitud_obj = create_solicitud_for_test(item_obj, self.participant_obj, create_solicitud_data(message=None))
+        self.dm_obj, _ = create_direct_message_for_test(solicitud_obj)
+
+    def postFeedback(self, user_obj, level):
+        client = Client()
+        client.login(username=user_obj.username, password="1234tweet")
+        session = client.session
+        session['dm_obj_pk'] = self.dm_obj.id
+        session.save()
+        client.post(reverse_lazy(ViewName.FEEDBACK_POST), {"content": "良かった", "level": level})
+
+    def test_フィードバックを入力すると取引相手の評価の集計が更新される(self):
+        self.postFeedback(self.participant_obj, 5)
+        self.postFeedback(self.participant_obj, 2)
+        profile_obj = Profile.objects.get(id=self.post_user_profile_obj.id)
+        self.assertEqual(profile_obj.rating_count, 2)
+        self.assertEqual(profile_obj.rating_sum, 7)
+        self.assertAlmostEqual(profile_obj.rating_average, 3.5)
+
+        self.postFeedback(self.post_user_obj, 4)
+        profile_obj = Profile.objects.get(id=self.participant_profile_obj.id)
+        self.assertEqual((profile_obj.rating_count, profile_obj.rating_sum), (1, 4))
+
+    def test_取得後に評価されてもProfileのsaveで評価の集計を上書きしない(self):
+        profile_obj = Profile.objects.get(id=self.post_user_profile_obj.id)
+        self.postFeedback(self.participant_obj, 5)
+
+        profile_obj.description = "編集した説明"
+        profile_obj.save()
+
+        profile_obj = Profile.objects.get(id=self.post_user_profile_obj.id)
+        self.assertEqual(profile_obj.description, "編集した説明")
+        self.assertEqual((profile_obj.rating_count, profile_obj.rating_sum), (1, 5))
+        self.assertAlmostEqual(profile_obj.rating_average, 5.0)
+
+    def test_rebuild_profile_ratingでfeedbackから再計算される(self):
+        self.post_user_profile_obj.feedback.add(
+            Feedback.objects.create(evaluator=self.participant_obj, content="bien", level=3),
+            Feedback.objects.create(evaluator=self.participant_obj, content="bien", level=4))
+        call_command("rebuild_profile_rating", stdout=StringIO())
+
+        profile_obj = Profile.objects.get(id=self.post_user_profile_obj.id)
+        self.assertEqual((profile_obj.rating_count, profile_obj.rating_sum), (2, 7))
+        self.assertAlmostEqual(profile_obj.rating_average, 3.5)
+        profile_obj = Profile.objects.get(id=self.participant_profile_obj.id)
+        self.assertEqual((profile_obj.rating_count, profile_obj.rating_sum, profile_obj.rating_average), (0, 0, None))
+
+    def test_ProfileSummarySerializerはfeedbackの一覧を出力しない(self):
+        self.postFeedback(self.participant_obj, 5)
+        data = ProfileSummarySerializer(Profile.objects.get(id=self.post_user_profile_obj.id)).data
+        self.assertNotIn("feedback", data)
+        self.assertEqual(data["username"], self.post_user_obj.username)
+        self.assertEqual((data["rating_count"], data["rating_sum"], data["rating_average"]), (1, 5, 5.0))
@@ -5,8 +5,10 @@ from django.views.generic import View
 from feedback.forms import FeedbackModelForm
 
 from django.contrib.auth.models import User
+from django.db import transaction
 from direct_messages.models     import DirectMessage
 from items.models import Item
+from profiles.models import addProfileFeedback
 
 from config.constants import ViewName
 
@@ -68,6 +70,7 @@ class FeedbackView(View):
         DirectMessage.is_feedbacked_by_ownerの変更
         Feedbackオブジェクトの生成
         Profile.feedbackにFeedbackオブジェクトの追加
+        Profile.rating_count, rating_sum, rating_averageの更新
         
         endpoint: 'feedback/feedback/'
         name: 'feedback:feedback'
@@ -108,22 +111,25 @@ class FeedbackView(View):
             feedback_obj = form.save(commit=False)
             feedback_obj.evaluator = User.objects.get(username=request.user.username)
             feedback_obj.level = level
-            feedback_obj.save()
-
-            #取引相手のProfileオブジェクトのfeedbackに生成したfeedbackを追加する
-            #取引相手を特定する
-            if request.user.username == dm_obj.owner.user.username :
-                dm_obj.participant.feedback.add(feedback_obj)
-                dm_obj.is_feedbacked_by_owner = True
-                dm_obj.save()
-
-            elif request.user.username == dm_obj.participant.user.username :
-                dm_obj.owner.feedback.add(feedback_obj)
-                dm_obj.is_feedbacked_by_participant = True
-                dm_obj.save()
-
-            else:
-                print("想定外のパターンを検出")
+
+            # Feedbackの生成とProfileの評価の集計(rating_count, rating_sum, rating_average)を同じトランザクションで行う
+            with transaction.atomic():
+                feedback_obj.save()
+
+                #取引相手のProfileオブジェクトのfeedbackに生成したfeedbackを追加する
+                #取引相手を特定する
+                if request.user.username == dm_obj.owner.user.username :
+                    addProfileFeedback(dm_obj.participant, feedback_obj)
+                    dm_obj.is_feedbacked_by_owner = True
+                    dm_obj.save()
+
+                elif request.user.username == dm_obj.participant.user.username :
+                    addProfileFeedback(dm_obj.owner, feedback_obj)
+                    dm_obj.is_feedbacked_by_participant = True
+                    dm_obj.save()
+
+                else:
+                    print("想定外のパターンを検出")
             return redirect("items:item_detail", item_obj.id)
 
         else:
@@ -0,0 +1,98 @@
+import time
+from django.core.cache import cache
+from categories.models import (
+    CATEGORY_GROUP_COSAS,
+    CATEGORY_GROUP_HABITACION,
+    CATEGORY_GROUP_TRABAJO,
+    CATEGORY_GROUP_TIENDA,
+)
+
+
+"""
+ホーム画面(config/views.HomeKaizenView, api ItemHomeListAPIView)に表示する
+4つのカテゴリーグループの記事一覧をCACHES['default']に保存するためのモジュール。
+
+キャッシュのキーにはバージョン番号を含めている。記事が作成、編集、削除された場合は
+items/models.pyのシグナルからトランザクションのコミット後にinvalidate()が呼ばれ、バージョン番号が1つ進む。
+コミット前のデータで作成された一覧は古いバージョンのキーに保存されるので、以降のリクエストで使われることはない。
+"""
+
+HOME_FEED_VERSION_CACHE_KEY = "items:home_feed:version"
+HOME_FEED_CACHE_KEY = "items:home_feed:{version}:{variant}:{group}"
+HOME_FEED_TIMEOUT = 60 * 60 * 24
+# ページ分割しない一覧(APIのsummary)をキャッシュに保存する記事数の上限
+HOME_FEED_MAX_CACHED_ITEMS = 200
+
+# ホーム画面に表示するグループ (categories/models.py 参照)
+HOME_FEED_GROUPS = (
+    ("cosas", CATEGORY_GROUP_COSAS),
+    ("habitacion", CATEGORY_GROUP_HABITACION),
+    ("trabajo", CATEGORY_GROUP_TRABAJO),
+    ("tienda", CATEGORY_GROUP_TIENDA),
+)
+
+
+class HomeFeedCache(object):
+
+    """ *使用方法*
+
+    from items.home_feed import home_feed_cache
+
+    buckets = home_feed_cache.getBuckets("web", lambda category_group: list(...))
+    buckets["cosas"], buckets["habitacion"], buckets["trabajo"], buckets["tienda"]
+
+    variantは同じグループを異なる形式で保存する場合に使い分ける(web画面用、APIのsummary用など)。
+    キャッシュにないグループのみbuilder(Item.category_groupの値)を呼び出して作成し、保存する。
+    """
+
+    def getVersion(self):
+        version = cache.get(HOME_FEED_VERSION_CACHE_KEY)
+        if version is None:
+            # バージョン番号がキャッシュから消えた場合に過去の番号を再利用しないよう時刻を使う
+            cache.add(HOME_FEED_VERSION_CACHE_KEY, int(time.time() * 1000), None)
+            version = cache.get(HOME_FEED_VERSION_CACHE_KEY)
+        return version
+
+    def makeKey(self, version, variant, group):
+        return HOME_FEED_CACHE_KEY.format(version=version, variant=variant, group=group)
+
+    def getBuckets(self, variant, builder, cacheable=None):
+        """機能
+        グループ名をキー、builderの返り値を値とする辞書を返す。
+
+        Args:
+            variant: str
+            builder: Item.category_groupの値を受け取り、キャッシュに保存する値(pickle可能なもの)を返す関数
+            cacheable: builderの返り値を受け取り、キャッシュに保存する場合はTrueを返す関数。
+                       memcachedの1項目の上限(1MB)を超える値はsetが失敗するので、大きすぎる値を保存しないために使う
+        Returns:
+            dict
+        """
+        version = self.getVersion()
+        keys = {group: self.makeKey(version, variant, group) for group, category_group in HOME_FEED_GROUPS}
+        cached = cache.get_many(list(keys.values()))
+
+        buckets = {}
+        for group, category_group in HOME_FEED_GROUPS:
+            key = keys[group]
+            if key in cached:
+                buckets[group] = cached[key]
+                continue
+            buckets[group] = builder(category_group)
+            if cacheable is None or cacheable(buckets[group]):
+                cache.set(key, buckets[group], HOME_FEED_TIMEOUT)
+        return buckets
+
+    def invalidate(self):
+        """
+        バージョン番号を進めて、保存されている全ての一覧を無効にする。
+        incrはmemcachedでは不可分な操作なので、同時に呼ばれても番号が戻ることはない。
+        """
+        try:
+            cache.incr(HOME_FEED_VERSION_CACHE_KEY)
+        except ValueError:
+            cache.add(HOME_FEED_VERSION_CACHE_KEY, int(time.time() * 1000), None)
+
+
+# プロセス内で共有するインスタンス
+home_feed_cache = HomeFeedCache()
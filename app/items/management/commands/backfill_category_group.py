@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from items.models import backfillCategoryGroup
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py backfill_category_group
+
+    Item.category_groupを追加する前に作成された記事のcategory_groupを設定する。
+    グループごとに1回のUPDATEで設定する。
+    migrateの後にも自動で実行される(items/models.py category_group_post_migrate_receiver)ので、
+    通常は手動で実行する必要はない。
+    """
+
+    help = "Item.category_groupをcategoryに基づいて設定する"
+
+    def handle(self, *args, **options):
+        for group, updated in backfillCategoryGroup().items():
+            self.stdout.write("{} : {}件を修正しました".format(group, updated))
@@ -1,12 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed, pre_migrate, post_migrate
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models as geomodels
-from categories.models import Category
+from categories.models import Category, CATEGORY_GROUPS, CATEGORY_GROUP_CHOICE, getCategoryGroup
 from direct_messages.models import DirectMessage
 from profiles.models import Profile
 from prefecturas.list_data import adm0_CHOICES, DEPARTAMENTO_CHOICES, MUNICIPIO_CHOICES
 from solicitudes.models import Solicitud
 from item_contacts.models import ItemContact
+from items.home_feed import home_feed_cache
 
 from django.utils import timezone
 
@@ -26,6 +30,8 @@ class Item(models.Model):
 	description      = models.TextField()
 	price            = models.IntegerField(default=0)
 	category         = models.ForeignKey(Category, on_delete=models.PROTECT)
+	# categoryから決まるグループ(categories/models.py 参照)。グループ単位の一覧で使うためにsave()で保存する
+	category_group   = models.PositiveSmallIntegerField(choices=CATEGORY_GROUP_CHOICE, null=True, blank=True, editable=False)
 	adm0             = models.CharField(max_length=15, default="GUATEMALA", choices=adm0_CHOICES)
 	adm1             = models.CharField(max_length=15, null=True, choices=DEPARTAMENTO_CHOICES)
 	adm2             = models.CharField(max_length=30, null=True, choices=MUNICIPIO_CHOICES)
@@ -44,14 +50,37 @@ class Item(models.Model):
 	image4           = models.ImageField(upload_to="images/" ,null=True, blank=True)
 	image5           = models.ImageField(upload_to="images/" ,null=True, blank=True)
 	image6           = models.ImageField(upload_to="images/" ,null=True, blank=True)
+	# 全文検索用(items/search.py 参照)。DBのトリガーで更新するので直接変更しない
+	search_vector    = SearchVectorField(null=True, editable=False)
 
 
 	# deadlineをなんの目的で作ったか忘れてしまった
 	# deadlineがTrueのとき　アイテム表示が　cerradoになる。
 
+	class Meta:
+		# 一覧は公開中(active=True)の記事のみを新しい順に表示するので、部分インデックス(WHERE active)にしている。
+		# 部分インデックスを使わせるため、一覧のクエリではexclude(active=False)ではなくfilter(active=True)と書く。
+		# keyset pagination(api/pagination.py)の(created_at, id)の並び順に合わせて末尾に-idを含めている。
+		indexes = [
+			models.Index(fields=["category_group", "active", "-created_at"], name="item_group_active_created"),
+			models.Index(fields=["category", "-created_at", "-id"], name="item_cat_created_act", condition=models.Q(active=True)),
+			models.Index(fields=["adm1", "category", "-created_at", "-id"], name="item_adm1_cat_created_act", condition=models.Q(active=True)),
+			models.Index(fields=["user", "-created_at", "-id"], name="item_user_created_act", condition=models.Q(active=True)),
+			GinIndex(fields=["search_vector"], name="item_search_vector"),
+			GinIndex(fields=["title"], name="item_title_trgm", opclasses=["gin_trgm_ops"]),
+		]
+
 	def __str__(self):
 		return self.title
 
+	def save(self, *args, **kwargs):
+		update_fields = kwargs.get("update_fields", None)
+		if self.category_id is not None and (update_fields is None or "category" in update_fields):
+			self.category_group = getCategoryGroup(self.category.number)
+			if update_fields is not None:
+				kwargs["update_fields"] = set(update_fields) | {"category_group"}
+		super(Item, self).save(*args, **kwargs)
+
 
 	"""
 	def save(self, *args, **kwargs):
@@ -88,3 +117,75 @@ class Item(models.Model):
 		super(Item,self).save(*args, **kwargs)
 	"""
 
+
+
+def home_feed_invalidation_receiver(sender, *args, **kwargs):
+	"""
+	ホーム画面の記事一覧(items/home_feed.py)に表示される内容が変更された時にキャッシュを無効にする。
+	キャッシュに保存するのは記事の列、件数(summary)、記事のid(full)のみで、Profileやメッセージは保存しないので、
+	記事の作成、編集、削除と記事のManyToManyField(件数)の変更でのみ無効にする。
+	トランザクション内の変更は他のプロセスからまだ見えないので、コミット後にもう一度無効にする。
+	"""
+	if kwargs.get("action", "").startswith("pre_"):
+		return
+	home_feed_cache.invalidate()
+	transaction.on_commit(home_feed_cache.invalidate)
+
+
+post_save.connect(home_feed_invalidation_receiver, sender=Item)
+post_delete.connect(home_feed_invalidation_receiver, sender=Item)
+for home_feed_sender in (Item.favorite_users.through, Item.item_contacts.through, Item.solicitudes.through):
+	m2m_changed.connect(home_feed_invalidation_receiver, sender=home_feed_sender)
+
+
+def search_pre_migrate_receiver(sender, using, *args, **kwargs):
+	"""
+	titleのトライグラムのインデックスに必要なpg_trgm拡張をテーブル作成前に作成する
+	"""
+	if sender.label != "items":
+		return
+	from items.search import createSearchExtensions
+	createSearchExtensions(using)
+
+
+def search_post_migrate_receiver(sender, using, *args, **kwargs):
+	"""
+	search_vectorを更新するトリガーをmigrate後に作成する
+	"""
+	if sender.label != "items":
+		return
+	from items.search import installSearchTrigger
+	installSearchTrigger(using)
+
+
+def backfillCategoryGroup(using="default"):
+	"""機能
+	Item.category_groupが設定されていない(またはcategoryと一致しない)記事のcategory_groupを設定する。
+	グループごとに1回のUPDATEで設定する。設定済みの場合は何も更新しない。
+
+	Returns:
+		dict: {グループ: 更新した件数}
+	"""
+	updated = {}
+	for group, numbers in CATEGORY_GROUPS.items():
+		updated[group] = Item.objects.using(using).filter(category__number__in=numbers).exclude(
+			category_group=group).update(category_group=group)
+	if sum(updated.values()) > 0:
+		# update()ではシグナルが発火しないのでホーム画面のキャッシュを直接無効にする
+		home_feed_cache.invalidate()
+	return updated
+
+
+def category_group_post_migrate_receiver(sender, using, *args, **kwargs):
+	"""
+	category_groupを追加する前に作成された記事にmigrate後に自動でcategory_groupを設定する。
+	ホーム画面、カテゴリーグループの一覧はcategory_groupのみで絞り込むので、設定されていない記事は表示されない
+	"""
+	if sender.label != "items":
+		return
+	backfillCategoryGroup(using)
+
+
+pre_migrate.connect(search_pre_migrate_receiver)
+post_migrate.connect(search_post_migrate_receiver)
+post_migrate.connect(category_group_post_migrate_receiver)
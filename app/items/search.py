@@ -0,0 +1,124 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, When
+from categories.models import CATEGORY_GROUPS
+from items.models import Item
+
+
+"""
+記事の全文検索を行うモジュール。
+
+Item.search_vectorにはtitle(重みA)とdescription(重みB)をスペイン語の設定でto_tsvectorした値を保存する。
+値はDBのトリガーで更新するので、save()だけでなくbulk_createやupdate()で変更した場合も常に最新である。
+トリガーとpg_trgm拡張はmigrate時にinstallSearchTrigger(), createSearchExtensions()で作成する(items/models.py 参照)。
+"""
+
+SEARCH_CONFIG = "spanish"
+
+SEARCH_EXTENSIONS_SQL = "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+
+SEARCH_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('{config}', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('{config}', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table};
+CREATE TRIGGER {table}_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update();
+
+UPDATE {table} SET title = title WHERE search_vector IS NULL;
+"""
+
+
+def createSearchExtensions(using):
+    with connections[using].cursor() as cursor:
+        cursor.execute(SEARCH_EXTENSIONS_SQL)
+
+
+def installSearchTrigger(using):
+    """
+    search_vectorを更新するトリガーを作成する。何度実行しても同じ結果になる。
+    トリガー作成前に作成された記事のsearch_vectorもここで設定する。
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(SEARCH_TRIGGER_SQL.format(table=Item._meta.db_table, config=SEARCH_CONFIG))
+
+
+class ItemSearch(object):
+
+    """ *使用方法*
+
+    from items.search import ItemSearch
+
+    item_search = ItemSearch(q, category="500", adm1="Quetzaltenango")
+    item_objects = item_search.getQuerySet()
+    item_objects, next_page = item_search.getPage(page=1, page_size=20)
+
+    search_vector(GINインデックス)による全文検索と、titleのトライグラム(GINインデックス)による
+    あいまい検索のどちらかに一致する公開中の記事を関連度の高い順に返す。
+    トライグラムはスペルミス("telefno" -> "teléfono")に一致させるために使う。
+    """
+
+    def __init__(self, q, category=None, adm1=None):
+        self.q = (q or "").strip()
+        self.category = category
+        self.adm1 = adm1
+
+    def getQuerySet(self):
+        if self.q == "":
+            return Item.objects.none()
+
+        query = SearchQuery(self.q, config=SEARCH_CONFIG)
+        item_objects = Item.objects.filter(active=True)
+        item_objects = self.filterCategory(item_objects)
+        if self.adm1:
+            item_objects = item_objects.filter(adm1=self.adm1)
+
+        return item_objects.filter(
+            Q(search_vector=query) | Q(title__trigram_similar=self.q)
+        ).annotate(
+            rank=SearchRank(F("search_vector"), query),
+            similarity=TrigramSimilarity("title", self.q),
+        ).order_by("-rank", "-similarity", "-created_at", "-id")
+
+    def filterCategory(self, item_objects):
+        """
+        categoryはカテゴリー番号("1"~"10")またはグループ("500"~"800")
+        """
+        if not self.category:
+            return item_objects
+        try:
+            group = int(self.category)
+        except ValueError:
+            group = None
+        if group in CATEGORY_GROUPS:
+            return item_objects.filter(category_group=group)
+        return item_objects.filter(category__number=self.category)
+
+    def getPage(self, page=1, page_size=20):
+        """機能
+        1ページ分の記事を関連度の順に返す。
+        件数を数えるCOUNT(*)は行わず、1件多く取得して次のページがあるか判定する。
+
+        Returns:
+            (QuerySet, int): 1ページ分のquerysetと次のページ番号(最後のページの場合はNone)
+        """
+        offset = (page - 1) * page_size
+        ids = list(self.getQuerySet().values_list("id", flat=True)[offset:offset + page_size + 1])
+        next_page = None
+        if len(ids) > page_size:
+            ids = ids[:page_size]
+            next_page = page + 1
+        if len(ids) == 0:
+            return Item.objects.none(), None
+
+        # id__inで取得し直すので、関連度の順をCaseで保つ
+        ordering = Case(*[When(id=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+        page_objects = Item.objects.filter(id__in=ids).annotate(search_position=ordering).order_by("search_position")
+        return page_objects, next_page
@@ -1,16 +1,25 @@
+from django.apps import apps
 from django.test import TestCase, RequestFactory
 from django.test.utils import setup_test_environment
 from django.test import Client
+from rest_framework.test import APIClient
 from django.urls import reverse_lazy, reverse
 from django.core.files import File
 from django.contrib.auth.models import User
 from items.forms import ItemModelForm
-from items.models           import Item
+from items.models           import Item, category_group_post_migrate_receiver
+from items.search           import ItemSearch
 from categories.models      import Category
 from direct_messages.models import DirectMessage
 from favorite.models        import Favorite
 from profiles.models        import Profile
 from solicitudes.models     import Solicitud
+from feedback.models import Feedback
+from profiles.models import addProfileFeedback
+from items.viewer_state import resolveItemViewerState
+from api.constants import BtnChoice
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from config.tests.utils import *
 from config.constants import ViewName
 from config.constants import TemplateName
@@ -1194,4 +1203,222 @@ class ItemCategoryListViewTest(TestCase):
         for obj in item_objects:
             self.assertEqual(obj.category.number, "5")
 
-                                
\ No newline at end of file
+                                
+
+class ItemCategoryGroupTest(TestCase):
+    """テスト目的
+    Item.category_groupがcategoryに応じて保存され、グループの一覧に使われることを担保する
+    """
+    """テスト対象
+    items/models.py Item#save
+    items/views.py ItemCategoryListView#GET
+    endpoint: 'items/category/<int:pk>/items/list/'
+    name: "items:ItemCategoryListView"
+    """
+    """テスト項目
+    記事を作成するとcategoryに対応するcategory_groupが保存される
+    categoryを変更するとcategory_groupも変更される
+    update_fieldsにcategoryを指定した場合もcategory_groupが変更される
+    グループ(500)を指定すると表示される記事はカテゴリー1,2,3の記事である
+    category_groupが設定されていない記事はmigrate後(post_migrate)にcategory_groupが設定される
+    """
+
+    def setUp(self):
+        setUp_cetegory_for_test()
+        self.user_obj = User.objects.create_user(username="test1", email="test1@gmail.com", password="1234tweet")
+
+    def createItem(self, number):
+        return Item.objects.create(
+            user=self.user_obj,
+            title="テストアイテム",
+            description="説明です。",
+            category=Category.objects.get(number=number))
+
+    def test_記事を作成するとcategoryに対応するcategory_groupが保存される(self):
+        for number, group in (("1", 500), ("4", 600), ("9", 700), ("10", 800)):
+            item_obj = self.createItem(number)
+            self.assertEqual(Item.objects.get(id=item_obj.id).category_group, group)
+
+    def test_categoryを変更するとcategory_groupも変更される(self):
+        item_obj = self.createItem("1")
+        item_obj.category = Category.objects.get(number="8")
+        item_obj.save()
+        self.assertEqual(Item.objects.get(id=item_obj.id).category_group, 700)
+
+    def test_update_fieldsにcategoryを指定した場合もcategory_groupが変更される(self):
+        item_obj = self.createItem("1")
+        item_obj.category = Category.objects.get(number="5")
+        item_obj.save(update_fields=["category"])
+        self.assertEqual(Item.objects.get(id=item_obj.id).category_group, 600)
+
+    def test_グループを指定すると表示される記事は当該グループのカテゴリーの記事である(self):
+        for number in ("1", "2", "3", "4", "8"):
+            self.createItem(number)
+        response = Client().get(reverse_lazy(ViewName.ITEM_CATEGORY_LIST, args=(500,)))
+        numbers = sorted(obj.category.number for obj in response.context[ContextKey.ITEM_OBJECTS])
+        self.assertEqual(numbers, ["1", "2", "3"])
+
+    def test_category_groupが設定されていない記事はmigrate後に設定される(self):
+        item_obj = self.createItem("4")
+        Item.objects.update(category_group=None)
+        category_group_post_migrate_receiver(apps.get_app_config("items"), using="default")
+        self.assertEqual(Item.objects.get(id=item_obj.id).category_group, 600)
+
+
+class ItemSearchTest(TestCase):
+    """テスト目的
+    全文検索とあいまい検索で記事が検索できることを担保する
+    """
+    """テスト対象
+    items/search.py ItemSearch
+    items/views.py ItemSearchView#GET
+    api/Views/item_views.py ItemSearchAPIView#GET
+    endpoint: 'items/search/', 'api/items/search/'
+    """
+    """テスト項目
+    記事を作成するとsearch_vectorがトリガーで設定される
+    スペイン語の語形変化(複数形)でも検索できる
+    スペルミスがあってもtitleのトライグラムで検索できる
+    titleに一致する記事はdescriptionに一致する記事より上位になる
+    categoryにグループを指定した場合は当該グループの記事のみ返る
+    非公開の記事は返らない
+    APIではpage_sizeごとにページ分割され、NEXT_PAGEで次のページを取得できる
+    """
+
+    def setUp(self):
+        setUp_cetegory_for_test()
+        self.user_obj = User.objects.create_user(username="test1", email="test1@gmail.com", password="1234tweet")
+        self.phone = self.createItem("teléfono", "Lo vendo barato.", "1")
+        self.table = self.createItem("mesa", "Mesa de madera y un teléfono viejo.", "1")
+        self.room = self.createItem("habitación", "Habitación cerca del parque.", "5")
+
+    def createItem(self, title, description, number, active=True):
+        return Item.objects.create(
+            user=self.user_obj,
+            title=title,
+            description=description,
+            category=Category.objects.get(number=number),
+            adm1="Quetzaltenango",
+            active=active)
+
+    def search(self, q, **kwargs):
+        return list(ItemSearch(q, **kwargs).getQuerySet())
+
+    def test_記事を作成するとsearch_vectorがトリガーで設定される(self):
+        self.assertIsNotNone(Item.objects.get(id=self.phone.id).search_vector)
+
+    def test_スペイン語の語形変化でも検索できる(self):
+        self.assertIn(self.room, self.search("habitaciones"))
+
+    def test_スペルミスがあってもtitleのトライグラムで検索できる(self):
+        self.assertIn(self.phone, self.search("telefono"))
+
+    def test_titleに一致する記事はdescriptionに一致する記事より上位になる(self):
+        self.assertEqual(self.search("teléfono")[:2], [self.phone, self.table])
+
+    def test_categoryにグループを指定した場合は当該グループの記事のみ返る(self):
+        self.createItem("mesa de habitación", "mesa", "5")
+        results = self.search("mesa", category="600")
+        self.assertEqual([item_obj.category.number for item_obj in results], ["5"])
+
+    def test_非公開の記事は返らない(self):
+        hidden = self.createItem("teléfono nuevo", "nuevo", "1", active=False)
+        self.assertNotIn(hidden, self.search("teléfono"))
+
+    def test_web画面で検索結果が表示される(self):
+        response = Client().get(reverse_lazy("items:item_search"), {"q": "habitación"})
+        self.assertEqual(list(response.context[ContextKey.ITEM_OBJECTS]), [self.room])
+
+    def test_APIではpage_sizeごとにページ分割されNEXT_PAGEで次のページを取得できる(self):
+        client = APIClient()
+        response = client.get("/api/items/search/", {"q": "teléfono", "page_size": 1})
+        self.assertEqual([d["id"] for d in response.data["ITEM_OBJECTS"]], [self.phone.id])
+        self.assertEqual(response.data["NEXT_PAGE"], 2)
+        response = client.get("/api/items/search/", {"q": "teléfono", "page_size": 1, "page": 2})
+        self.assertEqual([d["id"] for d in response.data["ITEM_OBJECTS"]], [self.table.id])
+
+
+
+class ItemViewerStateTest(TestCase):
+
+    """テスト対象
+    items/viewer_state.py resolveItemViewerState
+    items.views.py ItemDetailView (items:item_detail)
+    """
+
+    """テスト項目
+    済 閲覧者と記事の関係に応じてbtn_choiceが求められる
+    済 出品者の評価の合計と平均が求められる
+    済 閲覧者の状態と出品者の評価は2回のクエリ(feedbackのprefetchを含め3回)で求められる
+    済 記事詳細ページのクエリの数は申請者の数に関わらず一定である
+    """
+
+    def setUp(self):
+        category_obj = pickUp_category_obj_for_test()
+        self.post_user_obj, self.post_user_profile_obj = create_user_for_test(
+            create_user_data(prefix_user_emailaddress="post_user"))
+        self.applicant_obj, _ = create_user_for_test(create_user_data(prefix_user_emailaddress="applicant"))
+        self.other_obj, _ = create_user_for_test(create_user_data(prefix_user_emailaddress="other"))
+        self.item_obj = create_item_for_test(self.post_user_obj, create_item_data(category_obj))
+
+        for level in (5, 3):
+            addProfileFeedback(
+                self.post_user_profile_obj,
+                Feedback.objects.create(evaluator=self.other_obj, content="bien", level=level))
+
+    def resolve(self, user_obj):
+        return resolveItemViewerState(self.item_obj.id, user_obj)
+
+    def test_申請者がいない場合のbtn_choice(self):
+        self.assertEqual(self.resolve(None).btn_choice, BtnChoice.ANONYMOUS_USER_ACCESS)
+        self.assertEqual(self.resolve(self.post_user_obj).web_btn_choice, "no_solicitudes")
+        self.assertEqual(self.resolve(self.applicant_obj).web_btn_choice, "moushikomi")
+
+    def test_申請者がいて取引相手が未決定の場合のbtn_choice(self):
+        create_solicitud_for_test(self.item_obj, self.applicant_obj, create_solicitud_data())
+        self.assertEqual(self.resolve(self.post_user_obj).web_btn_choice, "select_solicitudes")
+        self.assertEqual(self.resolve(self.applicant_obj).web_btn_choice, "sumi")
+        self.assertEqual(self.resolve(self.other_obj).web_btn_choice, "moushikomi")
+
+    def test_取引相手が決定した場合のbtn_choiceとdm_obj(self):
+        solicitud_obj = create_solicitud_for_test(self.item_obj, self.applicant_obj, create_solicitud_data())
+        dm_obj, _ = create_direct_message_for_test(solicitud_obj)
+
+        state = self.resolve(self.post_user_obj)
+        self.assertEqual(state.btn_choice, BtnChoice.GO_TRANSACTION)
+        self.assertEqual(state.dm_obj, dm_obj)
+        state = self.resolve(self.applicant_obj)
+        self.assertEqual(state.web_btn_choice, "torihiki")
+        self.assertEqual(state.dm_obj, dm_obj)
+        state = self.resolve(self.other_obj)
+        self.assertEqual(state.web_btn_choice, "fail")
+        self.assertIsNone(state.dm_obj)
+
+    def test_出品者の評価の合計と平均が求められる(self):
+        state = self.resolve(None)
+        self.assertEqual(state.feedback_sum, 8)
+        self.assertEqual(state.feedback_ave, 4)
+
+    def test_閲覧者の状態と出品者の評価は3回のクエリで求められる(self):
+        create_solicitud_for_test(self.item_obj, self.applicant_obj, create_solicitud_data())
+        with CaptureQueriesContext(connection) as context:
+            state = self.resolve(self.applicant_obj)
+            state.btn_choice, state.dm_obj, state.feedback_sum, state.feedback_ave
+            list(state.seller_profile_obj.feedback.all())
+        self.assertEqual(len(context.captured_queries), 3)
+
+    def test_記事詳細ページのクエリの数は申請者の数に関わらず一定である(self):
+        url = reverse("items:item_detail", args=(self.item_obj.id,))
+        client = Client()
+        client.login(username=self.other_obj.username, password="1234tweet")
+
+        create_solicitud_for_test(self.item_obj, self.applicant_obj, create_solicitud_data())
+        with CaptureQueriesContext(connection) as first:
+            response = client.get(url)
+        self.assertEqual(response.context["btn_choice"], "moushikomi")
+
+        create_solicitud_for_test(self.item_obj, self.other_obj, create_solicitud_data())
+        with CaptureQueriesContext(connection) as second:
+            response = client.get(url)
+        self.assertEqual(response.context["btn_choice"], "sumi")
+        self.assertEqual(len(first.captured_queries), len(second.captured_queries))
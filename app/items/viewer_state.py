@@ -0,0 +1,169 @@
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from api.constants import BtnChoice
+from feedback.models import Feedback
+from profiles.models import Profile
+from .models import Item
+
+
+"""
+記事詳細ページ(items.views.ItemDetailView, api ItemDetailSerializerAPIView)で使う
+「閲覧者と記事の関係」と「出品者の評価」を求めるモジュール。
+
+以前は申請者の有無、閲覧者の申請の有無、取引相手などをcount()で1つずつ確認していたため、
+1回の表示で10回前後のクエリが発行されていた。
+ここでは記事の取得時にExistsとSubqueryのannotateで閲覧者の状態を求め(1クエリ)、
+出品者の評価の合計と平均はProfile.rating_sum, rating_averageを使う(1クエリ + feedbackのprefetch)。
+"""
+
+# web(items/templates)のbtn_choice.htmlで使われている値
+WEB_BTN_CHOICES = {
+    BtnChoice.NO_SOLICITUDES: "no_solicitudes",
+    BtnChoice.SELECT_SOLICITUDES: "select_solicitudes",
+    BtnChoice.GO_TRANSACTION: "torihiki",
+    BtnChoice.SOLICITAR: "moushikomi",
+    BtnChoice.SOLICITADO: "sumi",
+    BtnChoice.CANNOT_TRANSACTION: "fail",
+}
+
+
+def annotateItemViewerState(queryset, viewer_user_id):
+    """機能
+    記事のquerysetに閲覧者の状態を求めるannotateを追加する
+
+    Args:
+        queryset: Itemのqueryset
+        viewer_user_id: 閲覧者のUserのid (未認証の場合はNone)
+    Returns:
+        queryset: has_solicitudes, viewer_profile_id, viewer_solicitadoを持つItemのqueryset
+    """
+    through_objects = Item.solicitudes.through.objects.filter(item_id=OuterRef("pk"))
+    queryset = queryset.select_related("user", "direct_message").annotate(
+        has_solicitudes=Exists(through_objects))
+    if viewer_user_id is None:
+        return queryset
+    return queryset.annotate(
+        viewer_profile_id=Subquery(
+            Profile.objects.filter(user_id=viewer_user_id).order_by("id").values("id")[:1]),
+        viewer_solicitado=Exists(through_objects.filter(solicitud__applicant__user_id=viewer_user_id)),
+    )
+
+
+def getSellerProfile(item_obj):
+    """
+    出品者のProfileを取得する。評価の合計と平均はrating_sum, rating_averageに集計済みである
+    """
+    return Profile.objects.filter(user_id=item_obj.user_id).select_related("user").prefetch_related(
+        Prefetch("feedback", queryset=Feedback.objects.select_related("evaluator").order_by("id")),
+    ).get()
+
+
+class ItemViewerState(object):
+
+    """ *使用方法*
+
+    from items.viewer_state import resolveItemViewerState
+
+    state = resolveItemViewerState(pk, request.user)
+    state.item_obj              # Itemオブジェクト
+    state.seller_profile_obj    # 出品者のProfileオブジェクト
+    state.btn_choice            # BtnChoiceの値 (api)
+    state.web_btn_choice        # "moushikomi"などの値 (web, 未認証の場合はNone)
+    state.dm_obj                # 閲覧者が出品者または取引相手の場合のDirectMessageオブジェクト
+    state.feedback_sum, state.feedback_ave
+
+    閲覧者の状態はresolveItemViewerState()で取得したオブジェクトから求めるので、属性の参照でクエリは発行されない。
+    """
+
+    def __init__(self, item_obj, seller_profile_obj, viewer_user_id):
+        self.item_obj = item_obj
+        self.seller_profile_obj = seller_profile_obj
+        self.viewer_user_id = viewer_user_id
+
+    @property
+    def is_anonymous(self):
+        return self.viewer_user_id is None
+
+    @property
+    def is_seller(self):
+        return self.viewer_user_id is not None and self.viewer_user_id == self.item_obj.user_id
+
+    @property
+    def viewer_profile_id(self):
+        if self.is_anonymous:
+            return None
+        return self.item_obj.viewer_profile_id
+
+    @property
+    def is_participant(self):
+        dm_obj = self.item_obj.direct_message
+        return dm_obj is not None and self.viewer_profile_id is not None and dm_obj.participant_id == self.viewer_profile_id
+
+    @property
+    def dm_obj(self):
+        if self.is_seller or self.is_participant:
+            return self.item_obj.direct_message
+        return None
+
+    @property
+    def btn_choice(self):
+        has_direct_message = self.item_obj.direct_message_id is not None
+        if self.is_anonymous:
+            return BtnChoice.ANONYMOUS_USER_ACCESS
+
+        if self.is_seller:
+            if not self.item_obj.has_solicitudes:
+                return BtnChoice.NO_SOLICITUDES
+            if has_direct_message:
+                return BtnChoice.GO_TRANSACTION
+            return BtnChoice.SELECT_SOLICITUDES
+
+        if not has_direct_message:
+            if self.item_obj.viewer_solicitado:
+                return BtnChoice.SOLICITADO
+            return BtnChoice.SOLICITAR
+        if self.is_participant:
+            return BtnChoice.GO_TRANSACTION
+        return BtnChoice.CANNOT_TRANSACTION
+
+    @property
+    def web_btn_choice(self):
+        return WEB_BTN_CHOICES.get(self.btn_choice)
+
+    @property
+    def feedback_sum(self):
+        # 評価がない場合は以前のaggregate(Sum)と同じくNoneを返す
+        if self.seller_profile_obj.rating_count == 0:
+            return None
+        return self.seller_profile_obj.rating_sum
+
+    @property
+    def feedback_ave(self):
+        return self.seller_profile_obj.rating_average
+
+
+def resolveItemViewerState(pk, user_obj, item_queryset=None):
+    """機能
+    記事と閲覧者の関係、出品者の評価を求める。
+
+    Args:
+        pk: Itemのid
+        user_obj: 閲覧者のUserオブジェクト (未認証の場合はAnonymousUser または None)
+        item_queryset: 記事を取得するqueryset。シリアライザ用のprefetchなどを指定する場合に渡す
+    Returns:
+        ItemViewerState
+    Raises:
+        Item.DoesNotExist: 記事が存在しない場合
+        Profile.DoesNotExist: 出品者のProfileが存在しない場合
+
+    コピペ:
+        state = resolveItemViewerState(pk, request.user)
+    """
+    if item_queryset is None:
+        item_queryset = Item.objects.all()
+    viewer_user_id = None
+    if user_obj is not None and not user_obj.is_anonymous:
+        viewer_user_id = user_obj.id
+
+    item_obj = annotateItemViewerState(item_queryset, viewer_user_id).get(id=pk)
+    seller_profile_obj = getSellerProfile(item_obj)
+    return ItemViewerState(item_obj, seller_profile_obj, viewer_user_id)
@@ -8,9 +8,12 @@ from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.gis.geos import GEOSGeometry
 from django.views.generic import View
-from django.db.models import Avg, Sum, Q
+from django.db.models import Q
 from django.http import JsonResponse
 from items.models import Item
+from items.search import ItemSearch
+from items.viewer_state import resolveItemViewerState
+from categories.models import CATEGORY_GROUPS
 from items.forms import ItemModelForm
 from items.utils import addBtnFavToContext
 from item_contacts.forms import ItemContactModelForm
@@ -69,7 +72,7 @@ class ItemUserListView(View):
     def get(self, request, *args, **kwargs):
         context = {}
         user_obj = request.session["user_obj"]
-        item_objects = Item.objects.filter(user=user_obj).exclude(active=False).order_by("-created_at")
+        item_objects = Item.objects.filter(user=user_obj).filter(active=True).order_by("-created_at")
         # 基本的にItemオブジェクトが0個の場合は存在しないと考えられるが、不足の自体に備えて以下の場合を加えておく
         if item_objects.count() == 0:
             return render(request, TemplateName.NO_ITEMS)
@@ -102,7 +105,12 @@ class ItemCategoryListView(View):
         if category_number == 999:
             return redirect('item:item_list')
 
-        item_objects = Item.objects.filter(category__number=category_number).filter(active=True).order_by("-created_at")
+        # 500, 600, 700, 800はカテゴリーのグループ(categories/models.py 参照)
+        if category_number in CATEGORY_GROUPS:
+            item_objects = Item.objects.filter(category_group=category_number)
+        else:
+            item_objects = Item.objects.filter(category__number=category_number)
+        item_objects = item_objects.filter(active=True).order_by("-created_at")
         page_obj = paginate_queryset(request, item_objects)
         # 記事がないときはno_item.htmlを表示する
         if item_objects.count() == 0:
@@ -145,7 +153,11 @@ class ItemCategoryLocalListView(View):
             return redirect('item:item_list')
 
         # categoryObj = Category.objects.get(number=category_number)
-        item_objects = Item.objects.filter(category__number=category_number).filter(adm1=profile_obj.adm1).exclude(active=False).order_by("-created_at")
+        if category_number in CATEGORY_GROUPS:
+            item_objects = Item.objects.filter(category_group=category_number)
+        else:
+            item_objects = Item.objects.filter(category__number=category_number)
+        item_objects = item_objects.filter(adm1=profile_obj.adm1).filter(active=True).order_by("-created_at")
         page_obj = paginate_queryset(request, item_objects)
         if item_objects.count() == 0:
             return render(request, TemplateName.NO_ITEMS)
@@ -174,13 +186,14 @@ class ItemDetailView(View):
 
         context = {}
         pk = self.kwargs["pk"]
-        item_obj = Item.objects.get(id=pk)
-        # user_obj = User.objects.get(username=item_obj.user)
+        # 閲覧者と記事の関係、出品者の評価をまとめて取得する (items/viewer_state.py)
+        state = resolveItemViewerState(pk, request.user)
+        item_obj = state.item_obj
         user_obj = item_obj.user
         # 記事主名をクリックすると記事主のfeedbackや記事一覧を表示するために使用するセッションを追加。
         # ViewName.ITEM_USER_LIST(ItemUserListView)で使われる
         self.request.session["user_obj"] = user_obj
-        profile_obj = Profile.objects.get(user=user_obj)
+        profile_obj = state.seller_profile_obj
         solicitudes_objects = item_obj.solicitudes.all()
         item_contact_objects = item_obj.item_contacts.all().order_by('-timestamp')
         direct_messages_objects = DirectMessage.objects.filter(item=item_obj)
@@ -196,100 +209,38 @@ class ItemDetailView(View):
         # context["btn_fav"]を設定
         context = addBtnFavToContext(request, item_obj, context)
 
-        # context["btn_choice"]を設定
-
-        # ユーザーが未認証の場合 ->ボタン情報をcontextに追加しない
-        if request.user.is_anonymous:
-            pass
-
-        # ユーザーが投稿主かつ申請者なしの場合 -> 申請者を選ぶボタンを表示しない
-        elif request.user == user_obj and solicitudes_objects.count() == 0:
-            btn_choice = "no_solicitudes"
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主かつ申請者有＆取引相手未決定の場合 -> ”申請者を選ぶボタン”を表示させる。
-        elif request.user == user_obj and solicitudes_objects.count() != 0 and direct_messages_objects.count() == 0:
-            btn_choice = "select_solicitudes"
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主かつ取引相手決定済みの場合 -> ”取引画面へ映るボタン”を表示させる。
-        elif request.user == user_obj and direct_messages_objects.count() != 0:
-            btn_choice = 'torihiki'
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主以外かつ未申請の場合 -> ”申し込むボタン”を表示させる。
-        elif request.user != user_obj and solicitudes_objects.filter(applicant=Profile.objects.get(user=request.user)).count() == 0 and direct_messages_objects.filter(item=item_obj).count() == 0:
-            btn_choice = "moushikomi"
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主以外かつ申請済みの場合 -> ”申請済みのdisabledボタン”を表示させる。
-        elif request.user != user_obj and solicitudes_objects.filter(applicant=Profile.objects.get(user=request.user)).count() != 0 and direct_messages_objects.count() == 0:
-            btn_choice = 'sumi'
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主以外かつ自分に決定の場合 -> ”取引画面に移るボタン”を表示させる
-        elif request.user != user_obj and direct_messages_objects.filter(participant=Profile.objects.get(user=request.user)).count() == 1:
-            btn_choice = 'torihiki'
-            context["btn_choice"] = btn_choice
-
-        # ユーザーが投稿主以外かつ他者に決定の場合 -> ”このアイテムは他者に決定しましたのdisabledボタン”を表示させる。
-        elif request.user != user_obj and direct_messages_objects.filter(participant=Profile.objects.get(user=request.user)).count() == 0:
-            btn_choice = 'fail'
-            context["btn_choice"] = btn_choice
+        # context["btn_choice"]を設定 (ユーザーが未認証の場合 ->ボタン情報をcontextに追加しない)
+        if state.web_btn_choice is not None:
+            context["btn_choice"] = state.web_btn_choice
 
         # 記事作成者のフィードバックに関する["feedback_sum"]["feedback_ave"]
-        feedback_sum = profile_obj.feedback.all().aggregate(Sum('level'))['level__sum']
-        context["feedback_sum"] = feedback_sum
-        feedback_ave = profile_obj.feedback.all().aggregate(Avg('level'))['level__avg']
-        context["feedback_ave"] = feedback_ave
+        context["feedback_sum"] = state.feedback_sum
+        context["feedback_ave"] = state.feedback_ave
 
         # コメントを記入するための context["form"]を設定
 
         # ユーザーが未認証の場合 ->
-        if request.user.is_anonymous:
+        if state.is_anonymous:
             data = {"post_user": request.user, "item": item_obj}
             form = ItemContactModelForm(initial=data)
             context["form"] = form
 
-        # ユーザーが投稿主の場合 -> 投稿記事主以外のitem_contactオブジェクトを取得し、各プロフィールオブジェクトをreply_userにセットする
-        elif request.user == user_obj:
-            profile_obj = Profile.objects.get(user=request.user)
-            data = {"post_user": profile_obj, "item": item_obj}
-            form = ItemContactModelForm(initial=data)
-            context["form"]	= form
-
-        # ユーザーが投稿主の場合 -> 投稿記事主以外のitem_contactオブジェクトを取得し、各プロフィールオブジェクトをreply_userにセットする
-        elif request.user != user_obj and Profile.objects.filter(user=request.user).count() != 0:
-            profile_obj = Profile.objects.get(user=request.user)
-            data = {"post_user": profile_obj, "item": item_obj }
+        # ユーザーがProfileを持つ場合 -> 自分のProfileをpost_userにセットする
+        elif state.viewer_profile_id is not None:
+            data = {"post_user": state.viewer_profile_id, "item": item_obj}
             form = ItemContactModelForm(initial=data)
             context["form"] = form
 
-        # context["dm-obj"]を設定 (try exceptで書き換えられる)
-        if request.user.is_anonymous:
-            pass
-
-        elif request.user == user_obj and direct_messages_objects.count() != 0:
-            dm_obj = DirectMessage.objects.get(item=item_obj)
-            context["dm_obj"] = dm_obj
-
-        elif request.user != user_obj and direct_messages_objects.filter(participant=Profile.objects.get(user=request.user)).count() != 0:
-            dm_obj = DirectMessage.objects.get(item=item_obj)
-            context["dm_obj"] = dm_obj
+        # context["dm_obj"]を設定 (ユーザーが投稿主または取引相手の場合)
+        if state.dm_obj is not None:
+            context["dm_obj"] = state.dm_obj
 
         # テンプレートレンダリング
-        if request.user.is_anonymous:
-            return render(request, TemplateName.ITEM_DETAIL, context)
-
-        elif request.user == user_obj:
-            return render(request, TemplateName.ITEM_DETAIL, context)
-
         # おそらく以下のロジックは通らないと思われるが安全の為、記述する
-        elif request.user != user_obj and Profile.objects.filter(user=request.user).count() == 0:
+        if not state.is_anonymous and not state.is_seller and state.viewer_profile_id is None:
             return redirect('profiles:profile_creating')
 
-        elif request.user != user_obj:
-            return render(request, TemplateName.ITEM_DETAIL, context)
+        return render(request, TemplateName.ITEM_DETAIL, context)
 
 
 class ItemEditView(View):
@@ -554,16 +505,26 @@ class ItemSearchView(View):
     インプットフォームに入力されたキーをもとにarticulos(item)を
     リスト化し、リスト表示する
 
+    endpoint: 'items/search/'
+    name: 'items:item_search'
     """
     def get(self, request, *args, **kwargs):
+        """
+        q: 検索キーワード
+        category: カテゴリー番号またはグループ(500~800)で絞り込む場合に指定する
+        adm1: Departamentoで絞り込む場合に指定する
+        検索はitems/search.py ItemSearchで行い、関連度の高い順に表示する
+        """
         context = {}
-        # print(dir(self.request))
-        if self.request.method == "GET":
-            q = self.request.GET.get("q")
-            item_objects = Item.objects.filter(Q(title__icontains=q)|Q(description__icontains=q)).exclude(active=False).order_by("-created_at")
-            context["item_objects"] = item_objects
-            context = add_aviso_objects(request, context)
-            return render(request, TemplateName.ITEM_LIST, context)
+        item_search = ItemSearch(
+            request.GET.get("q"),
+            category=request.GET.get("category"),
+            adm1=request.GET.get("adm1"))
+        page_obj = paginate_queryset(request, item_search.getQuerySet())
+        context[ContextKey.ITEM_OBJECTS] = page_obj.object_list
+        context[ContextKey.PAGE_OBJ] = page_obj
+        context = add_aviso_objects(request, context)
+        return render(request, TemplateName.ITEM_LIST, context)
 
 
 class ItemFavoriteViewKaizen(View):
@@ -0,0 +1,195 @@
+import threading
+import time
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.contrib.gis.db.models import Union
+from prefecturas.models import Departamento
+from prefecturas.models import Municipio
+
+
+"""
+Departamento, Municipioのポリゴンをprepared geometryとしてプロセス内に保持するためのモジュール。
+DBに問い合わせずに point-in-polygon の判定を行いたい場合に使う。
+
+ポリゴンの読み込みとST_Unionによる国境の作成には時間がかかるので、webのプロセスの起動時(config/wsgi.py)に
+loadInBackground()で別のスレッドで読み込んでおき、リクエストの処理中には読み込まない。
+
+prefecturasのデータを読み込み直した場合(config/set_up.main)はinvalidate()を呼ぶ。
+バージョン番号をCACHES['default']に保存しているので、他のプロセス(gunicornのworker)も
+VERSION_CHECK_INTERVAL秒以内に読み込み直す。
+"""
+
+GEOMETRY_VERSION_CACHE_KEY = "prefecturas:geometry_version"
+VERSION_CHECK_INTERVAL = 60
+
+
+class RegionDataUnavailable(Exception):
+    """
+    ポリゴンが読み込まれていないため、DBを使わずに地域を判定できない場合に送出する
+    """
+
+
+class PreparedGeometryStore(object):
+
+    """ *使用方法*
+
+    from prefecturas.geometry_store import prepared_geometry_store
+
+    prepared_geometry_store.isInGuatemala(point)
+    prepared_geometry_store.findRegion(point)
+
+    初回アクセス時にDBから一度だけポリゴンを読み込み、以降はメモリ上の値を使う。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # [(adm1_es, adm1_pcode, extent, prepared), ...]
+        self._departamentos = None
+        # {adm1_pcode: [(adm2_es, extent, prepared), ...]}
+        self._municipios = None
+        # 全Departamentoを結合した国境のポリゴン (extent, prepared)
+        self._national = None
+        self._version = None
+        self._version_checked_at = 0
+        self._loading = False
+
+    def isLoaded(self):
+        return self._departamentos is not None
+
+    def loadInBackground(self):
+        """機能
+        load()を別のスレッドで実行する。既に読み込まれている場合、読み込み中の場合は何もしない。
+        リクエストの処理中に呼び出しても待たないので、DBで判定できた後のフォールバックの準備に使う。
+
+        Returns:
+            bool: 読み込みを開始した場合はTrue
+        """
+        with self._lock:
+            if self.isLoaded() or self._loading:
+                return False
+            self._loading = True
+        threading.Thread(target=self._loadInThread, name="prepared-geometry-loader", daemon=True).start()
+        return True
+
+    def _loadInThread(self):
+        try:
+            self.load()
+        except DatabaseError:
+            # DBが利用できない場合は次のloadInBackground()で読み込み直す
+            pass
+        finally:
+            self._loading = False
+            # このスレッドで開いたDBの接続を閉じる
+            connection.close()
+
+    def load(self):
+        """
+        Departamento, MunicipioのポリゴンをDBから読み込み、prepared geometryを作成する。
+        既に読み込まれている場合は何もしない。
+        """
+        self._syncVersion()
+        if self.isLoaded():
+            return
+        with self._lock:
+            if self.isLoaded():
+                return
+
+            departamentos = []
+            for adm1_es, adm1_pcode, geom in Departamento.objects.values_list("adm1_es", "adm1_pcode", "geom"):
+                departamentos.append((adm1_es, adm1_pcode, geom.extent, geom.prepared))
+            # prefecturasのデータがまだ読み込まれていない場合は保持せず、次回に読み込み直す
+            if len(departamentos) == 0:
+                return
+
+            municipios = {}
+            for adm2_es, adm1_pcode, geom in Municipio.objects.values_list("adm2_es", "adm1_pcode", "geom"):
+                municipios.setdefault(adm1_pcode, []).append((adm2_es, geom.extent, geom.prepared))
+
+            # 国境のポリゴンはPostGIS側(ST_Union)で結合する
+            outline = Departamento.objects.aggregate(outline=Union("geom"))["outline"]
+            national = None
+            if outline is not None:
+                national = (outline.extent, outline.prepared)
+
+            self._municipios = municipios
+            self._national = national
+            self._departamentos = departamentos
+
+    def invalidate(self):
+        """
+        保持しているprepared geometryを破棄し、他のプロセスにも読み込み直しを促す。
+        """
+        with self._lock:
+            self._clear()
+        version = (cache.get(GEOMETRY_VERSION_CACHE_KEY) or 0) + 1
+        cache.set(GEOMETRY_VERSION_CACHE_KEY, version, None)
+        self._version = version
+        self._version_checked_at = time.monotonic()
+
+    def isInGuatemala(self, point):
+        """機能
+        pointがGuatemala国内に存在する場合はTrueを返す。
+        ポリゴンが読み込まれていない場合は初回のみDBから読み込む。
+        """
+        self.load()
+        if self._national is None:
+            return False
+        extent, prepared = self._national
+        return _in_extent(extent, point.x, point.y) and prepared.contains(point)
+
+    def findRegion(self, point):
+        """機能
+        pointを含むDepartamento, Municipioの名前を返す。
+        DBが利用できない場合のフォールバックとして使うので、ここではDBからの読み込みを行わない。
+
+        Args:
+            point: GEOSGeometry(Point)
+        Returns:
+            (adm1, adm2): どちらも見つからない場合はNone
+        Raises:
+            RegionDataUnavailable: ポリゴンが読み込まれていない場合(Guatemala国外とは区別する)
+        """
+        departamentos = self._departamentos
+        municipios = self._municipios
+        if departamentos is None:
+            raise RegionDataUnavailable("prepared geometries are not loaded")
+
+        x, y = point.x, point.y
+        for adm1_es, adm1_pcode, extent, prepared in departamentos:
+            # bounding boxで絞り込んでからprepared geometryで判定する
+            if not _in_extent(extent, x, y) or not prepared.contains(point):
+                continue
+            for adm2_es, muni_extent, muni_prepared in municipios.get(adm1_pcode, []):
+                if _in_extent(muni_extent, x, y) and muni_prepared.contains(point):
+                    return adm1_es, adm2_es
+            return adm1_es, None
+        return None, None
+
+    def _syncVersion(self):
+        """
+        他のプロセスでinvalidate()が呼ばれていた場合は保持しているデータを破棄する。
+        キャッシュへの問い合わせはVERSION_CHECK_INTERVAL秒に1回に限る。
+        """
+        now = time.monotonic()
+        if self._version_checked_at and now - self._version_checked_at < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked_at = now
+        version = cache.get(GEOMETRY_VERSION_CACHE_KEY)
+        if version != self._version:
+            with self._lock:
+                self._clear()
+            self._version = version
+
+    def _clear(self):
+        self._departamentos = None
+        self._municipios = None
+        self._national = None
+
+
+def _in_extent(extent, x, y):
+    xmin, ymin, xmax, ymax = extent
+    return xmin <= x <= xmax and ymin <= y <= ymax
+
+
+# プロセス内で共有するインスタンス
+prepared_geometry_store = PreparedGeometryStore()
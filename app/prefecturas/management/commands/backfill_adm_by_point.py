@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from items.models import Item
+from profiles.models import Profile
+from prefecturas.resolver import RegionResolver
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py backfill_adm_by_point
+    python manage.py backfill_adm_by_point --model item --chunk-size 500 --dry-run
+
+    point値を持つItem, Profileオブジェクトのadm1, adm2をpoint値に基づいて修正する。
+    chunk-size件ごとにRegionResolver#resolveManyで1回のクエリで地域を求め、bulk_updateで保存する。
+    adm1, adm2のどちらかが求められないpoint値(Guatemala国外など)の場合は修正しない。
+    """
+
+    help = "point値に基づいてItem, Profileのadm1, adm2を修正する"
+
+    TARGET_MODELS = {
+        "item": Item,
+        "profile": Profile,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=["item", "profile", "all"], default="all")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["model"] == "all":
+            models = list(self.TARGET_MODELS.values())
+        else:
+            models = [self.TARGET_MODELS[options["model"]]]
+
+        for model in models:
+            updated = self.backfill(model, options["chunk_size"], options["dry_run"])
+            self.stdout.write("{} : {}件を修正しました".format(model.__name__, updated))
+
+    def backfill(self, model, chunk_size, dry_run):
+        resolver = RegionResolver()
+        updated = 0
+        last_pk = 0
+        while True:
+            rows = list(
+                model.objects.filter(point__isnull=False, pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", "point", "adm1", "adm2")[:chunk_size]
+            )
+            if len(rows) == 0:
+                return updated
+            last_pk = rows[-1][0]
+
+            # resolveManyが保存されているポリゴンの軸の順序(LAUNCH_ENV)に合わせるので、(経度, 緯度)のまま渡す
+            regions = resolver.resolveMany([(point.x, point.y) for pk, point, adm1, adm2 in rows])
+            objects = []
+            for (pk, point, adm1, adm2), (new_adm1, new_adm2) in zip(rows, regions):
+                if new_adm1 is None or new_adm2 is None:
+                    continue
+                if new_adm1 == adm1 and new_adm2 == adm2:
+                    continue
+                objects.append(model(pk=pk, adm1=new_adm1, adm2=new_adm2))
+
+            if dry_run is False and len(objects) > 0:
+                # bulk_updateはpost_saveシグナルを発火させないのでProfileのシグナル処理は実行されない
+                model.objects.bulk_update(objects, ["adm1", "adm2"])
+            updated += len(objects)
@@ -0,0 +1,150 @@
+import os
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.db import DatabaseError, connection
+from django.db.models import OuterRef, Subquery
+from prefecturas.models import Departamento
+from prefecturas.models import Municipio
+from prefecturas.geometry_store import RegionDataUnavailable, prepared_geometry_store
+
+
+# Departamento, Municipioのポリゴンが緯度と経度を入れ替えて保存されている環境(LAUNCH_ENV)
+# Dockerとそれ以外でGDALの軸の順序の扱いが異なるため(config.utils.wkt2pointの注を参照)
+AXIS_SWAPPED_LAUNCH_ENVS = ("DOCKER", "NO_DOCKER")
+
+
+def isAxisSwapped():
+    return os.environ.get("LAUNCH_ENV", default="NO_DOCKER") in AXIS_SWAPPED_LAUNCH_ENVS
+
+
+def toStoredCoordinates(lng, lat):
+    """機能
+    経度, 緯度を保存されているポリゴンと同じ軸の順序の(x, y)にする。
+
+    Args:
+        lng: 経度
+        lat: 緯度
+    Returns:
+        (x, y): LAUNCH_ENVがAXIS_SWAPPED_LAUNCH_ENVSの場合は(lat, lng)、それ以外は(lng, lat)
+    """
+    if isAxisSwapped():
+        return lat, lng
+    return lng, lat
+
+
+def wktToStoredPoint(wkt):
+    """機能
+    WKT(EWKT)のPOINT("SRID=4326;POINT (経度 緯度)")を、保存されているポリゴンと比較できるPointにする。
+    point-in-polygonの判定(RegionResolver, prepared_geometry_store)に渡す前に必ず通す。
+
+    Returns:
+        GEOSGeometry(Point)
+
+    コピペ
+        point = wktToStoredPoint(request.data["wkt_point"])
+    """
+    point = GEOSGeometry(wkt)
+    if not isAxisSwapped():
+        return point
+    x, y = toStoredCoordinates(point.x, point.y)
+    return Point(x, y)
+
+
+class RegionResolver(object):
+
+    """ *使用方法*
+
+    from prefecturas.resolver import RegionResolver
+
+    adm1, adm2 = RegionResolver().resolve(point)
+
+    pointを含むDepartamento(adm1), Municipio(adm2)を取得する。
+    point-in-polygonの判定はPostGIS側(ST_Contains + geomのGiSTインデックス)で行い、
+    adm1とadm2を1回のクエリで取得する。
+    DBが利用できない場合はprepared geometryによるプロセス内の判定に切り替える。
+    prepared geometryはプロセスの起動時(config/wsgi.py)に別のスレッドで読み込む。
+    読み込まれていない場合(invalidate()の後など)はDBで判定した後に別のスレッドで読み込みを開始する。
+    """
+
+    def resolve(self, point):
+        """
+        Args:
+            point: GEOSGeometry(Point)
+        Returns:
+            (adm1, adm2): 見つからない場合はNone
+        Raises:
+            RegionDataUnavailable: DBが利用できず、prepared geometryも読み込まれていない場合
+        """
+        try:
+            region = self.resolveByDatabase(point)
+        except DatabaseError as error:
+            try:
+                return self.resolveByPreparedGeometry(point)
+            except RegionDataUnavailable:
+                raise RegionDataUnavailable("database is unavailable and prepared geometries are not loaded") from error
+        self.preloadPreparedGeometry()
+        return region
+
+    def preloadPreparedGeometry(self):
+        """
+        DBが利用できなくなった時のフォールバックに備えて、prepared geometryを別のスレッドで読み込む。
+        リクエストの処理は読み込みを待たない。
+        """
+        if prepared_geometry_store.isLoaded():
+            return
+        prepared_geometry_store.loadInBackground()
+
+    def resolveByDatabase(self, point):
+        """
+        ST_Containsはbounding boxによる絞り込み(&&)を内部で行うのでgeomのGiSTインデックスが使われる。
+        Municipioはadm1_pcodeでDepartamentoに紐づく(RegionClassedInstanceMakerと同じ対応関係)。
+        """
+        municipio_qs = Municipio.objects.filter(
+            adm1_pcode=OuterRef("adm1_pcode"),
+            geom__contains=point,
+        ).values("adm2_es")[:1]
+
+        row = Departamento.objects.filter(geom__contains=point).annotate(
+            adm2=Subquery(municipio_qs)
+        ).values_list("adm1_es", "adm2").first()
+
+        if row is None:
+            return None, None
+        return row
+
+    def resolveByPreparedGeometry(self, point):
+        return prepared_geometry_store.findRegion(point)
+
+    def resolveMany(self, coordinates):
+        """機能
+        複数の座標に対応するadm1, adm2をまとめて取得する。
+        座標の配列をunnestしてDepartamento, Municipioと結合するので、座標の数に関わらずクエリは1回である。
+        軸の順序はtoStoredCoordinates()で保存されているポリゴンに合わせる。
+
+        Args:
+            coordinates: [(lng, lat), ...] (経度, 緯度の順)
+        Returns:
+            [(adm1, adm2), ...]: coordinatesと同じ順序。見つからない場合はNone
+        """
+        if len(coordinates) == 0:
+            return []
+
+        stored_coordinates = [toStoredCoordinates(float(lng), float(lat)) for lng, lat in coordinates]
+        xs = [x for x, y in stored_coordinates]
+        ys = [y for x, y in stored_coordinates]
+        sql = """
+            SELECT DISTINCT ON (p.idx) p.idx, d.adm1_es, m.adm2_es
+            FROM unnest(%s::double precision[], %s::double precision[]) WITH ORDINALITY AS p(x, y, idx)
+            LEFT JOIN {departamento} d
+                ON ST_Contains(d.geom, ST_SetSRID(ST_MakePoint(p.x, p.y), 4326))
+            LEFT JOIN {municipio} m
+                ON m.adm1_pcode = d.adm1_pcode
+                AND ST_Contains(m.geom, ST_SetSRID(ST_MakePoint(p.x, p.y), 4326))
+            ORDER BY p.idx
+        """.format(
+            departamento=Departamento._meta.db_table,
+            municipio=Municipio._meta.db_table,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [xs, ys])
+            rows = cursor.fetchall()
+        return [(adm1, adm2) for idx, adm1, adm2 in rows]
@@ -1,3 +1,95 @@
+from unittest import mock
+from django.db import DatabaseError
+from django.contrib.gis.geos import GEOSGeometry
 from django.test import TestCase
+from prefecturas.geometry_store import PreparedGeometryStore, RegionDataUnavailable
+from prefecturas.load import (
+    DepartamentoInstanceMaker,
+    MunicipioInstanceMaker,
+)
+from prefecturas.resolver import RegionResolver
 
-# Create your tests here.
+
+class RegionResolverTest(TestCase):
+    """テスト対象
+    prefecturas/resolver.py RegionResolver#resolve
+    """
+    """テスト項目
+    pointがQuetzaltenango内の場合、adm1, adm2がQuetzaltenangoになる。
+    pointがGuatemala国外の場合、adm1, adm2はNoneになる。
+    DBを使った判定とprepared geometryを使った判定の結果が一致する。
+    DBが利用できない場合はprepared geometryによる判定結果が返る。
+    DBが利用できずprepared geometryも読み込まれていない場合はGuatemala国外(None)ではなくRegionDataUnavailableになる。
+    DBで判定した後はprepared geometryの読み込みを別のスレッドで開始し、リクエストの処理中には読み込まない。
+    loadInBackground()で読み込んだ後はDBが利用できなくてもprepared geometryで判定できる。
+    """
+
+    QUETZALTENANGO = GEOSGeometry("SRID=4326;POINT (-91.51643849909306 14.84320911634316)")
+    TAPACHULA = GEOSGeometry("SRID=4326;POINT (-92.3129813 14.9114382)")
+
+    def setUp(self):
+        DepartamentoInstanceMaker().run()
+        MunicipioInstanceMaker().run()
+
+    def test_pointがQuetzaltenango内の場合_adm1とadm2はQuetzaltenangoになる(self):
+        adm1, adm2 = RegionResolver().resolve(self.QUETZALTENANGO)
+        self.assertEqual(adm1, "Quetzaltenango")
+        self.assertEqual(adm2, "Quetzaltenango")
+
+    def test_pointがGuatemala国外の場合_adm1とadm2はNoneになる(self):
+        self.assertEqual(RegionResolver().resolve(self.TAPACHULA), (None, None))
+
+    def test_DBによる判定とprepared_geometryによる判定の結果が一致する(self):
+        store = PreparedGeometryStore()
+        store.load()
+        for point in (self.QUETZALTENANGO, self.TAPACHULA):
+            self.assertEqual(
+                tuple(RegionResolver().resolveByDatabase(point)),
+                tuple(store.findRegion(point)))
+
+    def test_DBが利用できない場合はprepared_geometryによる判定結果が返る(self):
+        store = PreparedGeometryStore()
+        store.load()
+        with mock.patch.object(RegionResolver, "resolveByDatabase", side_effect=DatabaseError), \
+                mock.patch("prefecturas.resolver.prepared_geometry_store", store):
+            adm1, adm2 = RegionResolver().resolve(self.QUETZALTENANGO)
+        self.assertEqual(adm1, "Quetzaltenango")
+        self.assertEqual(adm2, "Quetzaltenango")
+
+    def test_DBが利用できずprepared_geometryも読み込まれていない場合はRegionDataUnavailableになる(self):
+        store = PreparedGeometryStore()
+        with mock.patch.object(RegionResolver, "resolveByDatabase", side_effect=DatabaseError), \
+                mock.patch("prefecturas.resolver.prepared_geometry_store", store):
+            with self.assertRaises(RegionDataUnavailable):
+                RegionResolver().resolve(self.QUETZALTENANGO)
+
+    def test_DBで判定した後は別のスレッドでprepared_geometryの読み込みを開始する(self):
+        store = PreparedGeometryStore()
+        with mock.patch("prefecturas.resolver.prepared_geometry_store", store), \
+                mock.patch.object(store, "loadInBackground") as loadInBackground:
+            RegionResolver().resolve(self.QUETZALTENANGO)
+        loadInBackground.assert_called_once_with()
+        self.assertFalse(store.isLoaded())
+
+    def test_loadInBackgroundで読み込んだ後はDBが利用できなくても判定できる(self):
+
+        class ImmediateThread(object):
+            # TestCaseのトランザクション内のデータは別のスレッドの接続から見えないので、同じスレッドで実行する
+            def __init__(self, target, **kwargs):
+                self.target = target
+
+            def start(self):
+                self.target()
+
+        store = PreparedGeometryStore()
+        with mock.patch("prefecturas.geometry_store.threading.Thread", ImmediateThread), \
+                mock.patch("prefecturas.geometry_store.connection") as thread_connection:
+            self.assertTrue(store.loadInBackground())
+        self.assertTrue(store.isLoaded())
+        # 読み込まれた後は再び読み込まない
+        self.assertFalse(store.loadInBackground())
+        thread_connection.close.assert_called_once_with()
+        with mock.patch("prefecturas.resolver.prepared_geometry_store", store), \
+                mock.patch.object(RegionResolver, "resolveByDatabase", side_effect=DatabaseError):
+            adm1, adm2 = RegionResolver().resolve(self.QUETZALTENANGO)
+        self.assertEqual((adm1, adm2), ("Quetzaltenango", "Quetzaltenango"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from profiles.models import rebuildProfileRating
+
+
+class Command(BaseCommand):
+
+    """ *使用方法*
+
+    python manage.py rebuild_profile_rating
+
+    Profile.rating_count, rating_sum, rating_averageをProfile.feedbackから再計算する。
+    rating_countなどを追加する前に作成されたFeedbackがある場合や、管理画面でFeedbackを編集した場合に実行する。
+    全Profileを1回のUPDATEで更新する。
+    """
+
+    help = "Profile.rating_count, rating_sum, rating_averageをfeedbackから再計算する"
+
+    def handle(self, *args, **options):
+        updated = rebuildProfileRating()
+        self.stdout.write("{}件のProfileを更新しました".format(updated))
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Avg, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
 from django.contrib.auth.models import User
 from phonenumber_field.modelfields import PhoneNumberField
 from django.contrib.gis.db import models as geomodels
@@ -36,6 +38,69 @@ class Profile(models.Model):
         default=DEFAULT_PROFILE_IMAGE)
     phonenumber = PhoneNumberField(null=True, blank=True)
     sex = models.IntegerField(choices=SEX_CHOICES, default=0)
+    # 未読のAvisoの数。Avisoの作成、既読、削除時にavisos/models.pyで更新する
+    unread_aviso_count = models.PositiveIntegerField(default=0, editable=False)
+    # 受け取った評価(feedback)の件数、levelの合計と平均。addProfileFeedback()で更新する
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_average = models.FloatField(null=True, blank=True, editable=False)
+
+    # UPDATE文(F式)でのみ更新するカラム。save()ではupdate_fieldsで指定した場合のみ書き込む
+    COUNTER_FIELDS = ("unread_aviso_count", "rating_count", "rating_sum", "rating_average")
 
     def __str__(self):
         return self.user.username
+
+    def save(self, *args, **kwargs):
+        """
+        既存のProfileをupdate_fieldsなしで保存する場合は、COUNTER_FIELDSを除いたフィールドのみを書き込む。
+        プロフィールの編集などで取得してから保存するまでの間にaddUnreadAvisoCount()などで
+        カウンター(評価の集計を含む)が更新されても、メモリ上の古い値で上書きしないようにする。
+        """
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        super().save(*args, **kwargs)
+
+
+def addProfileFeedback(profile_obj, feedback_obj):
+    """機能
+    profile_objのfeedbackにfeedback_objを追加し、rating_count, rating_sum, rating_averageを更新する。
+    評価は1回のUPDATEでDBの値に加算するので、同時に評価された場合も値がずれない。
+
+    Args:
+        profile_obj: 評価されたProfileオブジェクト
+        feedback_obj: 保存済みのFeedbackオブジェクト
+    """
+    level = int(feedback_obj.level)
+    with transaction.atomic():
+        profile_obj.feedback.add(feedback_obj)
+        # UPDATEのSETの式は更新前の値を参照する
+        Profile.objects.filter(id=profile_obj.id).update(
+            rating_count=F("rating_count") + 1,
+            rating_sum=F("rating_sum") + level,
+            rating_average=Cast(F("rating_sum") + level, FloatField()) / (F("rating_count") + 1),
+        )
+
+
+def rebuildProfileRating(profile_objects=None):
+    """機能
+    Profile.feedbackからrating_count, rating_sum, rating_averageを再計算する。
+
+    Args:
+        profile_objects: 再計算するProfileのqueryset。指定しない場合は全Profile
+    Returns:
+        int: 更新したProfileの数
+    """
+    if profile_objects is None:
+        profile_objects = Profile.objects.all()
+    feedback_objects = Profile.feedback.through.objects.filter(profile_id=OuterRef("pk")).order_by().values("profile_id")
+    return profile_objects.update(
+        rating_count=Coalesce(Subquery(
+            feedback_objects.annotate(count=Count("feedback_id")).values("count"), output_field=IntegerField()), 0),
+        rating_sum=Coalesce(Subquery(
+            feedback_objects.annotate(total=Sum("feedback__level")).values("total"), output_field=IntegerField()), 0),
+        rating_average=Subquery(
+            feedback_objects.annotate(average=Avg("feedback__level")).values("average"), output_field=FloatField()),
+    )
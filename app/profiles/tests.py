@@ -170,3 +170,37 @@ class ProfileViewGetTest(TestCase):
 
 
 
+
+
+
+class ProfileSaveCounterFieldsTest(TestCase):
+
+    """テスト対象
+    profiles/models.py Profile.save
+    """
+
+    """テスト項目
+    済 取得してから保存するまでの間にunread_aviso_countが更新されても、save()で古い値に戻らない
+    済 update_fieldsで指定した場合はunread_aviso_countも書き込む
+    """
+
+    def setUp(self):
+        self.user_obj, self.profile_obj = create_user_for_test(create_user_data(prefix_user_emailaddress="access_user"))
+
+    def test_取得後にカウンターが更新されてもsaveで上書きしない(self):
+        from avisos.models import addUnreadAvisoCount
+        profile_obj = Profile.objects.get(id=self.profile_obj.id)
+        addUnreadAvisoCount([profile_obj.id, profile_obj.id], 1)
+
+        profile_obj.description = "編集した説明"
+        profile_obj.save()
+
+        profile_obj = Profile.objects.get(id=self.profile_obj.id)
+        self.assertEqual(profile_obj.description, "編集した説明")
+        self.assertEqual(profile_obj.unread_aviso_count, 2)
+
+    def test_update_fieldsで指定した場合はカウンターも書き込む(self):
+        profile_obj = Profile.objects.get(id=self.profile_obj.id)
+        profile_obj.unread_aviso_count = 5
+        profile_obj.save(update_fields=["unread_aviso_count"])
+        self.assertEqual(Profile.objects.get(id=self.profile_obj.id).unread_aviso_count, 5)
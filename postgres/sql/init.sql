@@ -1 +1,2 @@
-CREATE EXTENSION postgis;
\ No newline at end of file
+CREATE EXTENSION postgis;
+CREATE EXTENSION pg_trgm;